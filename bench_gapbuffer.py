@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for gapbuffer under editor-like workloads, run alongside list,
+array.array, and bytearray baselines. Results are written as JSON so they can be
+compared between releases. Run `python bench_gapbuffer.py --help` for options.
+"""
+
+import argparse
+import array
+import json
+import platform
+import random
+import sys
+import timeit
+
+from gapbuffer import gapbuffer, piecetable
+
+# buffer sizes (in items) to run each workload at by default
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+
+# workloads that run at more sizes by default. the far jump keeps going up to
+# sizes where moving the gap across the buffer dominates its cost.
+WORKLOAD_SIZES = {
+    "far_jump": SIZES + [10 ** 6],
+}
+
+# typecodes to run each workload with by default
+TYPECODES = ["c", "u", "i"]
+
+# the text every text buffer is built from, repeated to the desired size
+TEXT = "the quick brown fox jumps over the lazy dog\n"
+
+def make_content(typecode, size):
+    """Return 'size' items of benchmark content for the given typecode."""
+
+    if typecode == "c":
+        return (TEXT * (size // len(TEXT) + 1))[:size]
+    elif typecode == "u":
+        return unicode(TEXT * (size // len(TEXT) + 1))[:size]
+
+    return [i % 100 for i in xrange(size)]
+
+def make_item(typecode):
+    """Return an item to insert that never occurs in the benchmark content."""
+
+    if typecode == "c":
+        return "#"
+    elif typecode == "u":
+        return u"#"
+
+    return 100
+
+# the implementations under test. each maps a name to a tuple of (the typecodes
+# it supports or None for all, a function creating a sequence from a typecode
+# and content, a function converting content to a block for slice assignment).
+IMPLEMENTATIONS = {
+    "gapbuffer": (None,
+        lambda typecode, content: gapbuffer(typecode, content),
+        lambda typecode, content: array.array(typecode, content)),
+    "piecetable": (None,
+        lambda typecode, content: piecetable(typecode, content),
+        lambda typecode, content: array.array(typecode, content)),
+    "list": (None,
+        lambda typecode, content: list(content),
+        lambda typecode, content: list(content)),
+    "array": (None,
+        lambda typecode, content: array.array(typecode, content),
+        lambda typecode, content: array.array(typecode, content)),
+    "bytearray": (["c"],
+        lambda typecode, content: bytearray(content),
+        lambda typecode, content: content),
+}
+
+def workload_typing(seq, typecode, block, rng):
+    """Type 1000 items one at a time at a cursor in the middle of the buffer."""
+
+    item = make_item(typecode)
+    cursor = len(seq) // 2
+
+    def run():
+        for i in xrange(cursor, cursor + 1000):
+            seq.insert(i, item)
+
+    return run, 1000
+
+def workload_random_jumps(seq, typecode, block, rng):
+    """Insert single items at 200 random positions."""
+
+    item = make_item(typecode)
+    positions = [rng.randint(0, len(seq)) for i in xrange(200)]
+
+    def run():
+        for position in positions:
+            seq.insert(position, item)
+
+    return run, len(positions)
+
+def workload_far_jump(seq, typecode, block, rng):
+    """Alternate single-item inserts at the start and end of the buffer."""
+
+    item = make_item(typecode)
+
+    def run():
+        for i in xrange(50):
+            seq.insert(0, item)
+            seq.insert(len(seq), item)
+
+    return run, 100
+
+def workload_paste_delete(seq, typecode, block, rng):
+    """Paste a block a tenth the size of the buffer into it, then delete it."""
+
+    position = len(seq) // 3
+    pasted = block(typecode, make_content(typecode, max(1, len(seq) // 10)))
+
+    def run():
+        seq[position:position] = pasted
+        del seq[position:position + len(pasted)]
+
+    return run, 2
+
+def workload_search(seq, typecode, block, rng):
+    """Test membership of a missing item and count a present one."""
+
+    missing = make_item(typecode)
+    present = make_content(typecode, 1)[0]
+
+    def run():
+        for i in xrange(10):
+            missing in seq
+            seq.count(present)
+
+    return run, 20
+
+def workload_slice(seq, typecode, block, rng):
+    """Read 100 slices of up to 1024 items at random offsets."""
+
+    offsets = [rng.randint(0, len(seq)) for i in xrange(100)]
+
+    def run():
+        for offset in offsets:
+            seq[offset:offset + 1024]
+
+    return run, len(offsets)
+
+def workload_iterate(seq, typecode, block, rng):
+    """Iterate over every item in the buffer."""
+
+    def run():
+        for item in seq:
+            pass
+
+    return run, 1
+
+WORKLOADS = {
+    "typing": workload_typing,
+    "random_jumps": workload_random_jumps,
+    "far_jump": workload_far_jump,
+    "paste_delete": workload_paste_delete,
+    "search": workload_search,
+    "slice": workload_slice,
+    "iterate": workload_iterate,
+}
+
+def bench(workload, implementation, typecode, size, repeat):
+    """
+    Run a workload against an implementation 'repeat' times, each time on a
+    fresh sequence, and return the fastest run's time in seconds along with
+    the number of operations the workload performs.
+    """
+
+    typecodes, factory, block = IMPLEMENTATIONS[implementation]
+    content = make_content(typecode, size)
+
+    best = None
+    for i in xrange(repeat):
+        # use the same random positions for every implementation
+        rng = random.Random(size)
+        run, ops = WORKLOADS[workload](
+                factory(typecode, content), typecode, block, rng)
+
+        start = timeit.default_timer()
+        run()
+        elapsed = timeit.default_timer() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, ops
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes", type=int, nargs="+",
+            help="buffer sizes to run each workload at (default %s, and %s for "
+            "the far jump)" % (SIZES, WORKLOAD_SIZES["far_jump"]))
+    parser.add_argument("--typecodes", nargs="+", default=TYPECODES,
+            help="typecodes to run each workload with")
+    parser.add_argument("--workloads", nargs="+", default=sorted(WORKLOADS),
+            choices=sorted(WORKLOADS), help="workloads to run")
+    parser.add_argument("--implementations", nargs="+",
+            default=sorted(IMPLEMENTATIONS), choices=sorted(IMPLEMENTATIONS),
+            help="implementations to run each workload against")
+    parser.add_argument("--repeat", type=int, default=3,
+            help="number of runs to take the fastest time from")
+    parser.add_argument("--output", type=argparse.FileType("w"),
+            default=sys.stdout, help="file to write JSON results to")
+    args = parser.parse_args(argv)
+
+    results = []
+    for workload in args.workloads:
+        for typecode in args.typecodes:
+            for size in args.sizes or WORKLOAD_SIZES.get(workload, SIZES):
+                for implementation in args.implementations:
+                    # skip baselines that can't hold this type of item
+                    typecodes = IMPLEMENTATIONS[implementation][0]
+                    if typecodes is not None and typecode not in typecodes:
+                        continue
+
+                    seconds, ops = bench(workload, implementation, typecode,
+                            size, args.repeat)
+                    results.append({
+                        "workload": workload,
+                        "implementation": implementation,
+                        "typecode": typecode,
+                        "size": size,
+                        "ops": ops,
+                        "seconds": seconds,
+                        "seconds_per_op": seconds / ops,
+                    })
+
+    json.dump({
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": args.repeat,
+        "results": results,
+    }, args.output, indent=2, sort_keys=True)
+    args.output.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,532 @@
+import abc
 import array
+import bisect
+import contextlib
+import functools
 import itertools
+import math
+import mmap
+import os
 import re
+import timeit
+import weakref
 
-class gapbuffer(object):
+# NumPy is optional, and only used to speed up some numeric operations
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class growthpolicy(object):
     """
-    Represents a sequence of identically-typed primitive items using a gap
-    buffer. Can be initialized with any iterable item, as long as the items in
-    the iterable are all of the same type. Uses an array.array internally to
-    store data.
+    Describes how a gapbuffer sizes its gap when it must grow to fit new items,
+    and when it gives memory back after items are removed.
     """
 
-    # type information for the different types our internal array can take on.
-    # used to initialize the internal array to some non-zero size and to get
-    # formal names for the type codes.
-    TYPE_CODES = {
-        "c": (str(' '), "character"),
-        "b": (0, "signed character"),
-        "B": (0, "unsigned character"),
-        "u": (unicode(' '), "unicode character"),
-        "h": (0, "signed short"),
-        "H": (0, "unsigned short"),
-        "i": (0, "signed int"),
-        "I": (0L, "unsigned int"),
-        "l": (0L, "signed long"),
-        "L": (0L, "unsigned long"),
-        "f": (0.0, "float"),
-        "d": (0.0, "double")
-    }
+    def __init__(self, factor=(1.0 / 16), min_gap=None, max_gap=None,
+            shrink_threshold=None):
+        """
+        Create a growth policy. When the gap is too small for an insertion, it
+        is grown to fit the new items plus 'factor' times the length of the
+        buffer's content (default 1/16), so that repeated insertions take
+        amortized constant time. The extra space is at least 'min_gap' items
+        (default the buffer's own gap_size) and at most 'max_gap' items (default
+        unlimited). If 'shrink_threshold' is given, the gap is trimmed back to
+        the minimum gap whenever a deletion leaves it larger than that many
+        items (default never).
+        """
 
-    def __init__(self, typecode, initial_content=[], gap_size=100):
+        # prevent decreasing or failure to increase buffer size
+        assert factor >= 0
+
+        self.factor = factor
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.shrink_threshold = shrink_threshold
+
+    def grow(self, needed, length, gap_size):
         """
-        Create a gapbuffer. typecode is the type of content the gapbuffer will
-        contain (see the keys of the TYPE_CODES dictionary on the class for
-        valid type codes). initial_content is the content to use when
-        initializing the gapbuffer for the first time (empty by default).
-        gap_size is the default size of the gap to use. A larger gap_size means
-        more items can be inserted without resizing the underlying array, but
-        the gapbuffer will use more memory than if the gap was smaller (default
-        100).
+        Return the new size of a gap that must hold 'needed' items in a buffer
+        with 'length' items of content and a default gap size of 'gap_size'.
         """
 
-        # minimum space to create for the new gap when resizing the current one
-        self.gap_size = gap_size
+        min_gap = gap_size if self.min_gap is None else self.min_gap
 
-        # allocate the initial gap for the internal buffer. if the typecode is
-        # invalid, array.array throws a nice ValueError for us.
-        item = gapbuffer.TYPE_CODES[typecode][0]
-        self.__buf = array.array(typecode, (item for i in xrange(gap_size)))
+        extra = max(min_gap, int(self.factor * length))
+        if self.max_gap is not None:
+            extra = min(extra, self.max_gap)
 
-        # first space of the gap, initially always at the start of the buffer
-        self.__gap_start = 0
+        return needed + extra
 
-        # first space after the final space in the gap, even if past the end of
-        # the internal buffer. since our buffer is (at the moment) all-gap, it
-        # starts as the length of the buffer.
-        self.__gap_end = len(self.__buf)
+    def shrink(self, gap_len, gap_size):
+        """
+        Return the size a gap of 'gap_len' items should be trimmed to after a
+        deletion, or None if it should be left alone.
+        """
 
-        # add the initial content (defaults to an empty iterable)
+        if self.shrink_threshold is None or gap_len <= self.shrink_threshold:
+            return None
+
+        return gap_size if self.min_gap is None else self.min_gap
+
+class editjournal(object):
+    """
+    Records the edits made to a gapbuffer as (start index, removed items,
+    inserted items) triples so they can be undone and redone. Edits are kept in
+    groups, each of which is undone and redone as a whole. The memory used is
+    proportional to the size of the edits, not to the size of the buffer.
+    """
+
+    def __init__(self, limit=None):
+        """
+        Create an edit journal. limit is the maximum number of removed and
+        inserted items to keep across all recorded edits, after which the
+        oldest groups of edits are forgotten (default None, for no limit).
+        """
+
+        self.limit = limit
+
+        # stacks of groups of edits, most recent last
+        self.__undo = []
+        self.__redo = []
+
+        # the number of items held by all the edits in both stacks
+        self.__size = 0
+
+        # how deeply nested the current group is, and whether a group has been
+        # started on the undo stack for it yet.
+        self.__depth = 0
+        self.__group_open = False
+
+    @property
+    def undo_count(self):
+        """The number of groups of edits that can be undone."""
+        return len(self.__undo)
+
+    @property
+    def redo_count(self):
+        """The number of groups of edits that can be redone."""
+        return len(self.__redo)
+
+    def begin_group(self):
+        """Start grouping edits together until the matching end_group()."""
+        self.__depth += 1
+
+    def end_group(self):
+        """End the group started by the matching begin_group()."""
+
+        assert self.__depth > 0
+        self.__depth -= 1
+
+        if self.__depth == 0:
+            self.__group_open = False
+
+    def clear(self):
+        """Forget all recorded edits."""
+
+        self.__undo = []
+        self.__redo = []
+        self.__size = 0
+        self.__group_open = False
+
+    def record(self, start, removed, inserted):
+        """
+        Record that the 'removed' array.array of items at the start index was
+        replaced by the 'inserted' one. Recording an edit forgets any edits that
+        could have been redone.
+        """
+
+        # copy the inserted items, since we don't own them
+        edit = (start, removed, inserted[:])
+
+        for group in self.__redo:
+            self.__size -= self.__group_size(group)
+        self.__redo = []
+
+        if self.__group_open:
+            group = self.__undo[-1]
+
+            # merge runs of typing into a single edit
+            last_start, last_removed, last_inserted = group[-1]
+            if (len(removed) == 0 and len(last_removed) == 0 and
+                    start == last_start + len(last_inserted)):
+                last_inserted.extend(inserted)
+            else:
+                group.append(edit)
+        else:
+            self.__undo.append([edit])
+            self.__group_open = self.__depth > 0
+
+        self.__size += len(removed) + len(inserted)
+        self.__enforce_limit()
+
+    def pop_undo(self):
+        """Remove and return the most recent group of edits, or None."""
+        return self.__pop(self.__undo)
+
+    def pop_redo(self):
+        """Remove and return the most recently undone group of edits, or None."""
+        return self.__pop(self.__redo)
+
+    def push_undo(self, group):
+        """Add a redone group of edits back onto the undo stack."""
+        self.__push(self.__undo, group)
+
+    def push_redo(self, group):
+        """Add an undone group of edits onto the redo stack."""
+        self.__push(self.__redo, group)
+
+    def __pop(self, stack):
+        """Remove and return the top group of edits from a stack, or None."""
+
+        if len(stack) == 0:
+            return None
+
+        # never add to a group once it has left the undo stack
+        self.__group_open = False
+
+        group = stack.pop()
+        self.__size -= self.__group_size(group)
+        return group
+
+    def __push(self, stack, group):
+        """Add a group of edits to the top of a stack."""
+
+        stack.append(group)
+        self.__size += self.__group_size(group)
+        self.__enforce_limit()
+
+    def __group_size(self, group):
+        """Return the number of items held by a group of edits."""
+        return sum(len(removed) + len(inserted)
+                for start, removed, inserted in group)
+
+    def __enforce_limit(self):
+        """Forget the oldest groups of edits until we're within our limit."""
+
+        if self.limit is None:
+            return
+
+        # forget the oldest undoable edits first, then the furthest redoable ones
+        for stack in [self.__undo, self.__redo]:
+            while self.__size > self.limit and len(stack) > 0:
+                self.__size -= self.__group_size(stack.pop(0))
+
+                if stack is self.__undo and len(stack) == 0:
+                    self.__group_open = False
+
+class bufferstats(object):
+    """
+    Counts the internal work done by the gapbuffers it's given to, to help
+    explain why some edits are slow. One bufferstats may be shared by many
+    gapbuffers to total their work.
+    """
+
+    # the names of the counters, in the order as_dict() reports them
+    COUNTERS = [
+        # times the gap was moved, and the total number of items it moved by
+        "gap_moves",
+        "gap_move_distance",
+
+        # items copied within the internal array by gap moves and resizes
+        "items_copied",
+
+        # times the internal array was resized, and the bytes it grew by
+        "resizes",
+        "bytes_allocated",
+
+        # times the gap was removed to give a context the raw internal array
+        "collapses",
+
+        # regular expression searches of the content, which back find(),
+        # rfind(), search(), finditer(), and string counts and membership tests.
+        "searches",
+    ]
+
+    def __init__(self):
+        """Create a bufferstats with all of its counters at zero."""
+        self.reset()
+
+    def reset(self):
+        """Set all the counters back to zero."""
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        """Return a dictionary mapping each counter's name to its value."""
+        return dict((name, getattr(self, name)) for name in self.COUNTERS)
+
+    def __repr__(self):
+        return (self.__class__.__name__ + "(" + ", ".join(name + "=" +
+                repr(getattr(self, name)) for name in self.COUNTERS) + ")")
+
+class bufferprofiler(object):
+    """
+    Records how long the operations of the gapbuffers it's given to take, along
+    with how far each moved the gap, as histograms with power-of-two buckets.
+    Each operation can also be passed to a sink function as it's recorded, to
+    find which calls cause spikes. One bufferprofiler may be shared by many
+    gapbuffers.
+    """
+
+    # the operations that are profiled
+    METHODS = ["__setitem__", "__delitem__", "insert", "extend", "index",
+            "count", "__contains__"]
+
+    def __init__(self, sink=None, timer=timeit.default_timer):
+        """
+        Create a bufferprofiler. sink is a function to call as sink(method name,
+        seconds taken, buffer length before, gap distance moved) for every
+        operation (default None). timer is the function used to read the time in
+        seconds (default timeit.default_timer).
+        """
+
+        self.sink = sink
+        self.timer = timer
+
+        # whether an operation is being profiled, so that operations called by
+        # other operations aren't counted twice.
+        self.__active = False
+
+        self.reset()
+
+    @staticmethod
+    def bucket(value):
+        """
+        Return the histogram bucket for a non-negative value: the smallest power
+        of two that's at least the value, or 0 for 0.
+        """
+
+        if value <= 0:
+            return 0
+        return 1 << (int(value) - 1).bit_length()
+
+    def reset(self):
+        """Forget all the operations recorded so far."""
+        self.__histograms = {}
+
+    def record(self, method, seconds, size, distance):
+        """
+        Record that an operation on a buffer of some length took some number
+        of seconds and moved the gap some distance, then pass it to the sink.
+        """
+
+        histograms = self.__histograms.setdefault(method,
+                {"latency": {}, "distance": {}})
+
+        # latencies are bucketed in whole microseconds
+        for name, value in [("latency", int(math.ceil(seconds * 1e6))),
+                ("distance", distance)]:
+            bucket = self.bucket(value)
+            histograms[name][bucket] = histograms[name].get(bucket, 0) + 1
+
+        if self.sink is not None:
+            self.sink(method, seconds, size, distance)
+
+    def as_dict(self):
+        """
+        Return a dictionary mapping the name of each recorded operation to a
+        dictionary of its "latency" (in microseconds) and "distance"
+        histograms, each mapping the upper bound of a bucket to its count.
+        """
+
+        return dict((method, dict((name, dict(histogram))
+                for name, histogram in histograms.iteritems()))
+                for method, histograms in self.__histograms.iteritems())
+
+    def _call(self, buf, method, name, args, kwargs):
+        """
+        Call a gapbuffer method on a buffer with some arguments, recording the
+        call under the given name unless it was made by another recorded call.
+        """
+
+        if self.__active:
+            return method(buf, *args, **kwargs)
+
+        stats = buf.stats
+        size = len(buf)
+        distance = stats.gap_move_distance
+
+        self.__active = True
+        start = self.timer()
         try:
-            # add the initial content to the end of the buffer
-            self.__buf.extend(initial_content)
+            return method(buf, *args, **kwargs)
+        finally:
+            seconds = self.timer() - start
+            self.__active = False
 
-        except TypeError:
-            # map array's TypeError to our own version of the same
-            raise TypeError(self.__class__.__name__ + " items must be of type "
-                    + gapbuffer.TYPE_CODES[typecode][1])
+            self.record(name, seconds, size,
+                    stats.gap_move_distance - distance)
 
-        # the space immediately following the final item in the buffer,
-        # including space for the gap. i.e., if the gap is at the very end of
-        # the buffer, the content end is equivalent to the gap end.
-        self.__content_end = len(self.__buf)
+class marker(object):
+    """
+    A position in a gapbuffer, as returned by its add_marker() method, that the
+    buffer keeps up to date as it's edited. Markers sit between items. A marker
+    inside a range that's replaced or deleted moves to the start of the range if
+    its gravity is "left", or to the end of whatever replaced the range if its
+    gravity is "right". Text inserted exactly at a marker is likewise inserted
+    after a left gravity marker and before a right gravity one.
+    """
+
+    GRAVITIES = ["left", "right"]
+
+    def __init__(self, gravity="left"):
+        if gravity not in marker.GRAVITIES:
+            raise ValueError("gravity must be one of " +
+                    ", ".join(marker.GRAVITIES))
+
+        self.__gravity = gravity
+
+        # the index of markers the marker is in, or None once it's removed. the
+        # index encodes the marker's position in its _value and _after fields.
+        self._index = None
+        self._value = 0
+        self._after = False
 
     @property
-    def typecode(self):
-        """The read-only typecode of this gapbuffer."""
-        return self.__buf.typecode
+    def gravity(self):
+        """The read-only gravity of this marker, "left" or "right"."""
+        return self.__gravity
 
     @property
-    def __gap_len(self):
-        """Get the length of the current gap."""
-        return self.__gap_end - self.__gap_start
+    def position(self):
+        """
+        The index of this marker in its buffer. Setting it moves the marker.
+        Once the marker is removed from its buffer, this is the final position
+        it had.
+        """
+
+        if self._index is None:
+            return self._value
+        return self._index.position(self)
+
+    @position.setter
+    def position(self, index):
+        if self._index is None:
+            raise ValueError("marker has been removed from its buffer")
+
+        markers = self._index
+        markers.remove(self)
+        markers.add(self, index)
+
+    def __repr__(self):
+        return (self.__class__.__name__ + "(position=" + repr(self.position) +
+                ", gravity=" + repr(self.gravity) + ")")
+
+def _profiled(method):
+    """
+    Decorate a gapbuffer method so that each call to it is recorded in the
+    buffer's profiler, if it has one.
+    """
+
+    name = method.__name__
+
+    @functools.wraps(method)
+    def profiled(self, *args, **kwargs):
+        profiler = self.profiler
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        return profiler._call(self, method, name, args, kwargs)
+
+    return profiled
+
+class _basebuffer(object):
+    """
+    The sequence interface shared by gapbuffer and the alternative buffer
+    designs. Subclasses provide the typecode property, __len__(), chunks(),
+    _item(), _copy(), and _replace(), and everything else is built on top of
+    those. Subclasses may override any of the rest to do it more efficiently.
+    """
 
+    __metaclass__ = abc.ABCMeta
+
+    # gapbuffers have no instance dictionary, so neither can we
+    __slots__ = ()
+
+    def __init__(self, typecode):
+        # validate the typecode the same way gapbuffer does
+        if typecode not in gapbuffer.TYPE_CODES:
+            raise ValueError("bad typecode (must be one of " +
+                    ", ".join(sorted(gapbuffer.TYPE_CODES)) + ")")
+
+    @abc.abstractproperty
+    def typecode(self):
+        """The read-only typecode of this buffer."""
+
+    @abc.abstractmethod
     def __len__(self):
         """Get the length of the buffer."""
-        return self.__content_end - self.__gap_len
+
+    @abc.abstractmethod
+    def chunks(self, size=None, reverse=False):
+        """
+        Iterate over the contents of the buffer as a series of array.array
+        chunks of at most 'size' items (default unlimited), raising a
+        ValueError for a size less than 1. If 'reverse' is True, the chunks are
+        yielded from the end of the buffer to the start, and the items in each
+        chunk are reversed as well.
+        """
+
+    @abc.abstractmethod
+    def _item(self, index):
+        """Return the item at a non-negative, in-range index."""
+
+    @abc.abstractmethod
+    def _copy(self, start, stop):
+        """
+        Return the items between non-negative, in-range start and stop indices
+        (where start <= stop) as a new array.array.
+        """
+
+    @abc.abstractmethod
+    def _replace(self, start, stop, items):
+        """
+        Replace the items between non-negative, in-range start and stop indices
+        (where start <= stop) with the items in the array.array 'items', which
+        is never changed afterwards.
+        """
+
+    def snapshot(self):
+        """Return an immutable snapshot of the buffer's current content."""
+        return snapshot(self.typecode, self._copy(0, len(self)))
+
+    def _to_array(self, values):
+        """
+        Return the given values as an array.array of our type, copying them only
+        if necessary.
+        """
+
+        if isinstance(values, array.array) and values.typecode == self.typecode:
+            return values
+
+        try:
+            # array.array() reads any string as the raw bytes of its items, so
+            # only accept text of our own type.
+            text = {"c": str, "u": unicode}.get(self.typecode, ())
+            if isinstance(values, basestring) and not isinstance(values, text):
+                raise TypeError()
+
+            return array.array(self.typecode, values)
+        except (TypeError, ValueError):
+            # map array's errors to our own TypeError
+            raise TypeError(self.__class__.__name__ + " items must be of type "
+                    + gapbuffer.TYPE_CODES[self.typecode][1])
+
+    def _enforce_index(self, *indices):
+        """Ensures the given indices are valid for the current buffer size."""
+        for index in indices:
+            if index >= len(self) or index < -len(self):
+                raise IndexError(self.__class__.__name__ + " index out of range")
+
+    def __iter__(self):
+        """Iterate over the items in the buffer a chunk at a time."""
+        return itertools.chain.from_iterable(
+                self.chunks(gapbuffer.ITER_CHUNK_SIZE))
+
+    def __reversed__(self):
+        """Iterate over the items in the buffer in reverse order."""
+        return itertools.chain.from_iterable(
+                self.chunks(gapbuffer.ITER_CHUNK_SIZE, reverse=True))
 
     def __compare(self, other):
         """
@@ -98,6 +541,11 @@ class gapbuffer(object):
             # we're always greater than non-iterable objects
             return 1
 
+        # compare natively with sequences we can slice into arrays or strings
+        slicer = self.__compare_slicer(other)
+        if slicer is not None:
+            return self.__compare_natively(other, slicer)
+
         # fill value guaranteed to be unique to this fun. call and inaccessible
         fv = object()
         for si, oi in itertools.izip_longest(self, other, fillvalue=fv):
@@ -118,6 +566,57 @@ class gapbuffer(object):
         # we're equal if none of the cases passed (same length, not different)
         return 0
 
+    def __compare_slicer(self, other):
+        """
+        Return a function that takes a start and stop index and returns a copy
+        of that slice of both our content and the other sequence, as a pair of
+        objects that compare natively the same way their items would. Returns
+        None if there's no native way to compare with the other sequence.
+        """
+
+        if isinstance(other, _basebuffer):
+            copy = other._copy
+        elif isinstance(other, array.array):
+            copy = lambda start, stop: other[start:stop]
+        elif self.typecode == "c" and isinstance(other, str):
+            return lambda start, stop: (self._copy(start, stop).tostring(),
+                    other[start:stop])
+        elif self.typecode == "u" and isinstance(other, unicode):
+            return lambda start, stop: (self._copy(start, stop).tounicode(),
+                    other[start:stop])
+        else:
+            return None
+
+        # text compares much faster as strings than as arrays of characters
+        if self.typecode == other.typecode == "c":
+            return lambda start, stop: (self._copy(start, stop).tostring(),
+                    copy(start, stop).tostring())
+        elif self.typecode == other.typecode == "u":
+            return lambda start, stop: (self._copy(start, stop).tounicode(),
+                    copy(start, stop).tounicode())
+
+        return lambda start, stop: (self._copy(start, stop), copy(start, stop))
+
+    def __compare_natively(self, other, slicer):
+        """
+        Lexicographically compare with another sequence as __compare() does,
+        but a chunk at a time using a slicer from __compare_slicer().
+        """
+
+        # compare the chunks the two sequences share. for chunks of the same
+        # length, the first differing item decides their order, just as it does
+        # for the sequences as a whole.
+        length = min(len(self), len(other))
+        for start in xrange(0, length, gapbuffer.ITER_CHUNK_SIZE):
+            ours, theirs = slicer(start, min(start + gapbuffer.ITER_CHUNK_SIZE,
+                    length))
+
+            if ours != theirs:
+                return -1 if ours < theirs else 1
+
+        # otherwise the shorter sequence comes first
+        return cmp(len(self), len(other))
+
     def __eq__(self, other):
         """Determine whether this is item-equivalent to another iterable."""
 
@@ -127,6 +626,26 @@ class gapbuffer(object):
 
         return self.__compare(other) == 0
 
+    def __ne__(self, other):
+        """Determine whether this differs from another iterable."""
+        return not self == other
+
+    def __lt__(self, other):
+        """Determine whether this is lexicographically less than another."""
+        return self.__compare(other) < 0
+
+    def __le__(self, other):
+        """Determine whether this is lexicographically at most another."""
+        return self.__compare(other) <= 0
+
+    def __gt__(self, other):
+        """Determine whether this is lexicographically greater than another."""
+        return self.__compare(other) > 0
+
+    def __ge__(self, other):
+        """Determine whether this is lexicographically at least another."""
+        return self.__compare(other) >= 0
+
     def __cmp__(self, other):
         """Lexicographically compares this with another iterable."""
         return self.__compare(other)
@@ -139,17 +658,12 @@ class gapbuffer(object):
 
         # substring test for character and unicode buffers
         if self.typecode in ["u", "c"] and isinstance(value, basestring):
-            # search the gap-less version of our underlying buffer
-            with self as buf:
-                # escape the given string and return whether a result was found
-                return re.search(re.escape(value), buf) is not None
+            return self.find(value) != -1
 
-        # general test for membership, including single-character string values
-        for item in self:
-            if value == item:
-                return True
-
-        return False
+        # general test for membership, including single-character string values,
+        # done natively by the arrays of each chunk of content.
+        return any(value in chunk
+                for chunk in self.chunks(gapbuffer.ITER_CHUNK_SIZE))
 
     def __add__(self, other):
         """
@@ -157,7 +671,7 @@ class gapbuffer(object):
         new buffer.
         """
 
-        added = gapbuffer(self.typecode, self)
+        added = self.__class__(self.typecode, self)
         added.extend(other)
 
         return added
@@ -173,14 +687,9 @@ class gapbuffer(object):
         result as a new buffer.
         """
 
-        multiplied = gapbuffer(self.typecode)
-
-        # don't concatenate if 0 or less was specified
-        if n > 0:
-            for i in xrange(n):
-                multiplied.extend(self)
-
-        return multiplied
+        # repeat our content natively, allocating the result all at once
+        return self.__class__(self.typecode,
+                self._copy(0, len(self)) * max(0, n))
 
     def __imul__(self, n):
         """Concatenate ourself to ourself some number of times in-place."""
@@ -188,375 +697,415 @@ class gapbuffer(object):
         # clear the buffer if 0 or less was specified
         if n <= 0:
             del self[:]
-        else:
-            for i in xrange(n - 1):
-                self.extend(self)
+        elif n > 1:
+            # append all the copies in one go
+            end = len(self)
+            self._replace(end, end, self._copy(0, end) * (n - 1))
 
         return self
 
-    def __enforce_index(self, *indices):
-        """Ensures the given indices are valid for the current buffer size."""
-        for index in indices:
-            if index >= len(self) or index < -len(self):
-                raise IndexError(self.__class__.__name__ + " index out of range")
-
     def __getitem__(self, x):
         """Get the item or slice at the given index."""
 
-        # handle slicing with a 'step' (normal format is handled by __getslice__)
         if isinstance(x, slice):
-            return self.__get_slice(x)
-        return self.__get_index(x)
-
-    def __get_index(self, i):
-        """Get the item at some index."""
-
-        # constrain index bounds
-        self.__enforce_index(i)
+            start, stop, step = x.indices(len(self))
 
-        # if before the gap, access buffer directly, else account for gap
-        index = i if i < self.__gap_start else i + self.__gap_len
-        return self.__buf[index]
+            if step == 1:
+                items = self._copy(start, max(start, stop))
+            else:
+                indices = xrange(start, stop, step)
+                if len(indices) == 0:
+                    items = array.array(self.typecode)
+                else:
+                    # stride over a copy of the range the slice covers
+                    low = min(indices[0], indices[-1])
+                    high = max(indices[0], indices[-1]) + 1
+                    items = self._copy(low, high)[start - low:
+                            stop - low if stop - low >= 0 else None:step]
 
-    def __get_slice(self, s):
-        """Get the sequence at the given slice."""
+            return self.__class__(self.typecode, items)
 
-        # unpack 'indices()' into xrange as a generator for our items
-        return gapbuffer(self.typecode,
-                (self[i] for i in xrange(*s.indices(len(self)))))
+        self._enforce_index(x)
+        return self._item(x + len(self) if x < 0 else x)
 
     def __setitem__(self, x, value):
         """Set an index or slice to some value."""
 
         if isinstance(x, slice):
-            return self.__set_slice(x, value)
-        return self.__set_index(x, value)
+            items = self._to_array(value)
+            start, stop, step = x.indices(len(self))
+
+            # extended slices are the same size as what they replace
+            if step != 1:
+                xr = xrange(start, stop, step)
+                if len(items) != len(xr):
+                    raise ValueError("attempt to assign sequence of size " +
+                            str(len(items)) + " to extended slice of size " +
+                            str(len(xr)))
+
+                for i, v in itertools.izip(xr, items):
+                    self._replace(i, i + 1, array.array(self.typecode, [v]))
+            else:
+                self._replace(start, max(start, stop), items)
+        else:
+            self._enforce_index(x)
+            x = x + len(self) if x < 0 else x
+            self._replace(x, x + 1, self._to_array([value]))
 
-    def __set_index(self, i, value):
-        """Set the item at some index."""
+    def __delitem__(self, x):
+        """Delete some index or slice."""
 
-        self.__enforce_index(i)
+        empty = array.array(self.typecode)
+        if isinstance(x, slice):
+            start, stop, step = x.indices(len(self))
+
+            if step != 1:
+                # delete from the end of the buffer so indices stay valid
+                for i in sorted(xrange(start, stop, step), reverse=True):
+                    self._replace(i, i + 1, empty)
+            elif stop > start:
+                self._replace(start, stop, empty)
+        else:
+            self._enforce_index(x)
+            x = x + len(self) if x < 0 else x
+            self._replace(x, x + 1, empty)
 
-        index = i if i < self.__gap_start else i + self.__gap_len
-        self.__buf[index] = value
+    def __enter__(self):
+        """
+        Return a raw array.array holding a copy of the buffer's content. Any
+        changes made to it are copied back into the buffer when the context
+        exits.
+        """
 
-    def __set_slice(self, s, value):
-        """Set the slice at some index."""
+        self.__raw = self._copy(0, len(self))
+        return self.__raw
 
-        # get the length of the value sequence, consuming it if necessary.
-        values = value
-        if not hasattr(value, "__len__"):
-            values = [v for v in value]
+    def __exit__(self, exception_type, exception_value, traceback):
+        """
+        Replace the part of the buffer's content that differs from the raw
+        array with the raw array's items, ignoring errors. A context that
+        changes nothing leaves the buffer alone.
+        """
 
-        # normalize slice indices
-        start, stop, step = s.indices(len(self))
+        raw = self.__raw
+        del self.__raw
 
-        # handle extended slices, which are the same size as what they replace
-        if step != 1:
-            # get our range
-            xr = xrange(start, stop, step)
+        # skip the items at either end that weren't changed
+        shared = min(len(self), len(raw))
+        start = self.__unchanged(raw, shared)
+        end = self.__unchanged(raw, shared - start, reverse=True)
 
-            # enforce range size for extended slices
-            if len(values) != len(xr):
-                raise ValueError("attempt to assign sequence of size " +
-                        str(len(values)) + " to extended slice of size " +
-                        str(len(xr)))
+        if start + end < len(self) or len(raw) != len(self):
+            self._replace(start, len(self) - end, raw[start:len(raw) - end])
 
-            # set the indices in the range to their new values
-            for i, v in itertools.izip(xr, values):
-                self[i] = v
-        else:
-            # move the gap to the start of the slice
-            self.__move_gap(start)
+    def __unchanged(self, raw, limit, reverse=False):
+        """
+        Return the number of items, up to 'limit', at the start (or the end, if
+        'reverse' is True) of our content that equal those in the array 'raw',
+        comparing a chunk at a time.
+        """
 
-            # resize the gap to contain the new values, then delete the old ones
-            self.__resize_gap(len(values))
-            self.__gap_end += stop - start
+        length = len(self)
+        size = gapbuffer.ITER_CHUNK_SIZE
+
+        matched = 0
+        while matched < limit:
+            count = min(size, limit - matched)
+            if reverse:
+                ours = self._copy(length - matched - count, length - matched)
+                theirs = raw[len(raw) - matched - count:len(raw) - matched]
+                ours.reverse()
+                theirs.reverse()
+            else:
+                ours = self._copy(matched, matched + count)
+                theirs = raw[matched:matched + count]
 
-            # replace old values with the new ones
-            for v in values:
-                # add the next value and bump up the gap pointer as we go
-                self.__buf[self.__gap_start] = v
-                self.__gap_start += 1
+            # find the first difference within the chunk
+            if ours != theirs:
+                for i, (a, b) in enumerate(itertools.izip(ours, theirs)):
+                    if a != b:
+                        return matched + i
 
-    def __delitem__(self, x):
-        """Delete some index or slice."""
+            matched += count
 
-        if isinstance(x, slice):
-            return self.__del_slice(x)
-        return self.__del_index(x)
+        return matched
 
-    def __del_index(self, i):
-        """Delete the item at some index."""
+    def index(self, item, start=0, end=None):
+        """
+        Return the index of the first occurence of 'item' in this buffer from
+        the slice between the optional start (default 0) and end (default end of
+        buffer) values.
+        """
 
-        self.__enforce_index(i)
+        start, end, step = slice(start, end).indices(len(self))
 
-        # move the gap to the given index
-        self.__move_gap(i)
+        # search a bounded chunk of the range at a time with array.index()
+        for chunk_start in xrange(start, end, gapbuffer.ITER_CHUNK_SIZE):
+            chunk = self._copy(chunk_start,
+                    min(chunk_start + gapbuffer.ITER_CHUNK_SIZE, end))
+            try:
+                return chunk_start + chunk.index(item)
+            except ValueError:
+                pass
 
-        # 'delete' the index by causing the gap to consume the index
-        self.__gap_end += 1
+        # signal failure if we couldn't find anything
+        raise ValueError(self.__class__.__name__ +
+                ".index(x): x is not in " + self.__class__.__name__)
 
-    def __del_slice(self, s):
-        """Delete some slice."""
+    def count(self, item):
+        """Return the number of times 'item' occurs in this buffer."""
 
-        # get the range we'll be manipulating
-        start, stop, step = s.indices(len(self))
-        xr = xrange(start, stop, step)
+        # count non-overlapping occurences of strings in text buffers
+        if self.typecode in ["u", "c"] and isinstance(item, basestring):
+            matches = self.finditer(re.escape(item),
+                    window=max(0, len(item) - 1))
+            return sum(1 for match in matches)
 
-        # handle extended slices
-        if step != 1:
-            # delete every item in the slice range
-            for count, index in enumerate(xr):
-                # account for already deleted indices
-                del self[index - count]
-        else:
-            # don't do anything if there was no gap given
-            if len(xr) > 0:
-                # move the gap to the start and expand to cover the range
-                self.__move_gap(start)
-                self.__gap_end += len(xr)
+        # handle other types natively, a chunk of content at a time
+        return sum(chunk.count(item)
+                for chunk in self.chunks(gapbuffer.ITER_CHUNK_SIZE))
 
-    def __enter__(self):
+    def find(self, sub, start=0, end=None):
         """
-        Return the raw array.array underlying the buffer, sans gap. This allows
-        for easy manipulation of the underlying data structure without worrying
-        about breaking state in the buffer at large.
+        Return the lowest index in this text buffer where the string 'sub' is
+        found within the slice between the optional start (default 0) and end
+        (default end of buffer) values, or -1 if it isn't found.
         """
 
-        # move the gap to the end of the buffer
-        self.__move_gap(len(self))
+        # like str.find(), nothing is found outside of the range, not even ""
+        if self.__outside_range(start, end):
+            return -1
 
-        # remove the gap. this should just be a pointer update in the C code.
-        del self.__buf[self.__gap_start:]
+        pattern = re.compile(re.escape(sub))
+        span = self.__search(pattern, start, end, max(0, len(sub) - 1))
+        return -1 if span is None else span[0]
 
-        # give the context the raw buffer
-        return self.__buf
+    def rfind(self, sub, start=0, end=None):
+        """
+        Return the highest index in this text buffer where the string 'sub' is
+        found within the slice between the optional start (default 0) and end
+        (default end of buffer) values, or -1 if it isn't found.
+        """
 
-    def __exit__(self, exception_type, exception_value, traceback):
-        """Replace the gap when context exits, ignoring any errors."""
+        # like str.find(), nothing is found outside of the range, not even ""
+        if self.__outside_range(start, end):
+            return -1
 
-        # add a new gap at the end of the buffer
-        item = gapbuffer.TYPE_CODES[self.typecode][0]
-        self.__buf.extend(item for i in xrange(self.gap_size))
+        # a zero-width lookahead lets us find overlapping occurences
+        pattern = re.compile("(?=" + re.escape(sub) + ")")
+        span = self.__search(pattern, start, end, max(0, len(sub) - 1),
+                reverse=True)
+        return -1 if span is None else span[0]
 
-        # account for any size change in the buffer
-        self.__content_end = len(self.__buf)
+    def search(self, pattern, start=0, end=None, window=None):
+        """
+        Search this text buffer for the first match of the regular expression
+        'pattern' (a string or compiled pattern) within the slice between the
+        optional start (default 0) and end (default end of buffer) values.
+        Returns the (start, end) indices of the match, or None if there was no
+        match.
+
+        The content is searched a region at a time (in a gapbuffer, the
+        content on either side of the gap is searched in place). Matches near
+        the boundaries between regions are found by searching a copy of the
+        'window' items (default SEARCH_WINDOW) on either side of them, so
+        matches that span a boundary and are longer than 'window', or that
+        rely on lookaround beyond it, may not be found.
+        """
 
-        # move the gap pointers to point at the new gap
-        self.__gap_start = self.__content_end - self.gap_size
-        self.__gap_end = self.__content_end
+        window = gapbuffer.SEARCH_WINDOW if window is None else window
+        return self.__search(re.compile(pattern), start, end, window)
 
-    def index(self, item, start=0, end=None):
+    def finditer(self, pattern, start=0, end=None, window=None):
         """
-        Return the index of the first occurence of 'item' in this gapbuffer from
-        the slice between the optional start (default 0) and end (default end of
-        buffer) values.
+        Iterate over the (start, end) indices of all non-overlapping matches of
+        the regular expression 'pattern' in this text buffer, as search() would
+        find them.
         """
 
-        # set a default for the end
-        end = len(self) if end is None else end
+        window = gapbuffer.SEARCH_WINDOW if window is None else window
+        return self.__matches(re.compile(pattern), start, end, window)
 
-        # only check if we have an increasing, non-empty range
-        if start != end:
-            # return the index for the first matching item
-            for i in xrange(*slice(start, end).indices(len(self))):
-                if self[i] == item:
-                    return i
+    def _search_regions(self, start, end, window, reverse=False):
+        """
+        Yield (string, pos, endpos, offset, limit) tuples describing the regions
+        to search for matches within the content between normalized start and
+        end indices, in order (or in reverse order if 'reverse' is True). Each
+        region is searched from 'pos' to 'endpos' in 'string', where string
+        index i corresponds to content index i - offset. Only matches starting
+        before the content index 'limit' (None for no limit) belong to the
+        region. 'window' is the number of items of context needed on either
+        side of the boundaries between regions.
+
+        Each region is a copy of SEARCH_CHUNK_SIZE items of the content along
+        with 'window' items on either side of them, so that searches never copy
+        the whole content at once. Regions are copied as they're reached, so a
+        search that stops early copies only the chunks it reached, and a scan
+        for every match copies each chunk once.
+        """
 
-        # signal failure if we couldn't find anything
-        raise ValueError(self.__class__.__name__ +
-                ".index(x): x is not in " + self.__class__.__name__)
+        size = gapbuffer.SEARCH_CHUNK_SIZE
 
-    def count(self, item):
-        """Return the number of times 'item' occurs in this gapbuffer."""
+        # an empty range is still searched, for empty matches
+        block_starts = xrange(start, end, size) if end > start else [start]
+        if reverse:
+            block_starts = reversed(block_starts)
 
-        # handle strings specially
-        if self.typecode in ["u", "c"] and isinstance(item, basestring):
-            with self as buf:
-                return len(re.findall(re.escape(item), buf))
-
-        # handle other types normally
-        result = 0
-        for self_item in self:
-            if self_item == item:
-                result += 1
-        return result
+        for block_start in block_starts:
+            block_end = min(end, block_start + size)
+            context_start = max(0, block_start - window)
 
-    def append(self, item):
-        """Append the 'item' to this gapbuffer."""
-        self.insert(len(self), item)
+            items = self._copy(context_start, min(end, block_end + window))
+            limit = None if block_end == end else block_end
+            yield (items, block_start - context_start, len(items),
+                    -context_start, limit)
 
-    def extend(self, other):
+    def __outside_range(self, start, end):
         """
-        Append all the items from the other iterable onto the end of this
-        gapbuffer.
+        Return True if find() and rfind() should find nothing between some
+        start and end, because the start is past the end of the buffer or past
+        the end of the range once both are normalized.
         """
 
-        # append the other iterable's items to the end of the existing raw buffer
-        with self as buf:
-            buf.extend(other)
-
-    def insert(self, index, item):
-        """Insert an item at the given index."""
-        self[index:index] = [item]
-
-    def pop(self, index=None):
-        """Remove the item at 'index' (default final item) and returns it."""
-
-        if len(self) == 0:
-            raise IndexError("pop from empty " + self.__class__.__name__)
-
-        # default index to the end of the buffer
-        index = len(self) - 1 if index is None else index
+        if start > len(self):
+            return True
 
-        item = self[index]
-        del self[index]
-        return item
+        start, end, step = slice(start, end).indices(len(self))
+        return start > end
 
-    def remove(self, item):
-        """Remove the first occurence of 'item' in this gapbuffer."""
-        del self[self.index(item)]
+    def __search_range(self, start, end):
+        """
+        Return the normalized start and end indices of a search, which must be
+        of a text buffer.
+        """
 
-    def reverse(self):
-        """Reverse the items in this gapbuffer in-place."""
+        if self.typecode not in ["u", "c"]:
+            raise TypeError(self.__class__.__name__ +
+                    " searches require a 'c' or 'u' typecode")
 
-        # only reverse if necessary
-        if len(self) > 1:
-            for i in xrange(len(self) / 2):
-                self[-(i + 1)], self[i] = self[i], self[-(i + 1)]
+        start, end, step = slice(start, end).indices(len(self))
+        return start, max(start, end)
 
-    def debug_view(self): # pragma: no cover
+    def __search(self, pattern, start, end, window, reverse=False):
         """
-        Get a debug view of the buffer's contents and internal values as a
-        unicode string. Only works for text ('c' or 'u') buffers.
+        Find the first (or last, if 'reverse' is True) match of the compiled
+        'pattern' in the content between start and end, region by region.
+        Returns the match's (start, end) content indices, or None if no match
+        was found.
         """
 
-        # disallow use for non-text buffers
-        if self.typecode not in ['c', 'u']:
-            return "Only works for 'c' and 'u' buffers. got: " + self.typecode
+        if not reverse:
+            return next(self.__matches(pattern, start, end, window), None)
 
-        # write special values into gap
-        for i in xrange(self.__gap_start, self.__gap_end):
-            self.__buf[i] = u"_"
+        start, end = self.__search_range(start, end)
+        for string, pos, endpos, offset, limit in self._search_regions(start,
+                end, window, reverse=True):
+            # keep the last match that starts within the region
+            match = None
+            for candidate in pattern.finditer(string, pos, endpos):
+                if limit is not None and candidate.start() - offset >= limit:
+                    break
+                match = candidate
 
-        # write special values into blank area
-        for i in xrange(self.__content_end, len(self.__buf)):
-            self.__buf[i] = u"#"
+            if match is not None:
+                return match.start() - offset, match.end() - offset
 
-        # our desired display characters and their positions
-        chars = [
-            ("s", self.__gap_start),
-            ("e", self.__gap_end),
-            ("$", self.__content_end)
-        ]
+        return None
 
-        # find the left-most value we'll be displaying
-        max_pos = max(map(lambda t: t[1], chars))
+    def __matches(self, pattern, start, end, window):
+        """
+        Iterate over the (start, end) content indices of the non-overlapping
+        matches of the compiled 'pattern' between start and end, searching each
+        region once as the iteration reaches it.
+        """
 
-        # track all the rows we'll need
-        rows = []
+        start, end = self.__search_range(start, end)
 
-        # add the first row
-        rows.append([None] * (max_pos + 1))
+        # the first content index the next match may start at, so that matches
+        # found in one region don't overlap those found in the one before it.
+        position = start
 
-        # insert all the characters into rows
-        for char, pos in chars:
-            # try all the rows in turn until an empty slot is found
-            for i in xrange(len(chars)):
-                # add more space if we need it
-                if len(rows) == i:
-                    rows.append([None] * (max_pos + 1))
+        for string, pos, endpos, offset, limit in self._search_regions(start,
+                end, window):
+            pos = max(pos, position + offset)
+            if pos > endpos:
+                continue
 
-                # fill the slot if it was empty, then move on
-                if rows[i][pos] is None:
-                    rows[i][pos] = char
+            for match in pattern.finditer(string, pos, endpos):
+                match_start = match.start() - offset
+                if limit is not None and match_start >= limit:
                     break
 
-        # build the final string
-        s = [
-            u"'" + unicode(self) + u"', " + unicode(len(self)),
-            self.__buf.tounicode()
-        ]
-
-        for row in rows:
-            t = []
-            for c in row:
-                t.append(c if c is not None else u" ")
-            s.append(u"".join(t))
+                yield match_start, match.end() - offset
 
-        return u'\n'.join(s)
+                # always make progress, even over empty matches
+                position = match.end() - offset
+                if match.end() == match.start():
+                    position += 1
 
-    def __resize_buf(self, target_size, factor=(1.0 / 16)):
+    def apply_edits(self, edits):
         """
-        Ensure that the buffer is at least as large as some target by repeatedly
-        increasing its size by some factor (default 1/16).
+        Apply a batch of (start, stop, replacement) edits, each replacing the
+        items between the start and stop indices of the current content with
+        the items in the replacement sequence. Edits may be given in any order
+        but mustn't overlap.
         """
 
-        # prevent decreasing or failure to increase buffer size
-        assert factor > 0
-
-        # increase the buffer size by our factor until it's long enough
-        item = gapbuffer.TYPE_CODES[self.typecode][0]
-        while len(self.__buf) < target_size:
-            extend_len = max(1, int((1.0 + factor) * (1 + len(self.__buf))))
-            self.__buf.extend(item for i in xrange(extend_len))
+        edits = _sorted_edits(edits, len(self), self._to_array)
 
-    def __resize_gap(self, target_size):
-        """Ensure that the gap is at least as large as some target."""
+        # apply the edits from the end so the earlier indices stay valid
+        for start, stop, items in reversed(edits):
+            self._replace(start, stop, items)
 
-        if self.__gap_len < target_size:
-            # calculate size increase of the gap, including the min gap size
-            gap_delta = target_size + self.gap_size - self.__gap_len
+    def append(self, item):
+        """Append the 'item' to this buffer."""
+        self.insert(len(self), item)
 
-            # make room for the current content and the new gap
-            self.__resize_buf(len(self.__buf) + gap_delta)
+    def extend(self, other):
+        """
+        Append all the items from the other iterable onto the end of this
+        buffer.
+        """
 
-            # shift the right content down to make room for the new gap
-            for i in reversed(xrange(self.__gap_end, self.__content_end)):
-                self.__buf[i + gap_delta] = self.__buf[i]
+        end = len(self)
+        self._replace(end, end, self._to_array(other))
 
-            # move the gap and content end pointers forward
-            self.__gap_end += gap_delta
-            self.__content_end += gap_delta
+    def insert(self, index, item):
+        """Insert an item at the given index."""
+        self[index:index] = [item]
 
-    def __move_gap(self, index):
-        """Move the gap to some index."""
+    def pop(self, index=None):
+        """Remove the item at 'index' (default final item) and returns it."""
 
-        # don't move the gap if it consists of the entire internal buffer
         if len(self) == 0:
-            return
+            raise IndexError("pop from empty " + self.__class__.__name__)
 
-        # normalize the index to a positive number if negative
-        index = len(self) + index if index < 0 else index
+        # default index to the end of the buffer
+        index = len(self) - 1 if index is None else index
 
-        # make sure we're within virtual buffer bounds. the start of the
-        # gap is always the same as the virtual buffer index, so we must limit
-        # it to this since its end extends to the end of the actual buffer.
-        assert 0 <= index <= len(self)
+        item = self[index]
+        del self[index]
+        return item
 
-        # optimize for moving a zero-length gap (avoids needless copies)
-        if self.__gap_len == 0:
-            self.__gap_start = self.__gap_end = index
-        else:
-            # move the gap left as far as necessary
-            while self.__gap_start > index:
-                # slide the gap to the left
-                self.__gap_start -= 1
-                self.__gap_end -= 1
+    def remove(self, item):
+        """Remove the first occurence of 'item' in this buffer."""
+        del self[self.index(item)]
+
+    def reverse(self):
+        """Reverse the items in this buffer in-place."""
 
-                # copy the gap's former preceding character to the gap's old
-                # final slot.
-                self.__buf[self.__gap_end] = self.__buf[self.__gap_start]
+        items = self._copy(0, len(self))
+        items.reverse()
+        self._replace(0, len(self), items)
 
-            # move the gap right as far as necessary
-            while self.__gap_start < index:
-                # copy the gap's following character to the gap's first slot.
-                self.__buf[self.__gap_start] = self.__buf[self.__gap_end]
+    def __text_chunks(self):
+        """
+        Iterate over the contents of a text ('c' or 'u') buffer as a series of
+        native str or unicode chunks.
+        """
 
-                # slide the gap to the right
-                self.__gap_start += 1
-                self.__gap_end += 1
+        for chunk in self.chunks():
+            yield chunk.tounicode() if self.typecode == "u" else chunk.tostring()
 
     def __str__(self):
         """Return the string representation of the buffer's contents."""
@@ -566,7 +1115,7 @@ class gapbuffer(object):
 
         # do more compact representations for string and unicode types
         if self.typecode in ["u", "c"]:
-            return ''.join(c for c in self)
+            return ''.join(self.__text_chunks())
 
         # turn all other types into a simple list
         return repr([i for i in self])
@@ -575,7 +1124,7 @@ class gapbuffer(object):
         """Return the unicode representation of the buffer's contents."""
 
         if self.typecode in ["u", "c"]:
-            return u''.join(c for c in self)
+            return u''.join(self.__text_chunks())
 
         return unicode(repr([i for i in self]))
 
@@ -589,12 +1138,2875 @@ class gapbuffer(object):
 
             # do more compact represenstations for string and unicode types
             if self.typecode == "c":
-                s += repr(''.join(c for c in self))
+                s += repr(''.join(self.__text_chunks()))
             elif self.typecode == "u":
-                s += repr(u''.join(c for c in self))
+                s += repr(u''.join(self.__text_chunks()))
             else:
                 # turn all other types into a simple list
                 s += repr([i for i in self])
 
         # add close paren and return
         return s + u")"
+
+class gapbuffer(_basebuffer):
+    """
+    Represents a sequence of identically-typed primitive items using a gap
+    buffer. Can be initialized with any iterable item, as long as the items in
+    the iterable are all of the same type. Uses an array.array internally to
+    store data.
+    """
+
+    # type information for the different types our internal array can take on.
+    # used to initialize the internal array to some non-zero size and to get
+    # formal names for the type codes.
+    TYPE_CODES = {
+        "c": (str(' '), "character"),
+        "b": (0, "signed character"),
+        "B": (0, "unsigned character"),
+        "u": (unicode(' '), "unicode character"),
+        "h": (0, "signed short"),
+        "H": (0, "unsigned short"),
+        "i": (0, "signed int"),
+        "I": (0L, "unsigned int"),
+        "l": (0L, "signed long"),
+        "L": (0L, "unsigned long"),
+        "f": (0.0, "float"),
+        "d": (0.0, "double")
+    }
+
+    # the maximum number of items copied out of the internal array at once when
+    # iterating over the buffer. bounds the memory used by iteration while still
+    # letting the array module do the bulk of the work.
+    ITER_CHUNK_SIZE = 4096
+
+    # the number of items on either side of the gap that regular expression
+    # searches stitch together to find matches that span the gap.
+    SEARCH_WINDOW = 1024
+
+    # the number of items buffers without a gap copy out of their content at a
+    # time to search it, not counting the windows on either side.
+    SEARCH_CHUNK_SIZE = 65536
+
+    # the growth policy used by buffers that aren't given one
+    DEFAULT_POLICY = growthpolicy()
+
+    # the number of items load() reads from a file at a time by default
+    LOAD_CHUNK_SIZE = 65536
+
+    # the length of the substrings indexed by build_ngram_index() by default
+    NGRAM_SIZE = 3
+
+    # a shared empty array of each typecode, for replacing items with nothing
+    __EMPTY = dict((typecode, array.array(typecode)) for typecode in TYPE_CODES)
+
+    # the shared operations that are profiled, see _profiled()
+    insert = _profiled(_basebuffer.insert.im_func)
+    extend = _profiled(_basebuffer.extend.im_func)
+
+    # buffers have no instance dictionary, so that applications holding
+    # millions of small ones pay little more than the size of their content.
+    __slots__ = ("gap_size", "policy", "__buf", "__gap_start", "__gap_end",
+            "__content_end", "__lines", "__journal", "__snapshots",
+            "__markers", "__ngrams", "__stats", "__profiler", "__raw_removed",
+            "__in_context", "__weakref__")
+
+    def __init__(self, typecode, initial_content=[], gap_size=100, policy=None,
+            journal=None, stats=None, profiler=None):
+        """
+        Create a gapbuffer. typecode is the type of content the gapbuffer will
+        contain (see the keys of the TYPE_CODES dictionary on the class for
+        valid type codes). initial_content is the content to use when
+        initializing the gapbuffer for the first time (empty by default).
+        gap_size is the default size of the gap to use. A larger gap_size means
+        more items can be inserted without resizing the underlying array, but
+        the gapbuffer will use more memory than if the gap was smaller (default
+        100). No gap is allocated until the first edit other than an append
+        needs one. policy is the growthpolicy that decides how the gap grows and
+        shrinks (default DEFAULT_POLICY). journal is an editjournal to record
+        edits in so they can be undone (default None, for no undo). stats is a
+        bufferstats to count the gapbuffer's internal work in (default None,
+        for no counting). profiler is a bufferprofiler to record the latency of
+        the gapbuffer's operations in (default None, for no profiling), and
+        implies counting in a new bufferstats if stats isn't given.
+        """
+
+        # minimum space to create for the new gap when resizing the current one
+        self.gap_size = gap_size
+
+        # how to size the gap when it must grow or shrink
+        self.policy = gapbuffer.DEFAULT_POLICY if policy is None else policy
+
+        # the internal buffer starts out holding only the content. if the
+        # typecode is invalid, array.array throws a nice ValueError for us.
+        self.__buf = array.array(typecode)
+
+        # add the initial content (defaults to an empty iterable)
+        try:
+            self.__buf.extend(initial_content)
+
+        except TypeError:
+            # map array's TypeError to our own version of the same
+            raise TypeError(self.__class__.__name__ + " items must be of type "
+                    + gapbuffer.TYPE_CODES[typecode][1])
+
+        # the space immediately following the final item in the buffer,
+        # including space for the gap. i.e., if the gap is at the very end of
+        # the buffer, the content end is equivalent to the gap end.
+        self.__content_end = len(self.__buf)
+
+        # first space of the gap, and the first space after its final space.
+        # the gap starts out empty at the start of the buffer, and is only
+        # allocated by the first edit that isn't an append, so buffers that are
+        # never edited that way use no memory for it.
+        self.__gap_start = 0
+        self.__gap_end = 0
+
+        # whether the context manager has handed out the raw buffer, and the
+        # raw content's state when it was entered.
+        self.__in_context = False
+        self.__raw_removed = None
+
+        # the index of newlines in a text buffer, created the first time a line
+        # is looked up and kept up to date from then on.
+        self.__lines = None
+
+        # where edits are recorded for undo, if anywhere. the initial content
+        # isn't an edit, so we only start recording now.
+        self.__journal = journal
+
+        # the snapshots sharing our internal array, created with the first one
+        self.__snapshots = None
+
+        # the index of our markers, created when the first one is added
+        self.__markers = None
+
+        # the optional index of substrings, see build_ngram_index()
+        self.__ngrams = None
+
+        # where our internal work is counted, if anywhere. this is checked
+        # before counting anything, so it costs next to nothing when disabled.
+        self.__stats = stats
+
+        # where the latency of our operations is recorded, if anywhere. the
+        # profiled operations check for it themselves, see _profiled().
+        self.__profiler = profiler
+
+        # the profiler gets the gap distance each operation moves from here
+        if profiler is not None and self.__stats is None:
+            self.__stats = bufferstats()
+
+    @property
+    def typecode(self):
+        """The read-only typecode of this gapbuffer."""
+        return self.__buf.typecode
+
+    @property
+    def stats(self):
+        """The read-only bufferstats counting our work, or None."""
+        return self.__stats
+
+    @property
+    def profiler(self):
+        """The read-only bufferprofiler recording our operations, or None."""
+        return self.__profiler
+
+    def __getstate__(self):
+        """
+        Return our state for pickling, which needs spelling out since we have no
+        __dict__. Only the content is saved, not the gap, and snapshots aren't
+        saved since the content saved is a copy they don't share.
+        """
+
+        return {
+            "gap_size": self.gap_size,
+            "policy": self.policy,
+            "items": self._copy(0, len(self)),
+            "lines": self.__lines,
+            "journal": self.__journal,
+            "markers": self.__markers,
+            "ngrams": self.__ngrams,
+            "stats": self.__stats,
+            "profiler": self.__profiler,
+        }
+
+    def __setstate__(self, state):
+        """Restore our state from __getstate__(), with an empty gap."""
+
+        self.gap_size = state["gap_size"]
+        self.policy = state["policy"]
+
+        # the gap starts out empty, as it does in a new buffer
+        self.__buf = state["items"]
+        self.__content_end = len(self.__buf)
+        self.__gap_start = 0
+        self.__gap_end = 0
+
+        self.__in_context = False
+        self.__raw_removed = None
+        self.__lines = state["lines"]
+        self.__journal = state["journal"]
+        self.__snapshots = None
+        self.__markers = state["markers"]
+        self.__ngrams = state["ngrams"]
+        self.__stats = state["stats"]
+        self.__profiler = state["profiler"]
+
+    @property
+    def __gap_len(self):
+        """Get the length of the current gap."""
+        return self.__gap_end - self.__gap_start
+
+    def __len__(self):
+        """Get the length of the buffer."""
+        return self.__content_end - self.__gap_len
+
+    def chunks(self, size=None, reverse=False):
+        """
+        Iterate over the contents of the buffer as a series of array.array
+        chunks. Chunks never span the gap and are at most 'size' items long
+        (default unlimited, yielding at most one chunk per side of the gap). A
+        size less than 1 raises a ValueError. If 'reverse' is True, the chunks
+        are yielded from the end of the buffer to the start, and the items in
+        each chunk are reversed as well.
+        """
+
+        if size is not None and size < 1:
+            raise ValueError("chunk size must be at least 1")
+
+        # the physical ranges holding our content, in the order they're yielded
+        ranges = [(0, self.__gap_start), (self.__gap_end, self.__content_end)]
+        if reverse:
+            ranges.reverse()
+
+        for range_start, range_end in ranges:
+            step = range_end - range_start if size is None else size
+
+            # walk the range in steps, skipping empty ranges entirely
+            offsets = xrange(range_start, range_end, max(1, step))
+            if reverse:
+                offsets = reversed(offsets)
+
+            for offset in offsets:
+                chunk = self.__buf[offset:min(offset + step, range_end)]
+                if reverse:
+                    chunk.reverse()
+                yield chunk
+
+    @_profiled
+    def __contains__(self, value):
+        """
+        Return True if the given item is contained in the buffer, False
+        otherwise.
+        """
+
+        # vectorized test for numbers in numeric buffers
+        arrays = self.__ndarrays()
+        if arrays is not None and isinstance(value, (int, long, float)):
+            value = self.__ndarray_item(value)
+            return value is not None and any(
+                    bool((a == value).any()) for offset, a in arrays)
+
+        return _basebuffer.__contains__(self, value)
+
+    def __getitem__(self, x):
+        """Get the item or slice at the given index."""
+
+        # handle slicing with a 'step' (normal format is handled by __getslice__)
+        if isinstance(x, slice):
+            return self.__get_slice(x)
+        return self.__get_index(x)
+
+    def __get_index(self, i):
+        """Get the item at some index."""
+
+        # constrain index bounds
+        self._enforce_index(i)
+        return self._item(i + len(self) if i < 0 else i)
+
+    def _item(self, index):
+        """Return the item at a non-negative, in-range index."""
+
+        # if before the gap, access buffer directly, else account for gap
+        return self.__buf[index if index < self.__gap_start else
+                index + self.__gap_len]
+
+    def __get_slice(self, s):
+        """Get the sequence at the given slice."""
+
+        start, stop, step = s.indices(len(self))
+
+        # contiguous slices are at most two slices of the internal array
+        if step == 1:
+            return gapbuffer(self.typecode, self._copy(start, max(start, stop)))
+
+        return gapbuffer(self.typecode, self.__copy_extended(start, stop, step))
+
+    @_profiled
+    def __setitem__(self, x, value):
+        """Set an index or slice to some value."""
+
+        if isinstance(x, slice):
+            return self.__set_slice(x, value)
+        return self.__set_index(x, value)
+
+    def __set_index(self, i, value):
+        """Set the item at some index."""
+
+        self._enforce_index(i)
+        i = i + len(self) if i < 0 else i
+
+        index = i if i < self.__gap_start else i + self.__gap_len
+
+        removed = None
+        if self.__journal is not None:
+            removed = self.__buf[index:index + 1]
+
+        self.__unshare(index, index + 1)
+        self.__buf[index] = value
+        self.__edited(i, 1, value, removed)
+
+    def __set_slice(self, s, value):
+        """Set the slice at some index."""
+
+        # get the length of the value sequence, consuming it if necessary.
+        values = value
+        if not hasattr(value, "__len__"):
+            values = [v for v in value]
+
+        # normalize slice indices
+        start, stop, step = s.indices(len(self))
+
+        # handle extended slices, which are the same size as what they replace
+        if step != 1:
+            # get our range
+            xr = xrange(start, stop, step)
+
+            # enforce range size for extended slices
+            if len(values) != len(xr):
+                raise ValueError("attempt to assign sequence of size " +
+                        str(len(values)) + " to extended slice of size " +
+                        str(len(xr)))
+
+            # set the indices in the range to their new values, undoing them
+            # together if they're journaled.
+            with self.__journal_group():
+                for i, v in itertools.izip(xr, values):
+                    self[i] = v
+        else:
+            # convert the values up front so they can be copied in one go
+            self._replace(start, max(start, stop), self._to_array(values))
+
+    def _replace(self, start, stop, items):
+        """
+        Replace the items between normalized start and stop indices (where
+        start <= stop) with the items in an array.array.
+        """
+
+        # keep a copy of what we're replacing if it's being journaled
+        removed = None
+        if self.__journal is not None:
+            removed = self._copy(start, stop)
+
+        # appending when there's no gap to fill just grows the array, so buffers
+        # that are only appended to never need a gap allocated.
+        if start == len(self) and self.__gap_len == 0 and not self.__snapshots:
+            self.__append(items)
+            self.__edited(start, 0, items, removed)
+            return
+
+        # move the gap to the start of the slice
+        self.__move_gap(start)
+
+        # resize the gap to contain the new values, then delete the old ones
+        self.__resize_gap(len(items))
+        self.__gap_end += stop - start
+
+        # copy the new values into the start of the gap
+        self.__unshare(self.__gap_start, self.__gap_start + len(items))
+        self.__buf[self.__gap_start:self.__gap_start + len(items)] = items
+        self.__gap_start += len(items)
+
+        self.__edited(start, stop - start, items, removed)
+
+        # give back memory if we removed more than we added
+        if stop - start > len(items):
+            self.__shrink_gap()
+
+    @_profiled
+    def __delitem__(self, x):
+        """Delete some index or slice."""
+
+        if isinstance(x, slice):
+            return self.__del_slice(x)
+        return self.__del_index(x)
+
+    def __del_index(self, i):
+        """Delete the item at some index."""
+
+        self._enforce_index(i)
+        i = i + len(self) if i < 0 else i
+
+        # with nothing tracking edits, just move the gap to the index and cause
+        # it to consume the index.
+        if (self.__lines is None and self.__journal is None and
+                self.__markers is None and self.__ngrams is None and
+                not self.__snapshots):
+            self.__move_gap(i)
+            self.__gap_end += 1
+            self.__shrink_gap()
+            return
+
+        # otherwise 'delete' it by replacing it with nothing
+        self._replace(i, i + 1, gapbuffer.__EMPTY[self.typecode])
+
+    def __del_slice(self, s):
+        """Delete some slice."""
+
+        # get the range we'll be manipulating
+        start, stop, step = s.indices(len(self))
+        xr = xrange(start, stop, step)
+
+        # handle extended slices
+        if step != 1:
+            # delete every item in the slice range, starting from the end of the
+            # buffer so the indices still to be deleted stay valid.
+            with self.__journal_group():
+                for index in sorted(xr, reverse=True):
+                    del self[index]
+        else:
+            # don't do anything if there was no gap given
+            if len(xr) > 0:
+                # move the gap to the start and expand to cover the range
+                self._replace(start, stop, gapbuffer.__EMPTY[self.typecode])
+
+    def __enter__(self):
+        """
+        Return the raw array.array underlying the buffer, sans gap. This allows
+        for easy manipulation of the underlying data structure without worrying
+        about breaking state in the buffer at large.
+        """
+
+        # changes to the raw buffer can't be tracked, so drop our line index
+        self.__lines = None
+
+        # and journal the whole content being replaced instead of each change
+        self.__raw_removed = None
+        if self.__journal is not None:
+            self.__raw_removed = self._copy(0, len(self))
+
+        # move the gap to the end of the buffer
+        self.__move_gap(len(self))
+
+        if self.__stats is not None:
+            self.__stats.collapses += 1
+
+        # the raw buffer can be changed in any way, so leave any snapshots with
+        # the current one and work on a copy of it instead.
+        if self.__snapshots:
+            self.__buf = self.__buf[:]
+            self.__snapshots = None
+
+        # remove the gap. this should just be a pointer update in the C code.
+        del self.__buf[self.__gap_start:]
+
+        # give the context the raw buffer
+        self.__in_context = True
+        return self.__buf
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        """Replace the gap when context exits, ignoring any errors."""
+
+        if self.__journal is not None and self.__raw_removed is not None:
+            self.__journal.record(0, self.__raw_removed, self.__buf)
+        self.__raw_removed = None
+        self.__in_context = False
+
+        # add a new gap at the end of the buffer
+        self.__buf.extend(self.__fill(self.gap_size))
+
+        if self.__stats is not None:
+            self.__stats.resizes += 1
+            self.__stats.bytes_allocated += self.gap_size * self.__buf.itemsize
+
+        # account for any size change in the buffer
+        self.__content_end = len(self.__buf)
+
+        # changes to the raw buffer can't be tracked, so markers just stay where
+        # they were unless the content no longer reaches them.
+        if self.__markers is not None:
+            length = len(self.__buf) - self.gap_size
+            self.__markers.remap(lambda position: min(position, length), length)
+
+        # move the gap pointers to point at the new gap
+        self.__gap_start = self.__content_end - self.gap_size
+        self.__gap_end = self.__content_end
+
+        # as do those to the substring index, which is rebuilt from scratch
+        if self.__ngrams is not None:
+            self.build_ngram_index(self.__ngrams.n)
+
+    @_profiled
+    def index(self, item, start=0, end=None):
+        """
+        Return the index of the first occurence of 'item' in this gapbuffer from
+        the slice between the optional start (default 0) and end (default end of
+        buffer) values.
+        """
+
+        # search for numbers in numeric buffers a segment at a time
+        arrays = self.__ndarrays()
+        if arrays is None or not isinstance(item, (int, long, float)):
+            return _basebuffer.index(self, item, start, end)
+
+        start, end, step = slice(start, end).indices(len(self))
+        value = self.__ndarray_item(item)
+
+        for offset, a in arrays:
+            low = max(start, offset)
+            high = min(end, offset + len(a))
+            if value is not None and low < high:
+                hits = numpy.flatnonzero(a[low - offset:high - offset] == value)
+                if len(hits) > 0:
+                    return low + int(hits[0])
+
+        # signal failure if we couldn't find anything
+        raise ValueError(self.__class__.__name__ +
+                ".index(x): x is not in " + self.__class__.__name__)
+
+    @_profiled
+    def count(self, item):
+        """Return the number of times 'item' occurs in this gapbuffer."""
+
+        # handle strings specially, using the substring index if we can
+        if self.__indexes(item):
+            end = 0
+            count = 0
+            for position in self.__indexed_matches(item, 0, len(self)):
+                # only count occurences that don't overlap, like find()
+                if position >= end:
+                    count += 1
+                    end = position + len(item)
+            return count
+
+        # count numbers in numeric buffers a segment at a time
+        arrays = self.__ndarrays()
+        if arrays is not None and isinstance(item, (int, long, float)):
+            item = self.__ndarray_item(item)
+            if item is None:
+                return 0
+            return sum(int(numpy.count_nonzero(a == item))
+                    for offset, a in arrays)
+
+        return _basebuffer.count(self, item)
+
+    def sum(self):
+        """
+        Return the sum of the items in this numeric gapbuffer, vectorized with
+        NumPy if it's installed.
+        """
+
+        arrays = self.__ndarrays()
+        if arrays is None:
+            return sum(self)
+
+        # sum floats as doubles one after another, like Python does. NumPy's
+        # own sum() adds them pairwise, which rounds differently, but a
+        # cumulative sum is sequential, so carry the total through each one.
+        if self.typecode in ["f", "d"]:
+            total = 0
+            for offset, a in arrays:
+                total = float(numpy.cumsum(numpy.concatenate(([total], a)),
+                        dtype=numpy.float64)[-1])
+            return total
+
+        # and integers as Python integers wherever 64-bit sums could overflow
+        if self.__buf.itemsize >= 8:
+            return sum(int(a.astype(object).sum()) for offset, a in arrays)
+        return sum(int(a.sum(dtype=numpy.int64)) for offset, a in arrays)
+
+    def min(self):
+        """
+        Return the smallest item in this gapbuffer, vectorized with NumPy if
+        it's installed. Raises a ValueError if the buffer is empty.
+        """
+
+        arrays = self.__ndarrays()
+        if not arrays:
+            return min(self)
+        return self.__extreme(min, numpy.amin, arrays)
+
+    def max(self):
+        """
+        Return the largest item in this gapbuffer, vectorized with NumPy if it's
+        installed. Raises a ValueError if the buffer is empty.
+        """
+
+        arrays = self.__ndarrays()
+        if not arrays:
+            return max(self)
+        return self.__extreme(max, numpy.amax, arrays)
+
+    def __extreme(self, pick, reduce, arrays):
+        """
+        Return the smallest or largest of our items in a list of non-empty
+        (index, NumPy array) pairs, where pick is min or max and reduce is the
+        matching NumPy function, giving the same result as pick() on the items.
+        """
+
+        # python's min() and max() keep the first item if it's NaN and never
+        # pick a later NaN over anything, where NumPy's pick any NaN, so leave
+        # out the NaNs of any array with them after checking the first item.
+        first = arrays[0][1][0].item()
+        if first != first:
+            return first
+
+        extremes = []
+        for offset, a in arrays:
+            extreme = reduce(a).item()
+            if extreme != extreme:
+                a = a[a == a]
+                if len(a) == 0:
+                    continue
+                extreme = reduce(a).item()
+            extremes.append(extreme)
+
+        return pick(extremes)
+
+    def argwhere(self, predicate):
+        """
+        Return a list of the indices of the items for which predicate(item) is
+        true. When NumPy is installed and this is a numeric gapbuffer, the
+        predicate is called with whole NumPy arrays of items instead and must
+        return an array of booleans, so it should only use operations that work
+        elementwise on both, like comparisons and arithmetic.
+        """
+
+        arrays = self.__ndarrays()
+        if arrays is None:
+            return [i for i, item in enumerate(self) if predicate(item)]
+
+        indices = []
+        for offset, a in arrays:
+            mask = numpy.zeros(len(a), dtype=bool)
+            mask[...] = predicate(self.__widened(a))
+            indices.extend((numpy.flatnonzero(mask) + offset).tolist())
+
+        return indices
+
+    def apply(self, function):
+        """
+        Replace every item in this gapbuffer with function(item). As with
+        argwhere(), when NumPy is installed and this is a numeric gapbuffer the
+        function is called with whole NumPy arrays of items instead. Either way,
+        results that aren't of the buffer's item type raise a TypeError, and
+        ones out of its range raise an OverflowError.
+        """
+
+        arrays = self.__ndarrays()
+        if arrays is None:
+            items = self._to_array([function(item) for item in self])
+        else:
+            items = array.array(self.typecode)
+            for offset, a in arrays:
+                result = numpy.empty(len(a), dtype=a.dtype)
+                result[...] = self.__ndarray_items(function(self.__widened(a)))
+                items.fromstring(result.tostring())
+
+        self._replace(0, len(self), items)
+
+    def find(self, sub, start=0, end=None):
+        """
+        Return the lowest index in this text gapbuffer where the string 'sub' is
+        found within the slice between the optional start (default 0) and end
+        (default end of buffer) values, or -1 if it isn't found.
+        """
+
+        # check only where the substring index says it might be, if we can
+        if self.__indexes(sub):
+            return next(self.__indexed_matches(sub, start, end), -1)
+
+        return _basebuffer.find(self, sub, start, end)
+
+    def line_count(self):
+        """Return the number of lines in this text gapbuffer."""
+        return self.__line_index().line_count()
+
+    def line_to_offset(self, line, column=0):
+        """
+        Return the index of the item at some column (default 0) of some line in
+        this text gapbuffer. Lines and columns are numbered from 0.
+        """
+        return self.__line_index().line_start(line) + column
+
+    def offset_to_line(self, offset):
+        """
+        Return the (line, column) pair for some index in this text gapbuffer,
+        which may be the length of the buffer. Lines and columns are numbered
+        from 0.
+        """
+
+        if not 0 <= offset <= len(self):
+            raise IndexError(self.__class__.__name__ + " index out of range")
+
+        line = self.__line_index().line_of(offset)
+        return line, offset - self.__lines.line_start(line)
+
+    def getline(self, line):
+        """
+        Return the content of some line in this text gapbuffer, numbered from 0,
+        without its trailing newline.
+        """
+
+        lines = self.__line_index()
+        start, end = lines.line_start(line), lines.line_end(line)
+
+        items = self._copy(start, end)
+        return items.tounicode() if self.typecode == "u" else items.tostring()
+
+    def build_ngram_index(self, n=None):
+        """
+        Index every substring of n (default NGRAM_SIZE) items in this text
+        gapbuffer, so that find(), count(), and membership tests for strings at
+        least that long only have to check where the rarest of their substrings
+        occurs rather than search all the content. The index is kept up to date
+        as the buffer is edited, which makes edits slower and takes several
+        times the memory of the content, so it suits large buffers that are
+        searched far more often than they're edited.
+        """
+
+        if self.typecode not in ["u", "c"]:
+            raise TypeError(self.__class__.__name__ +
+                    " n-gram indexes require a 'c' or 'u' typecode")
+
+        n = gapbuffer.NGRAM_SIZE if n is None else n
+        if n < 1:
+            raise ValueError("n-gram size must be at least 1")
+
+        self.__ngrams = _ngramindex(n)
+        self.__ngrams.replace(0, 0, len(self), self.__text)
+
+    def drop_ngram_index(self):
+        """Discard any index built by build_ngram_index()."""
+        self.__ngrams = None
+
+    @property
+    def markers(self):
+        """A list of the markers in this gapbuffer, in order of position."""
+        return [] if self.__markers is None else self.__markers.markers()
+
+    def add_marker(self, index, gravity="left"):
+        """
+        Add and return a marker at some index (which may be the length of the
+        buffer) that's kept up to date as the buffer is edited. gravity decides
+        where the marker goes when items are inserted at it, or when it's in a
+        range that's replaced: "left" (the default) keeps it before them, and
+        "right" moves it after them. Updating the markers for an edit takes time
+        proportional to the number of markers between it and the previous edit,
+        and to the number within the edited range.
+        """
+
+        if self.__markers is None:
+            self.__markers = _markerindex(len(self))
+
+        m = marker(gravity)
+        self.__markers.add(m, index)
+        return m
+
+    def remove_marker(self, m):
+        """Stop keeping a marker up to date, leaving it where it last was."""
+
+        if self.__markers is None or m._index is not self.__markers:
+            raise ValueError(self.__class__.__name__ +
+                    ".remove_marker(x): x is not in " + self.__class__.__name__)
+
+        self.__markers.remove(m)
+
+    def load(self, fileobj, chunk_size=None):
+        """
+        Append the raw items in a file object (as written by save() or
+        array.tofile()) to the buffer, reading 'chunk_size' items at a time
+        (default LOAD_CHUNK_SIZE) directly into a reused array with readinto()
+        when the file object supports it, so the file's content is never copied
+        anywhere but into the buffer.
+        """
+
+        if chunk_size is None:
+            chunk_size = gapbuffer.LOAD_CHUNK_SIZE
+        itemsize = self.__buf.itemsize
+
+        chunk = self.__fill(chunk_size)
+        readinto = getattr(fileobj, "readinto", None)
+
+        # load the whole file as one undoable edit
+        with self.__journal_group():
+            while True:
+                if readinto is not None:
+                    size = readinto(chunk) or 0
+                else:
+                    data = fileobj.read(chunk_size * itemsize)
+                    size = len(data)
+
+                if size == 0:
+                    break
+
+                count, partial = divmod(size, itemsize)
+                if readinto is not None:
+                    items = chunk if count == chunk_size else chunk[:count]
+                    head = chunk[count:count + 1].tostring()[:partial]
+                else:
+                    items = array.array(self.typecode)
+                    items.fromstring(data[:count * itemsize])
+                    head = data[count * itemsize:]
+
+                # complete an item split between reads by reading the rest of it
+                while 0 < len(head) < itemsize:
+                    rest = fileobj.read(itemsize - len(head))
+                    if len(rest) == 0:
+                        raise ValueError(
+                                "file size is not a multiple of item size")
+                    head += rest
+
+                if len(head) > 0:
+                    items.fromstring(head)
+
+                # append the items read, which leaves the gap at the end
+                end = len(self)
+                self._replace(end, end, items)
+
+    def save(self, fileobj):
+        """
+        Write the buffer's raw items to a file object, writing the content
+        before and after the gap straight from the internal array rather than
+        joining it into a copy first.
+        """
+
+        for segment in self.segments():
+            if len(segment) > 0:
+                fileobj.write(segment)
+
+    def undo(self):
+        """
+        Undo the most recent group of journaled edits that hasn't been undone
+        yet. Returns True if there was anything to undo, otherwise False.
+        """
+        return self.__replay(self.__require_journal().pop_undo(), undo=True)
+
+    def redo(self):
+        """
+        Redo the most recently undone group of journaled edits. Returns True if
+        there was anything to redo, otherwise False.
+        """
+        return self.__replay(self.__require_journal().pop_redo(), undo=False)
+
+    @contextlib.contextmanager
+    def group(self):
+        """
+        Return a context manager that groups all the edits made within it so
+        they're undone and redone together. Groups may be nested.
+        """
+
+        self.__require_journal()
+
+        with self.__journal_group():
+            yield self
+
+    def apply_edits(self, edits):
+        """
+        Apply a batch of (start, stop, replacement) edits, each replacing the
+        items between the start and stop indices of the current content with
+        the items in the replacement sequence. Edits may be given in any order
+        but mustn't overlap. They're applied in a single pass over the buffer,
+        which is far faster than assigning to a slice per edit when there are
+        many of them, and are undone together. The gap is left following the
+        last edit.
+        """
+
+        edits = _sorted_edits(edits, len(self), self._to_array)
+        if len(edits) == 0:
+            return
+
+        # build the new content in a fresh array, copying each run of unchanged
+        # items followed by the replacement for the edit that ends it.
+        buf = array.array(self.typecode)
+        position = 0
+        shift = 0
+
+        # the substring index needs the edited content, so it's rebuilt after
+        ngrams, self.__ngrams = self.__ngrams, None
+
+        with self.__journal_group():
+            for start, stop, items in edits:
+                buf.extend(self._copy(position, start))
+
+                removed = None
+                if self.__journal is not None:
+                    removed = self._copy(start, stop)
+                self.__edited(start + shift, stop - start, items, removed)
+
+                buf.extend(items)
+                position = stop
+                shift += len(items) - (stop - start)
+
+        # put a new gap after the last edit, then the rest of the content
+        gap_start = len(buf)
+        buf.extend(self.__fill(self.gap_size))
+        gap_end = len(buf)
+        buf.extend(self._copy(position, len(self)))
+
+        if self.__stats is not None:
+            self.__stats.resizes += 1
+            self.__stats.bytes_allocated += len(buf) * buf.itemsize
+            self.__stats.items_copied += len(buf) - (gap_end - gap_start)
+
+        # any snapshots are left sharing the old array, which is never changed
+        self.__buf = buf
+        self.__gap_start = gap_start
+        self.__gap_end = gap_end
+        self.__content_end = len(buf)
+        self.__snapshots = None
+
+        if ngrams is not None:
+            self.build_ngram_index(ngrams.n)
+
+    def reverse(self):
+        """Reverse the items in this gapbuffer in-place."""
+
+        # only reverse if necessary
+        if len(self) <= 1:
+            return
+
+        removed = None
+        if self.__journal is not None:
+            removed = self._copy(0, len(self))
+
+        # reversing the whole internal array reverses the content on each side
+        # of the gap and swaps the sides, which reverses the content as a whole
+        # and leaves the gap mirrored on the other side of the array.
+        self.__unshare(0, len(self.__buf))
+        self.__buf.reverse()
+        self.__gap_start, self.__gap_end = (len(self.__buf) - self.__gap_end,
+                len(self.__buf) - self.__gap_start)
+
+        # every line changed, so it's cheaper to rebuild the index when needed
+        self.__lines = None
+        if removed is not None:
+            self.__journal.record(0, removed, self._copy(0, len(self)))
+
+        # markers keep their places between the same items
+        if self.__markers is not None:
+            length = len(self)
+            self.__markers.remap(lambda position: length - position, length)
+
+        if self.__ngrams is not None:
+            self.build_ngram_index(self.__ngrams.n)
+
+    def debug_view(self): # pragma: no cover
+        """
+        Get a debug view of the buffer's contents and internal values as a
+        unicode string. Only works for text ('c' or 'u') buffers.
+        """
+
+        # disallow use for non-text buffers
+        if self.typecode not in ['c', 'u']:
+            return "Only works for 'c' and 'u' buffers. got: " + self.typecode
+
+        # write special values into gap
+        self.__unshare(self.__gap_start, self.__gap_end)
+        for i in xrange(self.__gap_start, self.__gap_end):
+            self.__buf[i] = u"_"
+
+        # write special values into blank area
+        for i in xrange(self.__content_end, len(self.__buf)):
+            self.__buf[i] = u"#"
+
+        # our desired display characters and their positions
+        chars = [
+            ("s", self.__gap_start),
+            ("e", self.__gap_end),
+            ("$", self.__content_end)
+        ]
+
+        # find the left-most value we'll be displaying
+        max_pos = max(map(lambda t: t[1], chars))
+
+        # track all the rows we'll need
+        rows = []
+
+        # add the first row
+        rows.append([None] * (max_pos + 1))
+
+        # insert all the characters into rows
+        for char, pos in chars:
+            # try all the rows in turn until an empty slot is found
+            for i in xrange(len(chars)):
+                # add more space if we need it
+                if len(rows) == i:
+                    rows.append([None] * (max_pos + 1))
+
+                # fill the slot if it was empty, then move on
+                if rows[i][pos] is None:
+                    rows[i][pos] = char
+                    break
+
+        # build the final string
+        s = [
+            u"'" + unicode(self) + u"', " + unicode(len(self)),
+            self.__buf.tounicode()
+        ]
+
+        for row in rows:
+            t = []
+            for c in row:
+                t.append(c if c is not None else u" ")
+            s.append(u"".join(t))
+
+        return u'\n'.join(s)
+
+    def snapshot(self):
+        """
+        Return an immutable snapshot of the buffer's current content in constant
+        time. The snapshot shares the buffer's internal array instead of copying
+        it, and the buffer copies only the shared items it goes on to overwrite
+        into the snapshot, so snapshots stay cheap while the buffer is edited.
+        """
+
+        # the raw buffer handed out by the context manager can be changed in
+        # place, so a snapshot taken inside the context gets its own copy.
+        if self.__in_context:
+            return snapshot._fromsources(self.typecode,
+                    [(self.__buf[:], 0, len(self.__buf))])
+
+        snap = snapshot._fromsources(self.typecode, [
+            (self.__buf, 0, self.__gap_start),
+            (self.__buf, self.__gap_end, len(self.__buf) - self.__gap_end),
+        ])
+
+        if self.__snapshots is None:
+            self.__snapshots = weakref.WeakSet()
+        self.__snapshots.add(snap)
+
+        return snap
+
+    def trim(self, gap_size=None):
+        """
+        Shrink the gap to at most 'gap_size' items (default the buffer's
+        gap_size), releasing the memory it used.
+        """
+
+        gap_size = self.gap_size if gap_size is None else gap_size
+
+        excess = self.__gap_len - gap_size
+        if excess > 0:
+            self.__resize_buf(self.__gap_end, -excess)
+            self.__gap_end -= excess
+
+    def __line_index(self):
+        """Return the line index, creating it if necessary."""
+
+        if self.typecode not in ["u", "c"]:
+            raise TypeError(self.__class__.__name__ +
+                    " line lookups require a 'c' or 'u' typecode")
+
+        if self.__lines is None:
+            self.__lines = _lineindex(self.typecode)
+            for offset, chunk in self.__offset_chunks():
+                self.__lines.replace(offset, 0, chunk)
+
+        return self.__lines
+
+    def __require_journal(self):
+        """Return our journal, raising a ValueError if we don't have one."""
+
+        if self.__journal is None:
+            raise ValueError(self.__class__.__name__ + " has no journal")
+        return self.__journal
+
+    @contextlib.contextmanager
+    def __journal_group(self):
+        """
+        Return a context manager that groups the edits made within it if we're
+        journaling, and does nothing otherwise.
+        """
+
+        if self.__journal is None:
+            yield
+        else:
+            self.__journal.begin_group()
+            try:
+                yield
+            finally:
+                self.__journal.end_group()
+
+    def __replay(self, group, undo):
+        """
+        Undo (or redo) a group of journaled edits, then hand the group back to
+        the journal to be redone (or undone) later.
+        """
+
+        if group is None:
+            return False
+
+        # don't journal the edits we make while replaying the group
+        journal, self.__journal = self.__journal, None
+        try:
+            if undo:
+                for start, removed, inserted in reversed(group):
+                    self._replace(start, start + len(inserted), removed)
+            else:
+                for start, removed, inserted in group:
+                    self._replace(start, start + len(removed), inserted)
+        finally:
+            self.__journal = journal
+
+        if undo:
+            journal.push_redo(group)
+        else:
+            journal.push_undo(group)
+
+        return True
+
+    def __offset_chunks(self):
+        """Iterate over (offset, chunk) pairs for each chunk of the content."""
+
+        offset = 0
+        for chunk in self.chunks(gapbuffer.ITER_CHUNK_SIZE * 16):
+            yield offset, chunk
+            offset += len(chunk)
+
+    def __edited(self, start, removed, inserted, removed_items=None):
+        """
+        Record that 'removed' items at the start index were replaced by the
+        'inserted' array.array (or single item) of new items. removed_items
+        holds a copy of the removed items when the edit is being journaled.
+        """
+
+        if (self.__lines is None and self.__journal is None and
+                self.__markers is None and self.__ngrams is None):
+            return
+
+        if not isinstance(inserted, array.array):
+            inserted = array.array(self.typecode, [inserted])
+
+        if self.__lines is not None:
+            self.__lines.replace(start, removed, inserted)
+
+        if self.__markers is not None:
+            self.__markers.replace(start, removed, len(inserted))
+
+        if self.__ngrams is not None:
+            self.__ngrams.replace(start, removed, len(inserted), self.__text)
+
+        if self.__journal is not None:
+            self.__journal.record(start, removed_items, inserted)
+
+    def __text(self, start, stop):
+        """Return the content between start and stop as a string."""
+
+        items = self._copy(start, stop)
+        return items.tounicode() if self.typecode == "u" else items.tostring()
+
+    def __indexes(self, sub):
+        """Return True if the substring index can be used to find 'sub'."""
+        return (self.__ngrams is not None and isinstance(sub, basestring) and
+                len(sub) >= self.__ngrams.n)
+
+    def __indexed_matches(self, sub, start, end):
+        """
+        Iterate over the ascending indices of every occurence of the string
+        'sub' between start and end, including overlapping ones, by checking
+        each place the substring index says it might start.
+        """
+
+        if self.__stats is not None:
+            self.__stats.searches += 1
+
+        start, end, step = slice(start, end).indices(len(self))
+        for position in self.__ngrams.candidates(sub, start):
+            if position + len(sub) > end:
+                break
+            if (start <= position and
+                    self.__text(position, position + len(sub)) == sub):
+                yield position
+
+    def __fill(self, count):
+        """Return an array.array of 'count' fill items for use in the gap."""
+        return array.array(self.typecode,
+                [gapbuffer.TYPE_CODES[self.typecode][0]]) * count
+
+    def __resize_buf(self, index, delta):
+        """
+        Grow the internal array by inserting 'delta' fill items at some index,
+        or shrink it by removing -delta items from before the index. Either way
+        the items following the index are shifted in a single bulk operation.
+        """
+
+        if self.__stats is not None:
+            self.__stats.resizes += 1
+            self.__stats.bytes_allocated += max(0, delta) * self.__buf.itemsize
+
+            # all the items after the index are shifted, or all of them are
+            # copied if snapshots share the array.
+            self.__stats.items_copied += (len(self.__buf) if self.__snapshots
+                    else len(self.__buf) - index)
+
+        if self.__snapshots:
+            # rather than shifting items that snapshots share, leave them the
+            # current array and build a resized copy of it for ourselves.
+            if delta > 0:
+                self.__buf = (self.__buf[:index] + self.__fill(delta) +
+                        self.__buf[index:])
+            else:
+                self.__buf = self.__buf[:index + delta] + self.__buf[index:]
+            self.__snapshots = None
+        elif delta > 0:
+            self.__buf[index:index] = self.__fill(delta)
+        elif delta < 0:
+            del self.__buf[index + delta:index]
+
+        self.__content_end += delta
+
+    def __append(self, items):
+        """
+        Append items to the end of an internal array with an empty gap, moving
+        the gap to the new end.
+        """
+
+        if self.__stats is not None:
+            self.__stats.resizes += 1
+            self.__stats.bytes_allocated += len(items) * self.__buf.itemsize
+
+        self.__buf.extend(items)
+        self.__content_end = len(self.__buf)
+        self.__gap_start = self.__gap_end = self.__content_end
+
+    def __resize_gap(self, target_size):
+        """Ensure that the gap is at least as large as some target."""
+
+        if self.__gap_len < target_size:
+            # ask the policy how big the new gap should be
+            gap_delta = self.policy.grow(target_size, len(self),
+                    self.gap_size) - self.__gap_len
+
+            # grow the gap in place, shifting the right content down
+            self.__resize_buf(self.__gap_end, gap_delta)
+            self.__gap_end += gap_delta
+
+    def __shrink_gap(self):
+        """Trim the gap after a deletion if our policy says it's too large."""
+
+        gap_size = self.policy.shrink(self.__gap_len, self.gap_size)
+        if gap_size is not None:
+            self.trim(gap_size)
+
+    def __unshare(self, start, stop):
+        """
+        Make any snapshots sharing the items between some start and stop index
+        in the internal array take their own copies of them, so the items can be
+        overwritten without changing the snapshots.
+        """
+
+        if not self.__snapshots:
+            return
+
+        for snap in list(self.__snapshots):
+            # stop tracking snapshots that no longer share anything with us
+            if not snap._detach(self.__buf, start, stop):
+                self.__snapshots.discard(snap)
+
+    def __move_gap(self, index):
+        """Move the gap to some index."""
+
+        # don't move the gap if it consists of the entire internal buffer
+        if len(self) == 0:
+            return
+
+        # normalize the index to a positive number if negative
+        index = len(self) + index if index < 0 else index
+
+        # make sure we're within virtual buffer bounds. the start of the
+        # gap is always the same as the virtual buffer index, so we must limit
+        # it to this since its end extends to the end of the actual buffer.
+        assert 0 <= index <= len(self)
+
+        if self.__stats is not None and index != self.__gap_start:
+            self.__stats.gap_moves += 1
+            self.__stats.gap_move_distance += abs(index - self.__gap_start)
+            if self.__gap_len > 0:
+                self.__stats.items_copied += abs(index - self.__gap_start)
+
+        # optimize for moving a zero-length gap (avoids needless copies)
+        if self.__gap_len == 0:
+            self.__gap_start = self.__gap_end = index
+        elif index < self.__gap_start:
+            # move the gap left by copying the items between the index and the
+            # gap's start to the end of the gap in a single slice assignment.
+            distance = self.__gap_start - index
+            self.__unshare(self.__gap_end - distance, self.__gap_end)
+            self.__buf[self.__gap_end - distance:self.__gap_end] = (
+                    self.__buf[index:self.__gap_start])
+
+            # slide the gap to the left
+            self.__gap_start -= distance
+            self.__gap_end -= distance
+        elif index > self.__gap_start:
+            # move the gap right by copying the items following the gap into
+            # its first slots, again as a single slice assignment.
+            distance = index - self.__gap_start
+            self.__unshare(self.__gap_start, index)
+            self.__buf[self.__gap_start:index] = (
+                    self.__buf[self.__gap_end:self.__gap_end + distance])
+
+            # slide the gap to the right
+            self.__gap_start += distance
+            self.__gap_end += distance
+
+    def segments(self):
+        """
+        Return a pair of read-only buffer objects viewing the raw content before
+        and after the gap, respectively, without copying it and without moving
+        the gap. The views cover the underlying item bytes, so offsets and
+        lengths are in bytes rather than items for types larger than a byte.
+        Since they view the buffer's internal storage, the views should not be
+        used after the buffer is modified.
+        """
+
+        # python 2's array.array doesn't support memoryview, but does support the
+        # old-style buffer interface.
+        itemsize = self.__buf.itemsize
+        return (
+            buffer(self.__buf, 0, self.__gap_start * itemsize),
+            buffer(self.__buf, self.__gap_end * itemsize,
+                (self.__content_end - self.__gap_end) * itemsize)
+        )
+
+    def __ndarrays(self):
+        """
+        Return a list of (index, NumPy array) pairs viewing the non-empty
+        content on either side of the gap without copying it, where index is
+        the index in the buffer each array starts at. Returns None instead if
+        NumPy isn't installed or this is a text buffer.
+        """
+
+        if numpy is None or self.typecode in ["c", "u"]:
+            return None
+
+        dtype = numpy.dtype(self.typecode)
+        offsets = [0, self.__gap_start]
+        return [(offset, numpy.frombuffer(segment, dtype=dtype))
+                for offset, segment in zip(offsets, self.segments())
+                if len(segment) > 0]
+
+    def __widened(self, a):
+        """
+        Return a copy of a NumPy array of our items with a type that does
+        arithmetic on them like Python does instead of wrapping around or
+        rounding: doubles for floats, 64-bit integers for narrower integers, and
+        Python integers for 64-bit ones.
+        """
+
+        if self.typecode in ["f", "d"]:
+            return a.astype(numpy.float64)
+        return a.astype(object if a.itemsize >= 8 else numpy.int64)
+
+    def __ndarray_items(self, values):
+        """
+        Return values computed from our items by NumPy as an array that can be
+        cast to our item type without losing anything, raising the TypeError or
+        OverflowError that converting them one at a time would otherwise.
+        """
+
+        values = numpy.asarray(values)
+
+        # Python integers and objects need converting one at a time anyway
+        if values.dtype.kind == "O":
+            return numpy.frombuffer(self._to_array(values.ravel().tolist()),
+                    dtype=self.typecode)
+
+        floats = self.typecode in ["f", "d"]
+        if values.dtype.kind not in ("biuf" if floats else "biu"):
+            raise TypeError(self.__class__.__name__ + " items must be of type "
+                    + gapbuffer.TYPE_CODES[self.typecode][1])
+
+        if not floats and values.size > 0:
+            info = numpy.iinfo(numpy.dtype(self.typecode))
+            if int(values.min()) < info.min or int(values.max()) > info.max:
+                raise OverflowError(self.__class__.__name__
+                        + " item out of range")
+
+        return values
+
+    def __ndarray_item(self, item):
+        """
+        Return a number as a NumPy scalar of our item type for comparing with
+        our content, or None if it can't be equal to any of our items, such as
+        when it's out of range or has a fractional part in an integer buffer.
+        """
+
+        try:
+            value = numpy.dtype(self.typecode).type(item)
+        except (OverflowError, ValueError):
+            return None
+
+        # conversion can wrap around or lose precision rather than failing
+        return value if value == item else None
+
+    def _copy(self, start, stop):
+        """
+        Copy the content between the start and stop indices to a new
+        array.array using at most two slices of the internal array.
+        """
+
+        if stop <= self.__gap_start:
+            return self.__buf[start:stop]
+        elif start >= self.__gap_start:
+            return self.__buf[start + self.__gap_len:stop + self.__gap_len]
+
+        return (self.__buf[start:self.__gap_start] +
+                self.__buf[self.__gap_end:stop + self.__gap_len])
+
+    def __copy_extended(self, start, stop, step):
+        """
+        Copy the items of the extended slice given by normalized start, stop,
+        and step values to a new array.array, using at most two extended slices
+        of the internal array.
+        """
+
+        gap_start = self.__gap_start
+
+        # split the items into those on the first and second sides of the gap we
+        # come across, in slice order.
+        if step > 0:
+            first_count = len(xrange(start, min(stop, gap_start), step))
+            offsets = (0, self.__gap_len)
+        else:
+            first_count = len(xrange(start, max(stop, gap_start - 1), step))
+            offsets = (self.__gap_len, 0)
+
+        count = len(xrange(start, stop, step))
+        parts = [
+            (start, first_count, offsets[0]),
+            (start + first_count * step, count - first_count, offsets[1])
+        ]
+
+        result = array.array(self.typecode)
+        for first, part_count, offset in parts:
+            if part_count > 0:
+                # don't let a descending slice's end wrap around to the end
+                last = first + offset + part_count * step
+                result.extend(self.__buf[first + offset:
+                        last if last >= 0 else None:step])
+
+        return result
+
+    def _search_regions(self, start, end, window, reverse=False):
+        """
+        Yield the regions to search for matches within the content between
+        start and end, as _basebuffer._search_regions() does. The content on
+        either side of the gap is searched in place, and only the content within
+        'window' items of the gap is copied.
+        """
+
+        if self.__stats is not None:
+            self.__stats.searches += 1
+
+        gap_start = self.__gap_start
+        gap_len = self.__gap_len
+
+        # ranges before the gap, or far enough past it that lookbehind won't see
+        # into the gap, can be searched in place in one go.
+        if end <= gap_start or start >= gap_start + window:
+            offset = 0 if end <= gap_start else gap_len
+            yield self.__buf, start + offset, end + offset, offset, None
+            return
+
+        # the range around the gap that we search in a stitched-together copy.
+        # it extends twice as far past the gap as before it so that matches
+        # starting just after the gap are seen with their following context, and
+        # includes some preceding context for lookbehind assertions.
+        window_start = max(start, gap_start - window)
+        window_end = min(end, gap_start + 2 * window)
+        context_start = max(0, window_start - window)
+
+        def before():
+            return self.__buf, start, gap_start, 0, window_start
+
+        def stitched():
+            items = self._copy(context_start, window_end)
+            limit = None if window_end == end else gap_start + window
+            return (items, window_start - context_start, len(items),
+                    -context_start, limit)
+
+        def after():
+            return (self.__buf, gap_start + window + gap_len, end + gap_len,
+                    gap_len, None)
+
+        # only search in place where there's content outside of the window
+        regions = [stitched]
+        if start < window_start:
+            regions.insert(0, before)
+        if window_end < end:
+            regions.append(after)
+
+        if reverse:
+            regions.reverse()
+
+        for region in regions:
+            yield region()
+
+def _sorted_edits(edits, length, to_array):
+    """
+    Validate a batch of (start, stop, replacement) edits to a buffer of some
+    length, returning them as a list of (start, stop, array.array) tuples sorted
+    by position. Replacements are converted with the to_array function.
+    """
+
+    result = []
+    for start, stop, replacement in edits:
+        if not 0 <= start <= stop <= length:
+            raise IndexError("edit range out of range: " + repr((start, stop)))
+        result.append((start, stop, to_array(replacement)))
+
+    # sort insertions before replacements starting at the same index, but keep
+    # the given order of insertions at the same index.
+    result.sort(key=lambda edit: edit[:2])
+
+    for previous, edit in itertools.izip(result, result[1:]):
+        if edit[0] < previous[1]:
+            raise ValueError("edits overlap: " + repr(previous[:2]) + " and " +
+                    repr(edit[:2]))
+
+    return result
+
+class _lineindex(object):
+    """
+    Tracks the positions of the newlines in a text buffer. Like a gap buffer,
+    it keeps the newlines before its split point as indices from the start of
+    the content, and those after it as distances from the end of the content,
+    so edits at the split point don't have to renumber anything. Edits
+    elsewhere first move the split point, which costs as much as the number of
+    newlines it passes. Lookups take logarithmic time.
+    """
+
+    def __init__(self, typecode):
+        self.__newline = re.compile(u"\n" if typecode == "u" else "\n")
+
+        # ascending indices of the newlines before the split point
+        self.__before = []
+
+        # ascending distances from the end of the content of the newlines after
+        # the split point, so the final entry is the one nearest to it.
+        self.__after = []
+
+        self.__split = 0
+        self.__length = 0
+
+    def __move(self, index):
+        """Move the split point to some index."""
+
+        length = self.__length
+
+        if index > self.__split:
+            # newlines before the index have distances greater than this
+            k = bisect.bisect_right(self.__after, length - index)
+            self.__before.extend([length - d for d in reversed(self.__after[k:])])
+            del self.__after[k:]
+        elif index < self.__split:
+            k = bisect.bisect_left(self.__before, index)
+            self.__after.extend([length - i for i in reversed(self.__before[k:])])
+            del self.__before[k:]
+
+        self.__split = index
+
+    def replace(self, start, removed, inserted):
+        """
+        Update the index for 'removed' items at the start index being replaced
+        by the items in the 'inserted' array.array.
+        """
+
+        self.__move(start)
+
+        # drop the newlines in the removed range
+        if removed > 0:
+            k = bisect.bisect_right(self.__after, self.__length - start - removed)
+            del self.__after[k:]
+
+        # newlines after the split point don't move relative to the end
+        self.__before.extend(start + match.start()
+                for match in self.__newline.finditer(inserted))
+
+        self.__length += len(inserted) - removed
+        self.__split = start + len(inserted)
+
+    def __newline_at(self, n):
+        """Return the index of the n'th newline."""
+
+        if n < len(self.__before):
+            return self.__before[n]
+        return self.__length - self.__after[
+                len(self.__after) - 1 - (n - len(self.__before))]
+
+    def line_count(self):
+        """Return the number of lines."""
+        return len(self.__before) + len(self.__after) + 1
+
+    def line_start(self, line):
+        """Return the index of the start of some line."""
+
+        if not 0 <= line < self.line_count():
+            raise IndexError("line number out of range")
+        return 0 if line == 0 else self.__newline_at(line - 1) + 1
+
+    def line_end(self, line):
+        """Return the index of the end of some line, excluding its newline."""
+
+        if not 0 <= line < self.line_count():
+            raise IndexError("line number out of range")
+        if line == self.line_count() - 1:
+            return self.__length
+        return self.__newline_at(line)
+
+    def line_of(self, index):
+        """Return the number of the line containing some index."""
+
+        # count the newlines before the index on either side of the split point
+        return (bisect.bisect_left(self.__before, index) + len(self.__after) -
+                bisect.bisect_right(self.__after, self.__length - index))
+
+class _ngramindex(object):
+    """
+    Maps every n item long substring (n-gram) of a text gapbuffer's content to
+    the indices where it occurs. The content is divided into chunks of around
+    CHUNK_SIZE items, each mapping the n-grams starting in it to their offsets
+    within it, so an edit only has to re-index the chunks it touches and the
+    offsets of the other chunks never change.
+    """
+
+    # the number of items in each chunk, which trades the cost of re-indexing a
+    # chunk on every edit against the cost of checking every chunk on a lookup.
+    CHUNK_SIZE = 1024
+
+    def __init__(self, n):
+        self.n = n
+
+        # the number of content items in each chunk, and the map of each
+        # chunk's n-grams to the ascending offsets they start at within it.
+        self.__lengths = []
+        self.__chunks = []
+
+        # the index in the content each chunk starts at, so chunks can be found
+        # by bisection, and the length of the content.
+        self.__starts = []
+        self.__length = 0
+
+        # the total number of times each n-gram occurs
+        self.__counts = {}
+
+    def __locate(self, index):
+        """
+        Return the position of the chunk containing some index (the last chunk
+        if it's the length of the content) and the index that chunk starts at.
+        """
+
+        i = bisect.bisect_right(self.__starts, index) - 1
+        return i, self.__starts[i]
+
+    def __count(self, chunk, sign):
+        """Add (or remove if sign is -1) a chunk's n-grams to the totals."""
+
+        counts = self.__counts
+        for gram, offsets in chunk.iteritems():
+            count = counts.get(gram, 0) + sign * len(offsets)
+            if count:
+                counts[gram] = count
+            else:
+                del counts[gram]
+
+    def replace(self, start, removed, inserted, text):
+        """
+        Update the index for 'removed' items at the start index having been
+        replaced by 'inserted' items, where text(start, stop) returns the edited
+        content between two indices as a string.
+        """
+
+        n = self.n
+        size = _ngramindex.CHUNK_SIZE
+        length = self.__length + inserted - removed
+
+        # re-index every chunk with n-grams overlapping the edit, along with
+        # the next chunk if they've become small enough to merge with it.
+        if self.__lengths:
+            first, offset = self.__locate(max(0, start - n + 1))
+            last = self.__locate(max(0, start - n + 1, start + removed - 1))[0]
+        else:
+            first, last, offset = 0, -1, 0
+
+        span = sum(self.__lengths[first:last + 1]) + inserted - removed
+        if span < size // 2 and last + 1 < len(self.__lengths):
+            last += 1
+            span += self.__lengths[last]
+
+        for chunk in self.__chunks[first:last + 1]:
+            self.__count(chunk, -1)
+
+        # split the new content into chunks, including the following n - 1
+        # items for the n-grams that start near the end of it.
+        content = text(offset, min(length, offset + span + n - 1))
+        lengths = [span] if span <= 2 * size else [
+                min(size, span - i) for i in xrange(0, span, size)]
+
+        chunks = []
+        position = 0
+        for chunk_length in lengths:
+            chunk = {}
+            end = min(position + chunk_length, len(content) - n + 1)
+            for i in xrange(position, end):
+                gram = content[i:i + n]
+                if gram in chunk:
+                    chunk[gram].append(i - position)
+                else:
+                    chunk[gram] = [i - position]
+
+            self.__count(chunk, 1)
+            chunks.append(chunk)
+            position += chunk_length
+
+        # drop any chunk left empty
+        if span == 0:
+            lengths, chunks = [], []
+
+        self.__lengths[first:last + 1] = lengths
+        self.__chunks[first:last + 1] = chunks
+
+        # fix up the starts of the chunks from the first re-indexed one on
+        del self.__starts[first:]
+        for chunk_length in self.__lengths[first:]:
+            self.__starts.append(offset)
+            offset += chunk_length
+
+        self.__length = length
+
+    def candidates(self, sub, start=0):
+        """
+        Iterate over the ascending indices from the start index on where the
+        string 'sub', which must be at least n items long, might occur. Chunks
+        are only looked at as they're reached, so stopping early skips the rest.
+        """
+
+        n = self.n
+
+        # look up the n-gram of sub that occurs the fewest times
+        best = None
+        for i in xrange(len(sub) - n + 1):
+            count = self.__counts.get(sub[i:i + n], 0)
+            if count == 0:
+                return
+            if best is None or count < best[0]:
+                best = count, i
+
+        # start at the chunk holding that n-gram's first possible occurence
+        gram = sub[best[1]:best[1] + n]
+        first = self.__locate(start + best[1])[0]
+        for number in xrange(first, len(self.__chunks)):
+            offsets = self.__chunks[number].get(gram)
+            if offsets is not None:
+                offset = self.__starts[number] - best[1]
+                for i in offsets:
+                    yield offset + i
+
+class _markerindex(object):
+    """
+    Tracks the positions of the markers in a gapbuffer. Like _lineindex, it
+    keeps the positions of the markers before its split point as indices from
+    the start of the content, and those after it as distances from the end of
+    the content, so edits at the split point don't have to renumber anything.
+    Edits elsewhere first move the split point, which costs as much as the
+    number of markers it passes. Each marker records its own encoded position,
+    so finding it takes constant time.
+    """
+
+    def __init__(self, length):
+        # the ascending positions of the markers before the split point, and
+        # the markers themselves.
+        self.__before = []
+        self.__before_markers = []
+
+        # the ascending distances from the end of the content of the markers
+        # after the split point, and the markers themselves.
+        self.__after = []
+        self.__after_markers = []
+
+        self.__split = 0
+        self.__length = length
+
+    def __move(self, index):
+        """
+        Move the split point to some index, leaving any markers at the index
+        after it.
+        """
+
+        length = self.__length
+
+        if index > self.__split:
+            # markers before the index have distances greater than this
+            k = bisect.bisect_right(self.__after, length - index)
+            moved = self.__after_markers[k:]
+            moved.reverse()
+            for m in moved:
+                m._value = length - m._value
+                m._after = False
+
+            self.__before.extend(m._value for m in moved)
+            self.__before_markers.extend(moved)
+            del self.__after[k:]
+            del self.__after_markers[k:]
+        elif index <= self.__split:
+            k = bisect.bisect_left(self.__before, index)
+            moved = self.__before_markers[k:]
+            moved.reverse()
+            for m in moved:
+                m._value = length - m._value
+                m._after = True
+
+            self.__after.extend(m._value for m in moved)
+            self.__after_markers.extend(moved)
+            del self.__before[k:]
+            del self.__before_markers[k:]
+
+        self.__split = index
+
+    def position(self, m):
+        """Return the position of one of our markers."""
+        return self.__length - m._value if m._after else m._value
+
+    def markers(self):
+        """Return a list of our markers in order of position."""
+        return self.__before_markers + self.__after_markers[::-1]
+
+    def add(self, m, index):
+        """Add a marker at some index."""
+
+        if not 0 <= index <= self.__length:
+            raise IndexError("marker index out of range")
+
+        # markers are always added at the split point, just after it
+        self.__move(index)
+
+        m._index = self
+        m._value = self.__length - index
+        m._after = True
+
+        self.__after.append(m._value)
+        self.__after_markers.append(m)
+
+    def remove(self, m):
+        """Remove one of our markers, leaving it at its final position."""
+
+        if m._after:
+            values, markers = self.__after, self.__after_markers
+        else:
+            values, markers = self.__before, self.__before_markers
+
+        # find the marker among any others with the same position
+        k = bisect.bisect_left(values, m._value)
+        while markers[k] is not m:
+            k += 1
+
+        del values[k]
+        del markers[k]
+
+        m._value = self.position(m)
+        m._after = False
+        m._index = None
+
+    def replace(self, start, removed, inserted):
+        """
+        Update the markers for 'removed' items at the start index being replaced
+        by 'inserted' items.
+        """
+
+        self.__move(start)
+
+        # take out the markers that sit in the replaced range, or exactly at the
+        # start index if nothing was removed. these are the final ones after
+        # the split point.
+        k = bisect.bisect_right(self.__after,
+                self.__length - start - max(removed, 1))
+        affected = self.__after_markers[k:]
+        del self.__after[k:]
+        del self.__after_markers[k:]
+
+        # markers after the range don't move relative to the end
+        self.__length += inserted - removed
+
+        # the affected markers go before or after the new items by gravity
+        for m in affected:
+            if m.gravity == "left":
+                m._value = start
+                m._after = False
+                self.__before.append(start)
+                self.__before_markers.append(m)
+            else:
+                m._value = self.__length - start - inserted
+                self.__after.append(m._value)
+                self.__after_markers.append(m)
+
+        self.__split = start + inserted
+
+    def remap(self, function, length):
+        """
+        Move every marker from its position p to function(p) after the content
+        has been changed to some length.
+        """
+
+        positions = [(function(self.position(m)), m) for m in self.markers()]
+        positions.sort(key=lambda pair: pair[0])
+
+        self.__init__(length)
+        for position, m in positions:
+            m._value = position
+            m._after = False
+            self.__before.append(position)
+            self.__before_markers.append(m)
+
+        self.__split = length
+
+class _checkpointindex(object):
+    """
+    Records the byte offset of every so many characters in UTF-8 encoded
+    content, so utf8gapbuffer only has to decode the bytes from the nearest
+    checkpoint to translate between character indices and byte offsets. Like
+    _markerindex, checkpoints before the split point are stored from the start
+    of the content and those after it from the end, so edits don't have to
+    renumber the checkpoints after them.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+        # the ascending character and byte offsets of the checkpoints before
+        # the split point.
+        self.__before_chars = []
+        self.__before_bytes = []
+
+        # the ascending character and byte distances from the end of the
+        # content of the checkpoints after the split point.
+        self.__after_chars = []
+        self.__after_bytes = []
+
+        self.__split = 0
+        self.__chars = 0
+        self.__bytes = 0
+
+    def __move(self, index):
+        """
+        Move the split point to some character index, leaving any checkpoint at
+        the index after it.
+        """
+
+        chars = self.__chars
+        size = self.__bytes
+
+        if index > self.__split:
+            k = bisect.bisect_right(self.__after_chars, chars - index)
+            self.__before_chars.extend(
+                    [chars - c for c in reversed(self.__after_chars[k:])])
+            self.__before_bytes.extend(
+                    [size - b for b in reversed(self.__after_bytes[k:])])
+            del self.__after_chars[k:]
+            del self.__after_bytes[k:]
+        elif index < self.__split:
+            k = bisect.bisect_left(self.__before_chars, index)
+            self.__after_chars.extend(
+                    [chars - c for c in reversed(self.__before_chars[k:])])
+            self.__after_bytes.extend(
+                    [size - b for b in reversed(self.__before_bytes[k:])])
+            del self.__before_chars[k:]
+            del self.__before_bytes[k:]
+
+        self.__split = index
+
+    def __nearest(self, value, before, after, total):
+        """
+        Return the (character, byte) offsets of the last checkpoint at or
+        before some value in one of the two coordinates, given that
+        coordinate's lists and total.
+        """
+
+        # checkpoints after the split point come after those before it
+        k = bisect.bisect_left(after, total - value)
+        if k < len(after):
+            return (self.__chars - self.__after_chars[k],
+                    self.__bytes - self.__after_bytes[k])
+
+        k = bisect.bisect_right(before, value) - 1
+        if k >= 0:
+            return self.__before_chars[k], self.__before_bytes[k]
+
+        return 0, 0
+
+    def from_char(self, index):
+        """Return the offsets of the last checkpoint at or before an index."""
+        return self.__nearest(index, self.__before_chars, self.__after_chars,
+                self.__chars)
+
+    def from_byte(self, offset):
+        """Return the offsets of the last checkpoint at or before an offset."""
+        return self.__nearest(offset, self.__before_bytes, self.__after_bytes,
+                self.__bytes)
+
+    def replace(self, start, removed, inserted, removed_bytes, inserted_bytes,
+            text):
+        """
+        Update the checkpoints for 'removed' characters (of 'removed_bytes'
+        bytes) at the start index having been replaced by 'inserted' characters
+        (of 'inserted_bytes' bytes), where text(start, stop) decodes the edited
+        content between two byte offsets.
+        """
+
+        # drop the checkpoints in the replaced range, the last ones after the
+        # split point once it's been moved to the start of it.
+        self.__move(start)
+        k = bisect.bisect_right(self.__after_chars,
+                self.__chars - start - removed)
+        del self.__after_chars[k:]
+        del self.__after_bytes[k:]
+
+        self.__chars += inserted - removed
+        self.__bytes += inserted_bytes - removed_bytes
+        self.__split = start + inserted
+
+        # add checkpoints between the ones around the edit if they're now too
+        # far apart, which also covers any inserted characters.
+        low_char, low_byte = 0, 0
+        if self.__before_chars:
+            low_char = self.__before_chars[-1]
+            low_byte = self.__before_bytes[-1]
+
+        high_char, high_byte = self.__chars, self.__bytes
+        if self.__after_chars:
+            high_char -= self.__after_chars[-1]
+            high_byte -= self.__after_bytes[-1]
+
+        interval = self.interval
+        if high_char - low_char > 2 * interval:
+            content = text(low_byte, high_byte)
+            for i in xrange(interval, len(content), interval):
+                low_byte += len(content[i - interval:i].encode("utf-8"))
+                self.__before_chars.append(low_char + i)
+                self.__before_bytes.append(low_byte)
+
+            self.__split = high_char
+
+class multigapbuffer(_basebuffer):
+    """
+    A gap buffer with one gap per cursor, for editing at several places at once.
+    The content is split into spans at each cursor, each of which is a gapbuffer
+    that keeps its gap at (or next to) its cursor, so inserting or deleting at
+    any cursor costs about as much as it would in a gapbuffer whose gap was
+    already in place. Cursors are identified by the ids add_cursor() returns.
+    Otherwise, a multigapbuffer supports the same interface as a gapbuffer.
+    """
+
+    def __init__(self, typecode, initial_content=[], cursors=(), gap_size=100,
+            policy=None):
+        """
+        Create a multigapbuffer. typecode, initial_content, gap_size and policy
+        are as for gapbuffer. cursors is an iterable of positions to create
+        cursors at, whose ids are assigned in order starting from 0.
+        """
+
+        _basebuffer.__init__(self, typecode)
+
+        self.gap_size = gap_size
+        self.policy = policy
+        self.__typecode = typecode
+
+        # each cursor sits at the end of the span at the same index, and the
+        # final span holds the content after the last cursor.
+        self.__spans = [self.__span(self._to_array(initial_content))]
+        self.__cursors = []
+        self.__next_cursor = 0
+
+        # the index in the content each span starts at, so spans can be found
+        # by bisection, and the length of the content.
+        self.__starts = []
+        self.__length = 0
+        self.__reindex(0)
+
+        for position in cursors:
+            self.add_cursor(position)
+
+    def __span(self, content=[]):
+        """Create a new span holding the given content."""
+        return gapbuffer(self.typecode, content, gap_size=self.gap_size,
+                policy=self.policy)
+
+    @property
+    def typecode(self):
+        """The read-only typecode of this multigapbuffer."""
+        return self.__typecode
+
+    @property
+    def cursors(self):
+        """The ids of this multigapbuffer's cursors, in document order."""
+        return list(self.__cursors)
+
+    def __len__(self):
+        """Get the length of the buffer."""
+        return self.__length
+
+    def chunks(self, size=None, reverse=False):
+        """
+        Iterate over the contents of the buffer as a series of array.array
+        chunks, as gapbuffer.chunks() does.
+        """
+
+        if size is not None and size < 1:
+            raise ValueError("chunk size must be at least 1")
+
+        spans = reversed(self.__spans) if reverse else self.__spans
+        for span in spans:
+            for chunk in span.chunks(size, reverse):
+                yield chunk
+
+    def __locate(self, index):
+        """
+        Return the number of the span containing an index, and the index's
+        offset within that span. Indices at the boundary between two spans
+        belong to the later one, so the cursor there stays put when content is
+        inserted at the index. The end of the buffer belongs to the final span.
+        """
+
+        # empty spans share their start with the span after them, so the last
+        # span starting at or before the index is the one containing it.
+        number = bisect.bisect_right(self.__starts, index) - 1
+        return number, index - self.__starts[number]
+
+    def __reindex(self, number):
+        """
+        Recompute the index each span starts at from the span with the given
+        number on, after the lengths of the spans from there on have changed.
+        This takes time proportional to the number of spans after it.
+        """
+
+        del self.__starts[number:]
+
+        index = 0
+        if number > 0:
+            index = self.__starts[-1] + len(self.__spans[number - 1])
+
+        for span in self.__spans[number:]:
+            self.__starts.append(index)
+            index += len(span)
+
+        self.__length = index
+
+    def __cursor_number(self, cursor):
+        """Return the number of the span a cursor sits at the end of."""
+
+        try:
+            return self.__cursors.index(cursor)
+        except ValueError:
+            raise ValueError(self.__class__.__name__ + " has no cursor " +
+                    repr(cursor))
+
+    def __span_copy(self, span, start, stop):
+        """Copy a slice of a span to a new array.array."""
+
+        items = array.array(self.typecode)
+        for chunk in span[start:stop].chunks():
+            items.extend(chunk)
+        return items
+
+    def _item(self, index):
+        number, offset = self.__locate(index)
+        return self.__spans[number][offset]
+
+    def _copy(self, start, stop):
+        items = array.array(self.typecode)
+
+        number, offset = self.__locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            span = self.__spans[number]
+            count = min(remaining, len(span) - offset)
+            items.extend(self.__span_copy(span, offset, offset + count))
+
+            remaining -= count
+            number += 1
+            offset = 0
+
+        return items
+
+    def _replace(self, start, stop, items):
+        number, offset = self.__locate(start)
+
+        # most edits are confined to a single span
+        span = self.__spans[number]
+        if stop - start <= len(span) - offset:
+            span[offset:offset + stop - start] = items
+            self.__reindex(number + 1)
+            return
+
+        # otherwise delete the range span by span. cursors within it collapse to
+        # its start as the spans between them empty out.
+        first = number
+        remaining = stop - start
+        while remaining > 0:
+            span = self.__spans[number]
+            count = min(remaining, len(span) - offset)
+            del span[offset:offset + count]
+
+            remaining -= count
+            number += 1
+            offset = 0
+
+        self.__reindex(first)
+
+        number, offset = self.__locate(start)
+        self.__spans[number][offset:offset] = items
+        self.__reindex(number + 1)
+
+    def add_cursor(self, index):
+        """
+        Add a cursor at the given index (which may be the length of the buffer)
+        and return its id.
+        """
+
+        cursor = self.__next_cursor
+        self.__add_cursor(cursor, index)
+        self.__next_cursor += 1
+
+        return cursor
+
+    def __add_cursor(self, cursor, index):
+        """Add a cursor with the given id at some index."""
+
+        if not -len(self) <= index <= len(self):
+            raise IndexError(self.__class__.__name__ + " index out of range")
+        index = index + len(self) if index < 0 else index
+
+        # split the span containing the index in two at the index
+        number, offset = self.__locate(index)
+        span = self.__spans[number]
+
+        self.__spans.insert(number + 1, self.__span(
+            self.__span_copy(span, offset, len(span))))
+        del span[offset:]
+
+        self.__cursors.insert(number, cursor)
+        self.__reindex(number + 1)
+
+    def remove_cursor(self, cursor):
+        """Remove the cursor with the given id."""
+
+        number = self.__cursor_number(cursor)
+        left, right = self.__spans[number], self.__spans[number + 1]
+
+        # merge the spans on either side by copying the smaller into the larger
+        if len(left) >= len(right):
+            left[len(left):] = self.__span_copy(right, 0, len(right))
+            del self.__spans[number + 1]
+        else:
+            right[0:0] = self.__span_copy(left, 0, len(left))
+            del self.__spans[number]
+
+        del self.__cursors[number]
+        self.__reindex(number)
+
+    def position(self, cursor):
+        """Return the index the cursor with the given id is at."""
+
+        # the cursor sits at the start of the span after it
+        return self.__starts[self.__cursor_number(cursor) + 1]
+
+    def move_cursor(self, cursor, index):
+        """
+        Move the cursor with the given id to some index. Moving a cursor past
+        its neighbours costs as much as removing and re-adding it, otherwise
+        only the items it moves over are copied.
+        """
+
+        if not -len(self) <= index <= len(self):
+            raise IndexError(self.__class__.__name__ + " index out of range")
+        index = index + len(self) if index < 0 else index
+
+        number = self.__cursor_number(cursor)
+        left, right = self.__spans[number], self.__spans[number + 1]
+
+        position = self.position(cursor)
+        distance = index - position
+
+        if -len(left) <= distance <= len(right):
+            # shift the items between the old and new positions across
+            if distance > 0:
+                left[len(left):] = self.__span_copy(right, 0, distance)
+                del right[:distance]
+            elif distance < 0:
+                right[0:0] = self.__span_copy(left, len(left) + distance,
+                        len(left))
+                del left[len(left) + distance:]
+
+            self.__reindex(number + 1)
+        else:
+            self.remove_cursor(cursor)
+            self.__add_cursor(cursor, index)
+
+    def insert_at(self, cursor, items):
+        """
+        Insert the items in an iterable at the cursor with the given id, leaving
+        the cursor after them.
+        """
+
+        number = self.__cursor_number(cursor)
+        span = self.__spans[number]
+        span[len(span):] = items
+        self.__reindex(number + 1)
+
+    def delete_at(self, cursor, count=1, forward=False):
+        """
+        Delete up to 'count' items before the cursor with the given id, or after
+        it if 'forward' is True.
+        """
+
+        number = self.__cursor_number(cursor)
+
+        if forward:
+            span = self.__spans[number + 1]
+            if count <= len(span):
+                del span[:count]
+                self.__reindex(number + 2)
+            else:
+                position = self.position(cursor)
+                del self[position:position + count]
+        else:
+            span = self.__spans[number]
+            if count <= len(span):
+                del span[len(span) - count:]
+                self.__reindex(number + 1)
+            else:
+                position = self.position(cursor)
+                del self[max(0, position - count):position]
+
+class piecetable(_basebuffer):
+    """
+    A buffer stored as a piece table: an immutable original buffer holding the
+    initial content, an append-only add buffer holding everything inserted
+    since, and a list of pieces saying which runs of those two buffers make up
+    the content, in order. Edits only ever append to the add buffer and split,
+    replace, or drop pieces, so their cost depends on the number of edits made
+    rather than on the size of the content. Otherwise, a piecetable supports the
+    same interface as a gapbuffer.
+    """
+
+    def __init__(self, typecode, initial_content=[]):
+        """
+        Create a piecetable. typecode and initial_content are as for gapbuffer.
+        """
+
+        _basebuffer.__init__(self, typecode)
+        self.__typecode = typecode
+
+        # copy the initial content so nobody else can change it under us
+        original = self._to_array(initial_content)
+        if original is initial_content:
+            original = original[:]
+
+        # the append-only buffer holding all inserted items
+        self.__add = array.array(typecode)
+
+        # each piece is a (source buffer, start, length) tuple, and each entry
+        # in starts is the index in the content its piece begins at.
+        self.__pieces = []
+        self.__starts = []
+        self.__length = 0
+
+        if len(original) > 0:
+            self.__pieces.append((original, 0, len(original)))
+            self.__starts.append(0)
+            self.__length = len(original)
+
+    @classmethod
+    def frommap(cls, typecode, source):
+        """
+        Create a piecetable whose initial content is a memory-mapped file,
+        given either as a path or as a file object opened for reading. The file
+        isn't read up front; its content is only copied out of the map as it's
+        accessed, and edits are kept in the add buffer, so the memory used is
+        proportional to what's edited rather than to the size of the file. The
+        file's size must be a multiple of the typecode's item size, and it
+        shouldn't be changed while the piecetable is in use.
+        """
+
+        if isinstance(source, basestring):
+            with open(source, "rb") as f:
+                return cls.frommap(typecode, f)
+
+        # empty files can't be mapped, but then there's nothing to map anyway
+        size = os.fstat(source.fileno()).st_size
+        if size == 0:
+            return cls(typecode)
+
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        original = _mappedsource(typecode, mapped)
+        if len(original) * array.array(typecode).itemsize != size:
+            mapped.close()
+            raise ValueError("file size is not a multiple of item size")
+
+        return cls._fromsources(typecode, [(original, 0, len(original))])
+
+    @classmethod
+    def _fromsources(cls, typecode, pieces):
+        """
+        Create a piecetable whose content is made up of a list of (source
+        buffer, start, length) pieces. The sources are referenced rather than
+        copied, so they mustn't change the items the pieces cover, or must
+        _detach() them first.
+        """
+
+        table = cls(typecode)
+
+        for piece in pieces:
+            if piece[2] > 0:
+                table.__pieces.append(piece)
+                table.__starts.append(table.__length)
+                table.__length += piece[2]
+
+        return table
+
+    def snapshot(self):
+        """
+        Return an immutable snapshot of the buffer's current content. Our
+        sources are never overwritten, so the snapshot simply shares them.
+        """
+        return snapshot._fromsources(self.typecode, self.__pieces)
+
+    @property
+    def typecode(self):
+        """The read-only typecode of this piecetable."""
+        return self.__typecode
+
+    def __len__(self):
+        """Get the length of the buffer."""
+        return self.__length
+
+    def chunks(self, size=None, reverse=False):
+        """
+        Iterate over the contents of the buffer as a series of array.array
+        chunks, as gapbuffer.chunks() does. Chunks never span pieces.
+        """
+
+        if size is not None and size < 1:
+            raise ValueError("chunk size must be at least 1")
+
+        pieces = reversed(self.__pieces) if reverse else self.__pieces
+        for source, start, length in pieces:
+            step = length if size is None else size
+
+            offsets = xrange(start, start + length, max(1, step))
+            if reverse:
+                offsets = reversed(offsets)
+
+            for offset in offsets:
+                chunk = source[offset:min(offset + step, start + length)]
+                if reverse:
+                    chunk.reverse()
+                yield chunk
+
+    def __locate(self, index):
+        """Return the number of the piece containing some in-range index."""
+        return bisect.bisect_right(self.__starts, index) - 1
+
+    def __split(self, index):
+        """
+        Make sure a piece starts at some index, splitting the piece containing it
+        if necessary, and return that piece's number. The end of the content is
+        treated as the start of a piece past the final one.
+        """
+
+        if index >= self.__length:
+            return len(self.__pieces)
+
+        number = self.__locate(index)
+        offset = index - self.__starts[number]
+
+        if offset > 0:
+            source, start, length = self.__pieces[number]
+
+            self.__pieces[number] = (source, start, offset)
+            self.__pieces.insert(number + 1,
+                    (source, start + offset, length - offset))
+            self.__starts.insert(number + 1, index)
+
+            number += 1
+
+        return number
+
+    def _item(self, index):
+        number = self.__locate(index)
+        source, start, length = self.__pieces[number]
+        return source[start + index - self.__starts[number]]
+
+    def _copy(self, start, stop):
+        items = array.array(self.typecode)
+        if start >= stop:
+            return items
+
+        number = self.__locate(start)
+        offset = start - self.__starts[number]
+
+        remaining = stop - start
+        while remaining > 0:
+            source, piece_start, length = self.__pieces[number]
+            count = min(remaining, length - offset)
+            items.extend(source[piece_start + offset:
+                    piece_start + offset + count])
+
+            remaining -= count
+            number += 1
+            offset = 0
+
+        return items
+
+    def _replace(self, start, stop, items):
+        first = self.__split(start)
+        last = self.__split(stop)
+
+        new_pieces = []
+        if len(items) > 0:
+            add_start = len(self.__add)
+            self.__add.extend(items)
+
+            # grow the previous piece rather than adding a new one when it ends
+            # where the new items begin, as it does when typing.
+            previous = self.__pieces[first - 1] if first > 0 else None
+            if (previous is not None and previous[0] is self.__add and
+                    previous[1] + previous[2] == add_start):
+                first -= 1
+                new_pieces.append((self.__add, previous[1],
+                    previous[2] + len(items)))
+            else:
+                new_pieces.append((self.__add, add_start, len(items)))
+
+        # replace the pieces covering the range, then fix up the piece starts
+        self.__pieces[first:last] = new_pieces
+
+        index = self.__starts[first] if first < len(self.__starts) else start
+        del self.__starts[first:]
+        for source, piece_start, length in self.__pieces[first:]:
+            self.__starts.append(index)
+            index += length
+
+        self.__length += len(items) - (stop - start)
+
+    def _detach(self, source, start, stop):
+        """
+        Copy any items between some start and stop index in a source buffer
+        that our pieces refer to into the add buffer, so the source can be
+        changed without changing our content. Returns whether any pieces still
+        refer to the source afterwards.
+        """
+
+        shared = False
+        pieces = []
+        starts = []
+
+        for piece, index in itertools.izip(self.__pieces, self.__starts):
+            piece_source, piece_start, length = piece
+            piece_stop = piece_start + length
+
+            if (piece_source is not source or piece_stop <= start or
+                    piece_start >= stop):
+                shared = shared or piece_source is source
+                pieces.append(piece)
+                starts.append(index)
+                continue
+
+            # keep sharing the parts of the piece outside the range
+            low = max(start, piece_start)
+            high = min(stop, piece_stop)
+
+            if piece_start < low:
+                pieces.append((source, piece_start, low - piece_start))
+                starts.append(index)
+                shared = True
+
+            add_start = len(self.__add)
+            self.__add.extend(source[low:high])
+            pieces.append((self.__add, add_start, high - low))
+            starts.append(index + low - piece_start)
+
+            if high < piece_stop:
+                pieces.append((source, high, piece_stop - high))
+                starts.append(index + high - piece_start)
+                shared = True
+
+        self.__pieces = pieces
+        self.__starts = starts
+
+        return shared
+
+class snapshot(piecetable):
+    """
+    An immutable copy of the content of a buffer, as returned by its snapshot()
+    method. A snapshot supports the same interface as a gapbuffer except for
+    changing its content, which raises a TypeError.
+    """
+
+    def __add__(self, other):
+        """
+        Concatenate the other iterable to this one and return the result as a
+        new snapshot.
+        """
+        return snapshot(self.typecode,
+                self._copy(0, len(self)) + self._to_array(other))
+
+    def _replace(self, start, stop, items):
+        raise TypeError(self.__class__.__name__ + " is read-only")
+
+class utf8gapbuffer(_basebuffer):
+    """
+    A text buffer with the 'u' typecode that stores its content as UTF-8 in a
+    'c' gapbuffer, using a quarter of the memory of a 'u' gapbuffer for mostly
+    ASCII text (or half, where unicode characters take two bytes). It's still
+    indexed by character: a sparse index of the byte offset of every
+    CHECKPOINT_INTERVAL characters translates indices to byte offsets in
+    logarithmic time plus the time to decode the bytes from the nearest
+    checkpoint. Otherwise, a utf8gapbuffer supports the same interface as a
+    'u' gapbuffer, with string searches done directly on the UTF-8 bytes.
+    """
+
+    # the number of characters between the checkpoints used to find byte
+    # offsets, which trades the memory they use against the bytes decoded for
+    # every lookup.
+    CHECKPOINT_INTERVAL = 128
+
+    def __init__(self, typecode, initial_content=[], gap_size=100, policy=None):
+        """
+        Create a utf8gapbuffer. typecode must be 'u', and initial_content,
+        gap_size and policy are as for gapbuffer, with the gap size in bytes.
+        """
+
+        _basebuffer.__init__(self, typecode)
+        if typecode != "u":
+            raise ValueError(self.__class__.__name__ +
+                    " requires the 'u' typecode")
+
+        self.__bytes = gapbuffer("c", gap_size=gap_size, policy=policy)
+        self.__checkpoints = _checkpointindex(
+                utf8gapbuffer.CHECKPOINT_INTERVAL)
+        self.__length = 0
+
+        self._replace(0, 0, self._to_array(initial_content))
+
+    @property
+    def typecode(self):
+        """The read-only typecode of this utf8gapbuffer."""
+        return "u"
+
+    @property
+    def encoded_size(self):
+        """The number of bytes in the UTF-8 encoding of the content."""
+        return len(self.__bytes)
+
+    def __len__(self):
+        """Get the length of the buffer in characters."""
+        return self.__length
+
+    def __raw(self, start, stop):
+        """
+        Return the UTF-8 bytes between two offsets as a str, copying them
+        straight out of the byte buffer without moving its gap.
+        """
+
+        before, after = self.__bytes.segments()
+        split = len(before)
+
+        if stop <= split:
+            return before[start:stop]
+        elif start >= split:
+            return after[start - split:stop - split]
+        return before[start:] + after[:stop - split]
+
+    def __decode(self, start, stop):
+        """Decode the content between two byte offsets."""
+        return self.__raw(start, stop).decode("utf-8")
+
+    def byte_offset(self, index):
+        """
+        Return the offset in the UTF-8 encoded content of the character at some
+        index, which may be the length of the buffer.
+        """
+
+        if not 0 <= index <= self.__length:
+            raise IndexError(self.__class__.__name__ + " index out of range")
+
+        char, offset = self.__checkpoints.from_char(index)
+        if char == index:
+            return offset
+
+        # decode enough bytes to be sure of holding the characters in between,
+        # ignoring any character cut off at the end.
+        raw = self.__raw(offset, min(len(self.__bytes),
+                offset + 4 * (index - char)))
+        return offset + len(
+                raw.decode("utf-8", "ignore")[:index - char].encode("utf-8"))
+
+    def char_index(self, offset):
+        """
+        Return the index of the character starting at some offset in the UTF-8
+        encoded content.
+        """
+
+        if not 0 <= offset <= len(self.__bytes):
+            raise IndexError(self.__class__.__name__ + " offset out of range")
+
+        char, start = self.__checkpoints.from_byte(offset)
+        return char + len(self.__decode(start, offset))
+
+    def chunks(self, size=None, reverse=False):
+        """
+        Iterate over the contents of the buffer as a series of array.array
+        chunks of at most 'size' characters (default all of them), as
+        gapbuffer.chunks() does.
+        """
+
+        if size is not None and size < 1:
+            raise ValueError("chunk size must be at least 1")
+
+        step = max(1, self.__length if size is None else size)
+        offsets = xrange(0, self.__length, step)
+        if reverse:
+            offsets = reversed(offsets)
+
+        for offset in offsets:
+            chunk = self._copy(offset, min(offset + step, self.__length))
+            if reverse:
+                chunk.reverse()
+            yield chunk
+
+    def _item(self, index):
+        start = self.byte_offset(index)
+        return self.__raw(start, min(len(self.__bytes), start + 4)).decode(
+                "utf-8", "ignore")[0]
+
+    def _copy(self, start, stop):
+        items = array.array("u")
+        if stop > start:
+            items.fromunicode(self.__decode(self.byte_offset(start),
+                    self.byte_offset(stop)))
+        return items
+
+    def _replace(self, start, stop, items):
+        byte_start = self.byte_offset(start)
+        byte_stop = self.byte_offset(stop)
+        encoded = items.tounicode().encode("utf-8")
+
+        self.__bytes[byte_start:byte_stop] = encoded
+        self.__length += len(items) - (stop - start)
+        self.__checkpoints.replace(start, stop - start, len(items),
+                byte_stop - byte_start, len(encoded), self.__decode)
+
+    def __encode(self, sub):
+        """
+        Return a string to search for as UTF-8, or None if it can't be searched
+        for in the bytes directly.
+        """
+
+        if not isinstance(sub, basestring) or len(sub) == 0:
+            return None
+        return unicode(sub).encode("utf-8")
+
+    def count(self, item):
+        """Return the number of times 'item' occurs in this buffer."""
+
+        # UTF-8 never encodes one character as part of another, so matching the
+        # bytes matches the characters.
+        encoded = self.__encode(item)
+        if encoded is None:
+            return _basebuffer.count(self, item)
+
+        return self.__bytes.count(encoded)
+
+    def find(self, sub, start=0, end=None):
+        """
+        Return the lowest index in this buffer where the string 'sub' is found
+        within the slice between the optional start (default 0) and end
+        (default end of buffer) values, or -1 if it isn't found.
+        """
+
+        encoded = self.__encode(sub)
+        if encoded is None:
+            return _basebuffer.find(self, sub, start, end)
+
+        start, end, step = slice(start, end).indices(len(self))
+        offset = self.__bytes.find(encoded, self.byte_offset(start),
+                self.byte_offset(max(start, end)))
+        return -1 if offset == -1 else self.char_index(offset)
+
+    def rfind(self, sub, start=0, end=None):
+        """
+        Return the highest index in this buffer where the string 'sub' is found
+        within the slice between the optional start (default 0) and end
+        (default end of buffer) values, or -1 if it isn't found.
+        """
+
+        encoded = self.__encode(sub)
+        if encoded is None:
+            return _basebuffer.rfind(self, sub, start, end)
+
+        start, end, step = slice(start, end).indices(len(self))
+        offset = self.__bytes.rfind(encoded, self.byte_offset(start),
+                self.byte_offset(max(start, end)))
+        return -1 if offset == -1 else self.char_index(offset)
+
+class _mappedsource(object):
+    """
+    A read-only view of a memory-mapped file as a sequence of items of some
+    type, for use as the original buffer of a piecetable. Slicing it copies just
+    the items in the slice out of the map into a new array.array.
+    """
+
+    def __init__(self, typecode, mapped):
+        self.__typecode = typecode
+        self.__map = mapped
+        self.__itemsize = array.array(typecode).itemsize
+
+    def __len__(self):
+        return len(self.__map) // self.__itemsize
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            start, stop, step = x.indices(len(self))
+
+            items = array.array(self.__typecode)
+            if stop > start:
+                items.fromstring(self.__map[start * self.__itemsize:
+                        stop * self.__itemsize])
+
+            return items if step == 1 else items[::step]
+
+        return self[x:x + 1][0]
+
+# the buffer classes create() can make, by name
+BACKENDS = {
+    "gapbuffer": gapbuffer,
+    "multigapbuffer": multigapbuffer,
+    "piecetable": piecetable,
+    "utf8gapbuffer": utf8gapbuffer,
+}
+
+def create(typecode, initial_content=[], backend="gapbuffer", **kwargs):
+    """
+    Create a buffer with the given typecode and initial content using the named
+    backend (see BACKENDS for valid names, default "gapbuffer"). Any remaining
+    keyword arguments are passed to the backend's constructor.
+    """
+
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("unknown backend " + repr(backend) +
+                " (must be one of " + ", ".join(sorted(BACKENDS)) + ")")
+
+    return cls(typecode, initial_content, **kwargs)
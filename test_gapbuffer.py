@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 
+import array
+import os
+import pickle
+import re
+import tempfile
 import unittest
+import weakref
+
+# NumPy is optional, so the tests using it are skipped if it isn't installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # correct content for each typecode
 VALID_CONTENT = {
@@ -242,6 +254,42 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual(cmp(s1, s2), cmp(b1, s2))
 
+    def test_cmp_native(self):
+        """Do comparisons with arrays, strings, and buffers match lists'?"""
+
+        for typecode, first, second in [("c", "abcab", "abd"),
+                ("u", u"abcab", u"abd"), ("i", [1, 2, 3, 1, 2], [1, 2, 4]),
+                ("d", [0.5, 1.0], [0.5, 1.0, -1.0])]:
+            # put the gap in the middle of the content
+            b = gapbuffer(typecode, first, gap_size=2)
+            b.insert(2, first[0])
+            del b[2]
+
+            others = [gapbuffer(typecode, second),
+                    array.array(typecode, second), first, second[:0],
+                    array.array(typecode, first)]
+            if typecode in ["c", "u"]:
+                others += [second, first[:3]]
+
+            for other in others:
+                expected = cmp(list(first), list(other))
+
+                self.assertEqual(cmp(b, other), expected)
+                self.assertEqual(b == other, expected == 0)
+                self.assertEqual(b != other, expected != 0)
+                self.assertEqual(b < other, expected < 0)
+                self.assertEqual(b <= other, expected <= 0)
+                self.assertEqual(b > other, expected > 0)
+                self.assertEqual(b >= other, expected >= 0)
+
+    def test_sort(self):
+        """Do buffers sort the same way as their content?"""
+
+        words = ["pear", "apple", "fig", "apples", "", "banana"]
+        buffers = sorted(gapbuffer("c", word) for word in words)
+
+        self.assertEqual([str(b) for b in buffers], sorted(words))
+
     def test_in_nonstring(self):
         """Do non string-based buffers contain items that are in them?"""
 
@@ -409,6 +457,18 @@ class TestGapBuffer(unittest.TestCase):
             b *= 2
             self.assertEqual(b, content * 2)
 
+
+    def test_mul_gap_middle(self):
+        """Does multiplying include the content on both sides of the gap?"""
+
+        b = gapbuffer("i", range(5), gap_size=2)
+        b.insert(2, 9)
+
+        self.assertEqual(b * 3, [0, 1, 9, 2, 3, 4] * 3)
+
+        b *= 2
+        self.assertEqual(b, [0, 1, 9, 2, 3, 4] * 2)
+
     def test_len(self):
         """Does getting the length of a gapbuffer work?"""
 
@@ -485,6 +545,14 @@ class TestGapBuffer(unittest.TestCase):
             for i in xrange(1, len(content) + 1):
                 self.assertEqual(content[-i], b[-i])
 
+    def test_get_index_negative_gap_moved(self):
+        """Does getting a negative index work when the gap isn't at the start?"""
+
+        b = gapbuffer("i", range(5))
+        b.append(5)
+
+        self.assertEqual(b[-3], 3)
+
     def test_get_index_out_of_bounds(self):
         """Does getting an out-of-bounds index work?"""
 
@@ -538,6 +606,15 @@ class TestGapBuffer(unittest.TestCase):
 
             self.assertEqual([i for i in reversed(content)], b)
 
+    def test_set_index_negative_gap_moved(self):
+        """Does setting a negative index work when the gap isn't at the start?"""
+
+        b = gapbuffer("i", range(5))
+        b.append(5)
+        b[-3] = -1
+
+        self.assertEqual(b, [0, 1, 2, -1, 4, 5])
+
     def test_set_index_out_of_bounds(self):
         """Does setting an out-of-bounds index work?"""
 
@@ -625,6 +702,30 @@ class TestGapBuffer(unittest.TestCase):
             self.assertEqual(b[2::2], content[2::2])
             self.assertEqual(b[::len(b)], content[::len(content)])
 
+    def test_get_slice_across_gap(self):
+        """Does getting a slice that spans the gap work?"""
+
+        b = gapbuffer("i", range(10))
+        b.insert(5, -1)
+        l = range(5) + [-1] + range(5, 10)
+
+        self.assertEqual(b[2:8], l[2:8])
+        self.assertEqual(b[:5], l[:5])
+        self.assertEqual(b[6:], l[6:])
+        self.assertEqual(b[8:2], l[8:2])
+
+    def test_get_slice_extended_across_gap(self):
+        """Does getting an extended slice that spans the gap work?"""
+
+        b = gapbuffer("i", range(10))
+        b.insert(5, -1)
+        l = range(5) + [-1] + range(5, 10)
+
+        for step in [2, 3, -1, -2, -3]:
+            self.assertEqual(b[::step], l[::step])
+            self.assertEqual(b[1:9:step], l[1:9:step])
+            self.assertEqual(b[9:1:step], l[9:1:step])
+
     def test_set_slice_empty(self):
         """Does setting an empty slice work?"""
 
@@ -652,6 +753,27 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual(b, content)
 
+    def test_set_slice_wrong_type(self):
+        """Does setting a slice to a string of the wrong type raise TypeError?
+        """
+
+        for typecode, value in [("b", "ab"), ("i", "abcd"), ("d", "abcdefgh"),
+                ("u", "abcdefgh"), ("c", u"ab")]:
+            for backend in ["gapbuffer", "multigapbuffer", "piecetable"]:
+                b = create(typecode, VALID_CONTENT[typecode], backend=backend)
+
+                with self.assertRaises(TypeError):
+                    b[0:0] = value
+                self.assertEqual(b, VALID_CONTENT[typecode])
+
+    def test_set_slice_other_array_type(self):
+        """Does setting a slice to an array of another type convert it?"""
+
+        b = gapbuffer("i", [0, 1, 2])
+        b[1:2] = array.array("h", [5, 6])
+
+        self.assertEqual(b, [0, 5, 6, 2])
+
     def test_set_slice_entire_range(self):
         """Does setting the entire range work?"""
 
@@ -907,6 +1029,24 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual(b, content)
 
+    def test_extend_wrong_type(self):
+        """Does extending with a string of the wrong type raise TypeError?"""
+
+        for typecode, value in [("i", "abcd"), ("d", "abcdefgh"),
+                ("u", "abcdefgh")]:
+            b = gapbuffer(typecode, VALID_CONTENT[typecode])
+
+            with self.assertRaises(TypeError):
+                b.extend(value)
+            self.assertEqual(b, VALID_CONTENT[typecode])
+
+        # the line index is left alone too
+        b = gapbuffer("u", u"one\ntwo")
+        self.assertEqual(b.line_count(), 2)
+        with self.assertRaises(TypeError):
+            b.extend("\nthree")
+        self.assertEqual(b.line_count(), 2)
+
     def test_append_congruency(self):
         """Is appending an item the same as setting the final slice to a one-
         element list?
@@ -1107,6 +1247,123 @@ class TestGapBuffer(unittest.TestCase):
         with self.assertRaises(ValueError):
             b.index(0, 0, -(len(b) * 2))
 
+    def test_index_across_chunks(self):
+        """Do index(), count(), and 'in' work across chunks and the gap?"""
+
+        content = [i % 1000 for i in xrange(gapbuffer.ITER_CHUNK_SIZE * 3)]
+        b = gapbuffer("i", content)
+
+        # put the gap part way through the second chunk
+        middle = gapbuffer.ITER_CHUNK_SIZE + 100
+        b.insert(middle, -1)
+        del b[middle]
+
+        for item, start, end in [(5, 0, None), (5, 4000, None),
+                (999, middle - 1, middle + 1000), (-1, 0, None),
+                (5, -3000, -2000), (5, 6, 1005)]:
+            try:
+                expected = content.index(item, start,
+                        len(content) if end is None else end)
+            except ValueError:
+                expected = None
+
+            try:
+                self.assertEqual(b.index(item, start, end), expected)
+            except ValueError:
+                self.assertEqual(expected, None)
+
+        self.assertEqual(b.count(5), content.count(5))
+        self.assertTrue(999 in b)
+        self.assertFalse(1000 in b)
+
+    def test_find(self):
+        """Does find() return the first index of a substring?"""
+
+        b = gapbuffer("c", "abcabc")
+        self.assertEqual(b.find("bc"), 1)
+        self.assertEqual(b.find("bc", 2), 4)
+        self.assertEqual(b.find("bc", 2, 5), -1)
+        self.assertEqual(b.find("x"), -1)
+        self.assertEqual(b.find(""), 0)
+
+        # empty strings are found at the end, but not past it or in a range that
+        # ends before it starts, like str.find()
+        self.assertEqual(b.find("", 6), 6)
+        self.assertEqual(b.find("", 7), -1)
+        self.assertEqual(b.rfind("", 7), -1)
+        self.assertEqual(b.find("", 4, 2), -1)
+        self.assertEqual(b.rfind("", 4, 2), -1)
+        self.assertEqual(b.find("", -1, -3), -1)
+        self.assertEqual(b.find("", 2, 2), 2)
+
+    def test_find_across_gap(self):
+        """Does find() find substrings that span the gap?"""
+
+        for typecode in ["c", "u"]:
+            content = VALID_CONTENT[typecode]
+            b = gapbuffer(typecode, content * 2)
+
+            # move the gap into the middle of the second copy of the content
+            b.insert(4, content[0])
+            del b[4]
+
+            self.assertEqual(b.find(content[:2] * 2), -1)
+            self.assertEqual(b.find(content[2:] + content[:2]), 2)
+
+    def test_find_keeps_gap(self):
+        """Does find() search without moving the gap?"""
+
+        b = gapbuffer("c", "hello world")
+        b.insert(5, ",")
+
+        self.assertEqual(b.find("o, w"), 4)
+        self.assertEqual(str(b.segments()[0]), "hello,")
+
+    def test_find_non_text(self):
+        """Does find() on non-text buffers raise a TypeError?"""
+
+        with self.assertRaises(TypeError):
+            gapbuffer("i", [1, 2, 3]).find("a")
+
+    def test_rfind(self):
+        """Does rfind() return the last index of a substring?"""
+
+        b = gapbuffer("c", "aaaa")
+        b.insert(2, "a")
+
+        self.assertEqual(b.rfind("aa"), 3)
+        self.assertEqual(b.rfind("aa", 0, 3), 1)
+        self.assertEqual(b.rfind("b"), -1)
+        self.assertEqual(b.rfind(""), 5)
+
+    def test_search(self):
+        """Does search() return the span of the first match?"""
+
+        b = gapbuffer("c", "one two three")
+        b.insert(7, "!")
+
+        self.assertEqual(b.search("t[a-z]+"), (4, 7))
+        self.assertEqual(b.search("o!"), (6, 8))
+        self.assertEqual(b.search("x"), None)
+
+    def test_search_greedy_across_gap(self):
+        """Do greedy matches continue across the gap?"""
+
+        b = gapbuffer("c", "baaaab")
+        b.insert(3, "a")
+
+        self.assertEqual(b.search("a+"), (1, 6))
+
+    def test_finditer(self):
+        """Does finditer() find all non-overlapping matches?"""
+
+        b = gapbuffer("c", "ab ab ab")
+        b.insert(4, "b")
+
+        self.assertEqual(list(b.finditer("ab+")), [(0, 2), (3, 6), (7, 9)])
+        self.assertEqual(list(b.finditer("x*")),
+                [(i, i) for i in xrange(len(b) + 1)])
+
     def test_insert(self):
         """Does insert work?"""
 
@@ -1399,6 +1656,192 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual([i for i in reversed(b1)], b2)
 
+    def test_reverse_gap_middle(self):
+        """Does reversing work with the gap in the middle of the content?"""
+
+        b = gapbuffer("c", "one\ntwo\nthree", gap_size=3)
+        self.assertEqual(b.line_count(), 3)
+        b.insert(5, "x")
+
+        b.reverse()
+        self.assertEqual(b, "eerht\nowxt\neno")
+        self.assertEqual(b.getline(1), "owxt")
+
+        # the buffer should still work normally afterwards
+        b.insert(6, "y")
+        b.append("!")
+        self.assertEqual(b, "eerht\nyowxt\neno!")
+
+    def test_iter(self):
+        """Does iterating over the buffer skip the gap?"""
+
+        for typecode in VALID_CONTENT:
+            content = VALID_CONTENT[typecode]
+            b = gapbuffer(typecode, content)
+
+            # move the gap into the middle of the content
+            b.insert(1, content[0])
+
+            self.assertEqual([i for i in b],
+                    [content[0], content[0]] + list(content[1:]))
+
+    def test_iter_reversed(self):
+        """Does reverse iteration over the buffer skip the gap?"""
+
+        for typecode in VALID_CONTENT:
+            content = VALID_CONTENT[typecode]
+            b = gapbuffer(typecode, content)
+            b.insert(1, content[0])
+
+            self.assertEqual([i for i in reversed(b)],
+                    list(reversed([content[0], content[0]] + list(content[1:]))))
+
+    def test_chunks(self):
+        """Do chunks cover the content without spanning the gap?"""
+
+        b = gapbuffer("i", range(10))
+        b.insert(5, -1)
+
+        self.assertEqual([c.tolist() for c in b.chunks()],
+                [range(5) + [-1], range(5, 10)])
+        self.assertEqual([c.tolist() for c in b.chunks(4)],
+                [[0, 1, 2, 3], [4, -1], [5, 6, 7, 8], [9]])
+
+    def test_chunks_reverse(self):
+        """Do reversed chunks yield the content from the end, reversed?"""
+
+        b = gapbuffer("i", range(10))
+        b.insert(5, -1)
+
+        self.assertEqual([c.tolist() for c in b.chunks(4, reverse=True)],
+                [[9], [8, 7, 6, 5], [-1, 4], [3, 2, 1, 0]])
+
+    def test_chunks_empty(self):
+        """Does an empty buffer yield no chunks?"""
+
+        self.assertEqual(list(gapbuffer("i").chunks()), [])
+
+    def test_chunks_invalid_size(self):
+        """Does asking for chunks of less than one item raise a ValueError?"""
+
+        for backend in ["gapbuffer", "multigapbuffer", "piecetable",
+                "utf8gapbuffer"]:
+            b = create("u", u"hello", backend=backend)
+            for size in [0, -1]:
+                with self.assertRaises(ValueError):
+                    list(b.chunks(size))
+
+    def test_segments(self):
+        """Do the segment views cover the content on either side of the gap?"""
+
+        b = gapbuffer("c", "hello world")
+        b.insert(5, ",")
+
+        before, after = b.segments()
+        self.assertEqual(str(before) + str(after), "hello, world")
+        self.assertEqual(str(before), "hello,")
+
+    def test_segments_item_bytes(self):
+        """Do the segment views cover whole items for multi-byte types?"""
+
+        b = gapbuffer("i", range(10))
+        b.insert(5, -1)
+
+        before, after = b.segments()
+        content = str(before) + str(after)
+
+        self.assertEqual(content, array.array("i", b).tostring())
+
+    def test_segments_read_only(self):
+        """Are the segment views read-only?"""
+
+        before, after = gapbuffer("c", "abc").segments()
+        with self.assertRaises(TypeError):
+            after[0] = "z"
+
+    def test_segments_keep_gap(self):
+        """Does getting the segment views leave the gap where it was?"""
+
+        b = gapbuffer("c", "hello world")
+        b.insert(5, ",")
+        b.segments()
+
+        self.assertEqual(len(str(b.segments()[0])), len("hello,"))
+
+    def test_line_count(self):
+        """Does line_count() count the lines in a text buffer?"""
+
+        self.assertEqual(gapbuffer("c").line_count(), 1)
+        self.assertEqual(gapbuffer("c", "a\nb").line_count(), 2)
+        self.assertEqual(gapbuffer("u", u"a\nb\n").line_count(), 3)
+
+    def test_line_to_offset(self):
+        """Does line_to_offset() find the start of each line?"""
+
+        b = gapbuffer("c", "one\ntwo\n\nfour")
+
+        self.assertEqual([b.line_to_offset(n) for n in xrange(4)], [0, 4, 8, 9])
+        self.assertEqual(b.line_to_offset(1, 2), 6)
+
+        with self.assertRaises(IndexError):
+            b.line_to_offset(4)
+
+    def test_offset_to_line(self):
+        """Does offset_to_line() find the line and column of an index?"""
+
+        b = gapbuffer("c", "one\ntwo\n\nfour")
+
+        self.assertEqual(b.offset_to_line(0), (0, 0))
+        self.assertEqual(b.offset_to_line(3), (0, 3))
+        self.assertEqual(b.offset_to_line(4), (1, 0))
+        self.assertEqual(b.offset_to_line(8), (2, 0))
+        self.assertEqual(b.offset_to_line(len(b)), (3, 4))
+
+        with self.assertRaises(IndexError):
+            b.offset_to_line(len(b) + 1)
+
+    def test_getline(self):
+        """Does getline() return each line without its newline?"""
+
+        b = gapbuffer("c", "one\ntwo\n\nfour")
+        self.assertEqual([b.getline(n) for n in xrange(4)],
+                ["one", "two", "", "four"])
+
+    def test_lines_after_edits(self):
+        """Is the line index kept up to date as the buffer is edited?"""
+
+        b = gapbuffer("c", "one\ntwo\nthree")
+        b.line_count()
+
+        b.insert(3, "\n")
+        del b[8]
+        b[-5:] = "3\n4"
+        b.extend("\nfive")
+        b[0] = "\n"
+
+        self.assertEqual(str(b), "\nne\n\ntwo3\n4\nfive")
+        self.assertEqual([b.getline(n) for n in xrange(b.line_count())],
+                ["", "ne", "", "two3", "4", "five"])
+        self.assertEqual(b.offset_to_line(9), (3, 4))
+
+    def test_lines_after_context_manager(self):
+        """Are changes made through the context manager seen by line lookups?"""
+
+        b = gapbuffer("c", "one\ntwo")
+        b.line_count()
+
+        with b as raw:
+            raw.extend("\nthree")
+
+        self.assertEqual(b.line_count(), 3)
+        self.assertEqual(b.getline(2), "three")
+
+    def test_lines_non_text(self):
+        """Do line lookups on non-text buffers raise a TypeError?"""
+
+        with self.assertRaises(TypeError):
+            gapbuffer("i", [1, 2, 3]).line_count()
+
     def test_str(self):
         """Does __str__ work?"""
         for typecode in VALID_CONTENT:
@@ -1445,6 +1888,19 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual(b, ([-1] * gap_size) + range(5))
 
+    def test_move_gap_farther_than_gap_size(self):
+        """Does moving the gap farther than its own length work?"""
+
+        gap_size = 3
+        b = gapbuffer("i", range(50), gap_size=gap_size)
+
+        # force the gap to the start, then to the end, then to the middle
+        b.insert(0, -1)
+        b.insert(len(b), -2)
+        b.insert(25, -3)
+
+        self.assertEqual(b, [-1] + range(24) + [-3] + range(24, 50) + [-2])
+
     def test_resize_gap(self):
         """Does increasing the gap size work?"""
 
@@ -1476,21 +1932,1729 @@ class TestGapBuffer(unittest.TestCase):
 
         self.assertEqual(b, range(5) + ([-1] * (gap_size * 4)))
 
-if __name__ == "__main__":
-    import sys
+    def test_resize_gap_large_insert(self):
+        """Does inserting far more items than the gap holds work?"""
 
-    # generate coverage data if coverage module is available
-    try:
-        from coverage import coverage
-        cov = coverage(config_file=False, branch=True, omit=["test_*.py"])
-        cov.start()
-    except ImportError:
-        cov = None
+        b = gapbuffer("i", range(10), gap_size=3)
+        b[5:5] = range(1000)
 
-    # imported here so coverage can catch the function/class definitions
-    from gapbuffer import gapbuffer
+        self.assertEqual(b, range(5) + range(1000) + range(5, 10))
+
+    def test_policy_grow(self):
+        """Does the growth policy size new gaps by factor, min and max?"""
+
+        policy = growthpolicy(factor=0.5, min_gap=10, max_gap=100)
+
+        self.assertEqual(policy.grow(5, 0, 3), 15)
+        self.assertEqual(policy.grow(5, 100, 3), 55)
+        self.assertEqual(policy.grow(5, 1000, 3), 105)
+        self.assertEqual(growthpolicy(factor=0).grow(5, 1000, 3), 8)
+
+    def test_policy_shrink(self):
+        """Does the growth policy only shrink gaps past its threshold?"""
+
+        self.assertEqual(growthpolicy().shrink(1000, 3), None)
+        self.assertEqual(growthpolicy(shrink_threshold=10).shrink(10, 3), None)
+        self.assertEqual(growthpolicy(shrink_threshold=10).shrink(11, 3), 3)
+        self.assertEqual(
+                growthpolicy(min_gap=5, shrink_threshold=10).shrink(11, 3), 5)
+
+    def test_policy_used_for_growth(self):
+        """Is the buffer's policy consulted when the gap must grow?"""
+
+        calls = []
+
+        class recordingpolicy(growthpolicy):
+            def grow(self, needed, length, gap_size):
+                calls.append((needed, length, gap_size))
+                return growthpolicy.grow(self, needed, length, gap_size)
+
+        b = gapbuffer("i", range(5), gap_size=3, policy=recordingpolicy())
+        b[0:0] = range(10)
+
+        self.assertEqual(calls, [(10, 5, 3)])
+        self.assertEqual(b, range(10) + range(5))
+
+    def test_trim(self):
+        """Does trimming the gap after a large deletion keep the content?"""
+
+        b = gapbuffer("i", range(1000), gap_size=3)
+        del b[10:990]
+        b.trim()
+
+        self.assertEqual(b, range(10) + range(990, 1000))
+
+        # the buffer should still work normally after trimming
+        b[10:10] = range(5)
+        self.assertEqual(b, range(10) + range(5) + range(990, 1000))
+
+    def test_auto_shrink(self):
+        """Does a policy with a shrink threshold keep the content intact?"""
+
+        policy = growthpolicy(shrink_threshold=20)
+        b = gapbuffer("i", range(100), gap_size=3, policy=policy)
+
+        del b[10:90]
+        del b[0]
+        b[0:2] = [-1]
+
+        self.assertEqual(b, [-1] + range(3, 10) + range(90, 100))
+
+    def test_apply_edits(self):
+        """Does applying a batch of edits match making them one at a time?"""
+
+        b = gapbuffer("c", "the quick brown fox", gap_size=2)
+        b.apply_edits([(16, 19, "dog"), (0, 3, "a"), (10, 10, "red "),
+                (4, 10, "")])
+
+        self.assertEqual(b, "a red brown dog")
+
+        # the buffer should still work normally afterwards
+        b.insert(0, ">")
+        b.append("!")
+        self.assertEqual(b, ">a red brown dog!")
+
+    def test_apply_edits_insertions(self):
+        """Are insertions at the same index applied in the order given?"""
+
+        b = gapbuffer("i", range(5))
+        b.apply_edits([(2, 3, [-1]), (2, 2, [10]), (2, 2, [11]), (5, 5, [12])])
+
+        self.assertEqual(b, [0, 1, 10, 11, -1, 3, 4, 12])
+
+    def test_apply_edits_empty(self):
+        """Does applying no edits leave the buffer alone?"""
+
+        b = gapbuffer("c", "hello")
+        b.apply_edits([])
+        self.assertEqual(b, "hello")
+
+    def test_apply_edits_invalid(self):
+        """Are invalid batches rejected without changing the buffer?"""
+
+        b = gapbuffer("c", "hello")
+
+        with self.assertRaises(ValueError):
+            b.apply_edits([(0, 3, "j"), (2, 4, "")])
+        with self.assertRaises(IndexError):
+            b.apply_edits([(0, 1, "j"), (4, 6, "")])
+        with self.assertRaises(IndexError):
+            b.apply_edits([(3, 2, "")])
+        with self.assertRaises(TypeError):
+            b.apply_edits([(0, 1, "j"), (2, 3, [1])])
+
+        self.assertEqual(b, "hello")
+
+    def test_apply_edits_lines(self):
+        """Is the line index kept up to date by a batch of edits?"""
+
+        b = gapbuffer("c", "one\ntwo\nthree")
+        self.assertEqual(b.line_count(), 3)
+
+        b.apply_edits([(3, 4, " "), (8, 8, "\n\n")])
+
+        self.assertEqual(b.line_count(), 4)
+        self.assertEqual(b.getline(0), "one two")
+        self.assertEqual(b.getline(3), "three")
+
+    def test_no_instance_dict(self):
+        """Do gapbuffers do without an instance dictionary?"""
+
+        b = gapbuffer("c", "abc")
+        with self.assertRaises(AttributeError):
+            b.name = "cell"
+
+        # they can still be weakly referenced
+        self.assertTrue(weakref.ref(b)() is b)
+
+    def test_lazy_gap(self):
+        """Is the gap only allocated by the first edit that isn't an append?"""
+
+        stats = bufferstats()
+        b = gapbuffer("c", "abc", stats=stats)
+
+        b.append("d")
+        b.extend("ef")
+        self.assertEqual(stats.gap_moves, 0)
+        self.assertEqual(stats.bytes_allocated, 3)
+        self.assertEqual(str(b.segments()[0]), "abcdef")
+
+        b.insert(1, "x")
+        self.assertEqual(b, "axbcdef")
+        self.assertTrue(stats.bytes_allocated > 3 + b.gap_size)
+
+    def test_pickle(self):
+        """Do gapbuffers survive pickling with every protocol?"""
+
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            b = gapbuffer("c", "hello world", journal=editjournal())
+            b.insert(5, ",")
+            m = b.add_marker(7)
+            s = b.snapshot()
+
+            copy, marker_copy, snapshot_copy = pickle.loads(
+                    pickle.dumps((b, m, s), protocol))
+            self.assertEqual(copy, "hello, world")
+            self.assertEqual(copy.gap_size, b.gap_size)
+            self.assertEqual(marker_copy.position, 7)
+
+            # the copy can be edited, leaving the original and snapshots alone
+            copy.insert(0, ">")
+            copy[1] = "H"
+            self.assertEqual(copy, ">Hello, world")
+            self.assertEqual(marker_copy.position, 8)
+            self.assertEqual(b, "hello, world")
+            self.assertEqual(snapshot_copy, "hello, world")
+
+            # and keeps its journal
+            self.assertTrue(copy.undo())
+            self.assertEqual(copy, ">hello, world")
+
+class TestNumeric(unittest.TestCase):
+    # the operations here are vectorized with NumPy if it's installed, and the
+    # results should be the same either way.
+
+    def make(self, typecode="i", content=range(10)):
+        """Return a gapbuffer with its gap in the middle of its content."""
+
+        b = gapbuffer(typecode, content, gap_size=3)
+        middle = len(b) // 2
+        b.insert(middle, content[0])
+        del b[middle]
+
+        return b
+
+    def test_sum(self):
+        """Does sum() add up the items on both sides of the gap?"""
+
+        self.assertEqual(self.make().sum(), 45)
+        self.assertEqual(self.make("d", [0.5, 1.5, 2.0]).sum(), 4.0)
+        self.assertEqual(gapbuffer("i").sum(), 0)
+
+    def test_min_max(self):
+        """Do min() and max() find the extreme items?"""
+
+        b = self.make("h", [3, -7, 12, 0, 5])
+
+        self.assertEqual(b.min(), -7)
+        self.assertEqual(b.max(), 12)
+
+    def test_min_max_empty(self):
+        """Do min() and max() raise a ValueError on an empty buffer?"""
+
+        b = gapbuffer("d")
+
+        with self.assertRaises(ValueError):
+            b.min()
+        with self.assertRaises(ValueError):
+            b.max()
+
+    def test_count_index(self):
+        """Do count(), index(), and 'in' match list's results?"""
+
+        content = [1, 5, 2, 5, 3, 5]
+        b = self.make("B", content)
+
+        for item in [5, 5.0, 5.5, -1, 256, "5"]:
+            self.assertEqual(b.count(item), content.count(item))
+            self.assertEqual(item in b, item in content)
+
+        self.assertEqual(b.index(5), 1)
+        self.assertEqual(b.index(5, 2), 3)
+        self.assertEqual(b.index(5, -2), 5)
+        with self.assertRaises(ValueError):
+            b.index(5, 2, 3)
+        with self.assertRaises(ValueError):
+            b.index(256)
+
+    def test_float_precision(self):
+        """Are floats compared at full precision in float buffers?"""
+
+        b = self.make("f", [0.1, 0.5])
+
+        # 0.1 can't be stored exactly as a single-precision float
+        self.assertEqual(b.count(0.1), 0)
+        self.assertEqual(b.count(0.5), 1)
+
+    def test_argwhere(self):
+        """Does argwhere() find the indices of matching items?"""
+
+        b = self.make()
+        self.assertEqual(b.argwhere(lambda x: x % 3 == 0), [0, 3, 6, 9])
+        self.assertEqual(b.argwhere(lambda x: x > 100), [])
+
+    def test_apply(self):
+        """Does apply() replace each item with the function's result?"""
+
+        b = self.make()
+        b.apply(lambda x: x * 2 + 1)
+
+        self.assertEqual(b, [x * 2 + 1 for x in range(10)])
+
+    def test_apply_text(self):
+        """Do text buffers apply functions item by item?"""
+
+        b = gapbuffer("c", "hello")
+        b.apply(lambda c: c.upper())
+
+        self.assertEqual(b, "HELLO")
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_vectorized(self):
+        """Are functions given whole arrays when NumPy is installed?"""
+
+        calls = []
+        def double(a):
+            calls.append(a)
+            return a * 2
+
+        b = self.make()
+        b.apply(double)
+
+        self.assertEqual(b, range(0, 20, 2))
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(isinstance(a, numpy.ndarray) for a in calls))
+
+    def outcomes(self, typecode, content, operation):
+        """
+        Return what operation(buffer) does on a buffer of some content with and
+        without NumPy, as either its result and the buffer's content or the type
+        of error it raised.
+        """
+
+        module = sys.modules[gapbuffer.__module__]
+        outcomes = []
+        for vectorize in [True, False]:
+            saved = module.numpy
+            module.numpy = module.numpy if vectorize else None
+            try:
+                b = self.make(typecode, content)
+                outcomes.append((operation(b), list(b)))
+            except (TypeError, OverflowError) as e:
+                outcomes.append(type(e))
+            finally:
+                module.numpy = saved
+
+        return outcomes
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_sum_matches_python(self):
+        """Does sum() give the same result with and without NumPy?"""
+
+        for typecode, content in [
+                ("L", [2 ** 63, 2 ** 63]),
+                ("l", [2 ** 62] * 4),
+                ("b", [100] * 3),
+                ("I", [2 ** 32 - 1] * 3),
+                ("f", [0.5, 0.25]),
+                ("d", [0.5, 1.5, 2.0]),
+                ("d", [1e16] + [1.0] * 10150)]:
+            vectorized, python = self.outcomes(typecode, content,
+                    lambda b: b.sum())
+            self.assertEqual(vectorized, python)
+            self.assertEqual(python[0], sum(content))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_min_max_match_python(self):
+        """Do min() and max() treat NaNs the same with and without NumPy?"""
+
+        nan = float("nan")
+        for typecode, content in [
+                ("d", [2.0, nan, -1.0, 3.0]),
+                ("d", [nan, 2.0, -1.0]),
+                ("f", [1.0, 2.0, nan, nan, nan]),
+                ("i", [4, -2, 9])]:
+            for operation in [lambda b: b.min(), lambda b: b.max()]:
+                vectorized, python = self.outcomes(typecode, content,
+                        operation)
+
+                # compare NaNs by their representation, since they're unequal
+                self.assertEqual(repr(vectorized), repr(python))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_apply_matches_python(self):
+        """Does apply() give the same result or error with and without NumPy?"""
+
+        for typecode, content, function in [
+                ("i", [1, 2, 3], lambda x: x * 2),
+                ("h", [1, -2, 3], lambda x: x // 2),
+                ("l", [2 ** 62], lambda x: x + 1),
+                ("f", [0.5, 1.5], lambda x: x * 3),
+                ("b", [100, 1], lambda x: x * 2),
+                ("B", [1], lambda x: x - 2),
+                ("L", [2 ** 63], lambda x: x * 2),
+                ("i", [1, 2], lambda x: x * 2.7)]:
+            vectorized, python = self.outcomes(typecode, content,
+                    lambda b: b.apply(function))
+            self.assertEqual(vectorized, python)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_argwhere_matches_python(self):
+        """Does argwhere() give the same result with and without NumPy?"""
+
+        vectorized, python = self.outcomes("b", [100, 10, 60],
+                lambda b: b.argwhere(lambda x: x * 2 > 100))
+        self.assertEqual(vectorized, python)
+
+class TestBufferStats(unittest.TestCase):
+    def test_disabled(self):
+        """Do buffers not count anything by default?"""
+        self.assertEqual(gapbuffer("c", "hello").stats, None)
+
+    def test_initial_content(self):
+        """Is creating a buffer with initial content not counted?"""
+
+        stats = bufferstats()
+        gapbuffer("c", "hello", stats=stats)
+
+        self.assertEqual(stats.as_dict(), dict((name, 0)
+                for name in bufferstats.COUNTERS))
+
+    def test_gap_moves(self):
+        """Are gap moves and the items they copy counted?"""
+
+        stats = bufferstats()
+        b = gapbuffer("c", "hello world", stats=stats)
+
+        # the gap starts empty at the start of the content, so the first insert
+        # allocates it by shifting the content along.
+        b.insert(0, ">")
+        b.insert(6, ",")
+        b.insert(1, " ")
+        b.append("!")
+
+        self.assertEqual(stats.gap_moves, 3)
+        self.assertEqual(stats.gap_move_distance, 5 + 6 + 12)
+        self.assertEqual(stats.items_copied, 11 + 5 + 6 + 12)
+
+    def test_resizes(self):
+        """Are resizes and the memory they allocate counted?"""
+
+        stats = bufferstats()
+        b = gapbuffer("i", range(10), gap_size=2, stats=stats)
+
+        b.extend(range(100))
+
+        self.assertEqual(stats.resizes, 1)
+        self.assertTrue(stats.bytes_allocated >= 98 * array.array("i").itemsize)
+
+    def test_collapses_and_searches(self):
+        """Are context manager collapses and searches counted?"""
+
+        stats = bufferstats()
+        b = gapbuffer("c", "one two one", stats=stats)
+
+        with b:
+            pass
+        b.find("two")
+        "three" in b
+        list(b.finditer("one"))
+
+        self.assertEqual(stats.collapses, 1)
+        self.assertEqual(stats.searches, 3)
+
+    def test_shared_and_reset(self):
+        """Can stats be shared between buffers and reset?"""
+
+        stats = bufferstats()
+        b1 = gapbuffer("c", "hello", stats=stats)
+        b2 = gapbuffer("c", "world", stats=stats)
+
+        b1.insert(1, "!")
+        b2.insert(1, "!")
+        self.assertEqual(stats.as_dict()["gap_moves"], 2)
+        self.assertTrue(b1.stats is b2.stats is stats)
+
+        stats.reset()
+        self.assertEqual(stats.gap_moves, 0)
+        self.assertEqual(stats.gap_move_distance, 0)
+
+class TestBufferProfiler(unittest.TestCase):
+    def make(self, content="hello world"):
+        """
+        Return a profiled gapbuffer, its profiler, and a list that the profiler
+        sinks operations into. Every operation appears to take one second.
+        """
+
+        times = iter(xrange(1000))
+        samples = []
+        profiler = bufferprofiler(sink=lambda *sample: samples.append(sample),
+                timer=lambda: next(times))
+
+        return gapbuffer("c", content, profiler=profiler), profiler, samples
+
+    def test_bucket(self):
+        """Are values bucketed by the power of two at least as large?"""
+
+        self.assertEqual([bufferprofiler.bucket(v) for v in
+                [0, 1, 2, 3, 4, 5, 8, 9, 1000]], [0, 1, 2, 4, 4, 8, 8, 16, 1024])
+
+    def test_sink(self):
+        """Is each operation sunk with its length and gap distance?"""
+
+        b, profiler, samples = self.make()
+
+        b.insert(5, ",")
+        b.extend("!")
+        b[0] = "j"
+        del b[1]
+        "world" in b
+        b.count("o")
+        b.index("w")
+
+        self.assertEqual(samples, [
+            ("insert", 1, 11, 5),
+            ("extend", 1, 12, 6),
+            ("__setitem__", 1, 13, 0),
+            ("__delitem__", 1, 13, 12),
+            ("__contains__", 1, 12, 0),
+            ("count", 1, 12, 0),
+            ("index", 1, 12, 0),
+        ])
+        self.assertEqual(b, "jllo, world!")
+
+    def test_histograms(self):
+        """Are latencies and distances recorded in histograms?"""
+
+        b, profiler, samples = self.make()
+
+        b.insert(3, "x")
+        b.insert(0, "x")
+        b.insert(1, "x")
+
+        # one second is a million microseconds, bucketed up to 2 ** 20
+        self.assertEqual(profiler.as_dict(), {"insert": {
+            "latency": {2 ** 20: 3},
+            "distance": {4: 2, 0: 1},
+        }})
+
+        profiler.reset()
+        self.assertEqual(profiler.as_dict(), {})
+
+    def test_failed_operation(self):
+        """Are operations that raise errors still recorded?"""
 
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestGapBuffer)
+        b, profiler, samples = self.make()
+
+        with self.assertRaises(ValueError):
+            b.index("z")
+
+        self.assertEqual(samples, [("index", 1, 11, 0)])
+
+    def test_appearance(self):
+        """Do profiled buffers look like any other gapbuffer?"""
+
+        b, profiler, samples = self.make("hi")
+
+        self.assertTrue(isinstance(b, gapbuffer))
+        self.assertEqual(repr(b), "gapbuffer('c', 'hi')")
+        self.assertTrue(b.profiler is profiler)
+        self.assertTrue(b.stats is not None)
+        self.assertEqual(gapbuffer("c").profiler, None)
+
+    def test_subclass(self):
+        """Are the operations of gapbuffer subclasses profiled too?"""
+
+        class subclass(gapbuffer):
+            pass
+
+        samples = []
+        profiler = bufferprofiler(sink=lambda *sample: samples.append(sample))
+        b = subclass("c", "hi", profiler=profiler)
+        b.insert(1, "!")
+
+        self.assertEqual(type(b), subclass)
+        self.assertEqual([sample[0] for sample in samples], ["insert"])
+
+class TestEditJournal(unittest.TestCase):
+    def test_no_journal(self):
+        """Does undo without a journal raise a ValueError?"""
+
+        b = gapbuffer("c", "hello")
+        with self.assertRaises(ValueError):
+            b.undo()
+
+    def test_nothing_to_undo(self):
+        """Do undo and redo report when there's nothing to do?"""
+
+        b = gapbuffer("c", "hello", journal=editjournal())
+        self.assertFalse(b.undo())
+        self.assertFalse(b.redo())
+        self.assertEqual(b, "hello")
+
+    def test_undo_redo(self):
+        """Can each kind of edit be undone and redone?"""
+
+        b = gapbuffer("c", "hello world", journal=editjournal())
+
+        b[5:5] = ","
+        b.append("!")
+        del b[0]
+        b[0] = "j"
+        b[6:11] = "there"
+        del b[::2]
+
+        states = ["hello world", "hello, world", "hello, world!",
+                "ello, world!", "jllo, world!", "jllo, there!"]
+        for state in reversed(states):
+            self.assertTrue(b.undo())
+            self.assertEqual(b, state)
+        self.assertFalse(b.undo())
+
+        for state in states[1:]:
+            self.assertTrue(b.redo())
+            self.assertEqual(b, state)
+
+    def test_redo_cleared(self):
+        """Does a new edit forget the edits that could have been redone?"""
+
+        b = gapbuffer("c", "abc", journal=editjournal())
+        b.append("d")
+        b.undo()
+        b.append("e")
+
+        self.assertFalse(b.redo())
+        b.undo()
+        self.assertEqual(b, "abc")
+
+    def test_group(self):
+        """Are grouped edits undone together?"""
+
+        b = gapbuffer("i", range(10), journal=editjournal())
+
+        with b.group():
+            del b[0]
+            with b.group():
+                b.insert(5, 100)
+            b[0] = -1
+        b.append(10)
+
+        b.undo()
+        self.assertEqual(b, [-1, 2, 3, 4, 5, 100, 6, 7, 8, 9])
+        b.undo()
+        self.assertEqual(b, range(10))
+        b.redo()
+        self.assertEqual(b, [-1, 2, 3, 4, 5, 100, 6, 7, 8, 9])
+
+    def test_typing_merged(self):
+        """Is typing in a group stored as a single edit?"""
+
+        journal = editjournal()
+        b = gapbuffer("c", "", journal=journal)
+
+        with b.group():
+            for c in "hello":
+                b.append(c)
+
+        self.assertEqual(journal.undo_count, 1)
+        self.assertEqual(journal.pop_undo(), [(0, array.array("c"),
+                array.array("c", "hello"))])
+
+    def test_limit(self):
+        """Are the oldest edits forgotten once the journal is over its limit?"""
+
+        journal = editjournal(limit=10)
+        b = gapbuffer("c", "", journal=journal)
+
+        b.extend("abcd")
+        b.extend("efgh")
+        b.extend("ijkl")
+
+        self.assertEqual(journal.undo_count, 2)
+        b.undo()
+        b.undo()
+        self.assertEqual(b, "abcd")
+        self.assertFalse(b.undo())
+
+    def test_apply_edits(self):
+        """Is a batch of edits undone and redone together?"""
+
+        b = gapbuffer("c", "hello world", journal=editjournal())
+        b.apply_edits([(0, 1, "j"), (5, 6, ", "), (11, 11, "!")])
+        self.assertEqual(b, "jello, world!")
+
+        b.undo()
+        self.assertEqual(b, "hello world")
+        b.redo()
+        self.assertEqual(b, "jello, world!")
+
+    def test_context_manager(self):
+        """Are changes made to the raw buffer undoable?"""
+
+        b = gapbuffer("c", "hello", journal=editjournal())
+        with b as buf:
+            buf.reverse()
+
+        self.assertEqual(b, "olleh")
+        b.undo()
+        self.assertEqual(b, "hello")
+        b.redo()
+        self.assertEqual(b, "olleh")
+
+    def test_lines_after_undo(self):
+        """Is the line index kept up to date when undoing?"""
+
+        b = gapbuffer("c", "one\ntwo", journal=editjournal())
+        self.assertEqual(b.line_count(), 2)
+
+        b[3:3] = "\nthree"
+        self.assertEqual(b.line_count(), 3)
+        b.undo()
+        self.assertEqual(b.line_count(), 2)
+        self.assertEqual(b.getline(1), "two")
+
+class TestSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        """Does a snapshot hold the content from when it was taken?"""
+
+        b = gapbuffer("c", "hello world")
+        s = b.snapshot()
+
+        self.assertEqual(s, "hello world")
+        self.assertEqual(len(s), 11)
+        self.assertEqual(s[6:], "world")
+
+    def test_unchanged_by_edits(self):
+        """Do edits made after a snapshot leave the snapshot alone?"""
+
+        b = gapbuffer("i", range(20), gap_size=2)
+        b.insert(10, -1)
+        s = b.snapshot()
+
+        # type at the gap, move it both ways, overwrite, and regrow it
+        b.insert(11, -2)
+        b.insert(0, -3)
+        b[15] = -4
+        del b[5:8]
+        b[18:18] = range(50)
+        b.trim(0)
+
+        self.assertEqual(s, range(10) + [-1] + range(10, 20))
+
+    def test_unchanged_by_context_manager(self):
+        """Do changes to the raw buffer leave a snapshot alone?"""
+
+        b = gapbuffer("c", "hello")
+        s = b.snapshot()
+        with b as buf:
+            buf.reverse()
+
+        self.assertEqual(b, "olleh")
+        self.assertEqual(s, "hello")
+
+    def test_taken_in_context_manager(self):
+        """Do later changes to the raw buffer leave a snapshot taken with it?"""
+
+        b = gapbuffer("c", "hello")
+        with b as buf:
+            buf.reverse()
+            s = b.snapshot()
+            buf.extend("!!")
+            buf[0] = "O"
+
+        self.assertEqual(b, "Olleh!!")
+        self.assertEqual(s, "olleh")
+
+        # and after the context, snapshots share the buffer again
+        t = b.snapshot()
+        b[0] = "o"
+        self.assertEqual(t, "Olleh!!")
+
+    def test_many_snapshots(self):
+        """Does each of several snapshots keep its own content?"""
+
+        b = gapbuffer("c", "")
+        snapshots = []
+        for c in "hello world":
+            b.append(c)
+            snapshots.append(b.snapshot())
+
+        for i, s in enumerate(snapshots):
+            self.assertEqual(s, "hello world"[:i + 1])
+
+    def test_read_only(self):
+        """Does changing a snapshot raise a TypeError?"""
+
+        s = gapbuffer("c", "hello").snapshot()
+
+        with self.assertRaises(TypeError):
+            s[0] = "j"
+        with self.assertRaises(TypeError):
+            del s[0]
+        with self.assertRaises(TypeError):
+            s.append("!")
+
+        self.assertEqual(s, "hello")
+
+    def test_search(self):
+        """Does a snapshot support the read-only interface?"""
+
+        s = gapbuffer("c", "one two one").snapshot()
+
+        self.assertEqual(s.find("one", 1), 8)
+        self.assertEqual(s.count("o"), 3)
+        self.assertTrue("two" in s)
+        self.assertEqual(str(s), "one two one")
+
+    def test_concatenate(self):
+        """Can snapshots be concatenated and repeated into new snapshots?"""
+
+        b = gapbuffer("c", "hello")
+        s = b.snapshot()
+
+        t = s + " world"
+        self.assertTrue(isinstance(t, snapshot))
+        self.assertEqual(t, "hello world")
+        self.assertEqual(s + b, "hellohello")
+        self.assertEqual(s * 2, "hellohello")
+        self.assertEqual(s, "hello")
+
+    def test_read_only_context_manager(self):
+        """Can a snapshot be read through the context manager?"""
+
+        s = gapbuffer("c", "hello").snapshot()
+        with s as raw:
+            self.assertEqual(raw.tostring(), "hello")
+
+        with self.assertRaises(TypeError):
+            with s as raw:
+                raw.append("!")
+
+        self.assertEqual(s, "hello")
+
+    def test_apply_edits(self):
+        """Does a batch of edits leave a snapshot alone?"""
+
+        b = gapbuffer("c", "hello world")
+        s = b.snapshot()
+        b.apply_edits([(0, 1, "j"), (6, 11, "there")])
+
+        self.assertEqual(b, "jello there")
+        self.assertEqual(s, "hello world")
+
+    def test_other_backends(self):
+        """Do the other backends support snapshots too?"""
+
+        for backend in ["multigapbuffer", "piecetable"]:
+            b = create("c", "hello", backend=backend)
+            s = b.snapshot()
+            b[0] = "j"
+
+            self.assertEqual(s, "hello")
+            self.assertEqual(b, "jello")
+
+class TestNgramIndex(unittest.TestCase):
+    def test_find(self):
+        """Does find() use the index to give the same results?"""
+
+        b = gapbuffer("c", "the cat sat on the mat")
+        b.build_ngram_index()
+
+        self.assertEqual(b.find("the"), 0)
+        self.assertEqual(b.find("the", 1), 15)
+        self.assertEqual(b.find("at on"), 9)
+        self.assertEqual(b.find("the", 1, 17), -1)
+        self.assertEqual(b.find("dog"), -1)
+
+        # strings shorter than the n-grams are searched for as usual
+        self.assertEqual(b.find("m"), 19)
+
+    def test_count(self):
+        """Does count() only count occurences that don't overlap?"""
+
+        b = gapbuffer("u", u"aaaaaaa")
+        b.build_ngram_index(2)
+
+        self.assertEqual(b.count(u"aaa"), 2)
+        self.assertEqual(b.count(u"aa"), 3)
+        self.assertEqual(b.count(u"ab"), 0)
+
+    def test_contains(self):
+        """Does membership testing use the index?"""
+
+        b = gapbuffer("c", "hello world", stats=bufferstats())
+        b.build_ngram_index()
+
+        self.assertTrue("lo w" in b)
+        self.assertFalse("low" in b)
+        self.assertEqual(b.stats.searches, 2)
+
+    def test_edits(self):
+        """Is the index kept up to date through every kind of edit?"""
+
+        b = gapbuffer("c", "one two three", gap_size=2,
+                journal=editjournal())
+        b.build_ngram_index()
+
+        b[4:7] = "four"
+        b.insert(0, "z")
+        b[1] = "O"
+        del b[10:]
+        self.assertEqual(b, "zOne four ")
+        self.assertEqual(b.find("four"), 5)
+        self.assertEqual(b.find("two"), -1)
+
+        b.undo()
+        self.assertEqual(b.find("three"), 10)
+
+        b.apply_edits([(0, 1, ""), (10, 15, "3")])
+        self.assertEqual(b.find("ne f"), 1)
+        self.assertEqual(b.count("3"), 1)
+
+        b.reverse()
+        self.assertEqual(b.find("ruof"), 2)
+
+        with b as buf:
+            del buf[4:]
+        self.assertEqual(b.find(" ru"), 1)
+        self.assertEqual(b.find("ruof"), -1)
+
+    def test_large(self):
+        """Does the index work across many chunks of content?"""
+
+        words = ["alpha", "beta", "gamma", "delta"]
+        content = " ".join(words[i % 3] for i in xrange(5000))
+        b = gapbuffer("c", content)
+        b.build_ngram_index()
+
+        middle = len(content) // 2
+        b[middle:middle] = "delta "
+        b[0:5] = "delta"
+        content = "delta" + content[5:middle] + "delta " + content[middle:]
+
+        self.assertEqual(b.count("delta"), 2)
+        self.assertEqual(b.find("delta", 1), middle)
+        self.assertEqual(b.count("gamma alpha"), content.count("gamma alpha"))
+        self.assertEqual(b.find("a delta"), content.find("a delta"))
+
+    def test_stops_at_first_match(self):
+        """Do find() and membership stop checking at the first match?"""
+
+        class recording(gapbuffer):
+            copied = []
+
+            def _copy(self, start, stop):
+                recording.copied.append((start, stop))
+                return gapbuffer._copy(self, start, stop)
+
+        b = recording("c", "alpha beta " * 2000)
+        b.build_ngram_index()
+        del recording.copied[:]
+
+        self.assertEqual(b.find("beta"), 6)
+        self.assertTrue("beta alpha" in b)
+        self.assertEqual(b.find("beta", 20000), 20004)
+        self.assertEqual(recording.copied,
+                [(6, 10), (6, 16), (20004, 20008)])
+
+    def test_drop(self):
+        """Does dropping the index go back to searching the content?"""
+
+        b = gapbuffer("c", "hello world")
+        b.build_ngram_index()
+        b.drop_ngram_index()
+        b[0:5] = "jello"
+
+        self.assertEqual(b.find("ello"), 1)
+
+    def test_bad_index(self):
+        """Do bad typecodes and sizes raise errors?"""
+
+        with self.assertRaises(TypeError):
+            gapbuffer("i", [1, 2, 3]).build_ngram_index()
+        with self.assertRaises(ValueError):
+            gapbuffer("c", "abc").build_ngram_index(0)
+
+class TestMarkers(unittest.TestCase):
+    def test_add_marker(self):
+        """Does a new marker sit at the index it was added at?"""
+
+        b = gapbuffer("c", "hello world")
+        m = b.add_marker(6)
+
+        self.assertEqual(m.position, 6)
+        self.assertEqual(m.gravity, "left")
+        self.assertEqual(b.markers, [m])
+
+    def test_add_marker_out_of_range(self):
+        """Does adding a marker outside the content raise IndexError?"""
+
+        b = gapbuffer("c", "hello")
+        b.add_marker(5)
+
+        with self.assertRaises(IndexError):
+            b.add_marker(6)
+        with self.assertRaises(IndexError):
+            b.add_marker(-1)
+
+    def test_bad_gravity(self):
+        """Does an unknown gravity raise ValueError?"""
+
+        b = gapbuffer("c", "hello")
+        with self.assertRaises(ValueError):
+            b.add_marker(0, gravity="up")
+
+    def test_edits_before_and_after(self):
+        """Do markers follow edits before them and ignore edits after them?"""
+
+        b = gapbuffer("c", "hello world", gap_size=2)
+        m = b.add_marker(6)
+
+        b.insert(0, ">")
+        self.assertEqual(m.position, 7)
+        b[1:3] = "j"
+        self.assertEqual(m.position, 6)
+        b.extend("!!!")
+        del b[8:]
+        self.assertEqual(m.position, 6)
+        self.assertEqual(b[m.position:], "wo")
+
+    def test_insert_at_marker(self):
+        """Do inserts at a marker go after left and before right gravity?"""
+
+        b = gapbuffer("c", "ab")
+        left = b.add_marker(1, gravity="left")
+        right = b.add_marker(1, gravity="right")
+
+        b[1:1] = "xyz"
+        self.assertEqual(left.position, 1)
+        self.assertEqual(right.position, 4)
+
+    def test_delete_around_marker(self):
+        """Do markers in a replaced range collapse to its ends by gravity?"""
+
+        b = gapbuffer("c", "hello world")
+        left = b.add_marker(3, gravity="left")
+        right = b.add_marker(3, gravity="right")
+        end = b.add_marker(5)
+
+        b[2:5] = "LP"
+        self.assertEqual(left.position, 2)
+        self.assertEqual(right.position, 4)
+        self.assertEqual(end.position, 4)
+
+        del b[0:6]
+        self.assertEqual([m.position for m in b.markers], [0, 0, 0])
+
+    def test_order(self):
+        """Are markers listed in order of position as they're moved?"""
+
+        b = gapbuffer("i", range(100), gap_size=3)
+        markers = [b.add_marker(i) for i in [90, 10, 50, 30, 70]]
+
+        b[40:60] = []
+        b.insert(0, -1)
+        b.insert(95, -1)
+
+        self.assertEqual([m.position for m in b.markers], [11, 31, 41, 51, 71])
+        self.assertEqual(markers[2].position, 41)
+
+    def test_set_position(self):
+        """Does setting a marker's position move it?"""
+
+        b = gapbuffer("c", "hello world")
+        m = b.add_marker(0)
+        n = b.add_marker(5)
+
+        m.position = 11
+        self.assertEqual(b.markers, [n, m])
+
+        b.insert(8, "!")
+        self.assertEqual(m.position, 12)
+
+        with self.assertRaises(IndexError):
+            m.position = 13
+
+    def test_remove_marker(self):
+        """Does a removed marker stay where it was?"""
+
+        b = gapbuffer("c", "hello world")
+        m = b.add_marker(6)
+        b.remove_marker(m)
+
+        b[0:0] = "oh "
+        self.assertEqual(m.position, 6)
+        self.assertEqual(b.markers, [])
+
+        # it can't be removed again, or removed from another buffer
+        with self.assertRaises(ValueError):
+            b.remove_marker(m)
+        with self.assertRaises(ValueError):
+            gapbuffer("c").remove_marker(b.add_marker(0))
+        with self.assertRaises(ValueError):
+            m.position = 0
+
+    def test_reverse(self):
+        """Do markers stay between the same items when reversed?"""
+
+        b = gapbuffer("c", "abcdef")
+        m = b.add_marker(2)
+        b.reverse()
+
+        self.assertEqual(m.position, 4)
+        self.assertEqual(b[m.position - 1:m.position + 1], "cb")
+
+    def test_context_manager(self):
+        """Are markers clamped to the content after raw buffer changes?"""
+
+        b = gapbuffer("c", "hello world", gap_size=0)
+        m = b.add_marker(3)
+        n = b.add_marker(11)
+        with b as buf:
+            del buf[5:]
+
+        self.assertEqual(m.position, 3)
+        self.assertEqual(n.position, 5)
+
+    def test_undo(self):
+        """Do markers follow edits made by undo and redo?"""
+
+        b = gapbuffer("c", "hello world", journal=editjournal())
+        m = b.add_marker(6, gravity="right")
+
+        b[0:5] = "hi"
+        self.assertEqual(m.position, 3)
+        b.undo()
+        self.assertEqual(m.position, 6)
+        b.redo()
+        self.assertEqual(m.position, 3)
+
+    def test_apply_edits(self):
+        """Do markers follow a batch of edits?"""
+
+        b = gapbuffer("c", "one two three")
+        markers = [b.add_marker(i) for i in [4, 8, 13]]
+
+        b.apply_edits([(8, 13, "3"), (0, 3, "1"), (4, 7, "two!")])
+        self.assertEqual(b, "1 two! 3")
+        self.assertEqual([m.position for m in markers], [2, 7, 8])
+
+class TestMultiGapBuffer(unittest.TestCase):
+
+    def test_init_cursors(self):
+        """Are initial cursors created in order at the given positions?"""
+
+        b = multigapbuffer("c", "hello world", cursors=[0, 5, 11])
+
+        self.assertEqual(b, "hello world")
+        self.assertEqual(b.cursors, [0, 1, 2])
+        self.assertEqual([b.position(c) for c in b.cursors], [0, 5, 11])
+
+    def test_context_manager(self):
+        """Do cursors stay put through the context manager unless moved?"""
+
+        b = multigapbuffer("c", "hello world", cursors=[1, 5, 11])
+        with b:
+            pass
+        self.assertEqual([b.position(c) for c in b.cursors], [1, 5, 11])
+
+        # a change only moves the cursors after it
+        with b as raw:
+            raw[6:11] = array.array("c", "there!")
+        self.assertEqual(b, "hello there!")
+        self.assertEqual([b.position(c) for c in b.cursors][:2], [1, 5])
+
+    def test_insert_at(self):
+        """Does inserting at cursors leave each cursor after its insertion?"""
+
+        b = multigapbuffer("c", "hello world", cursors=[0, 5, 11])
+        b.insert_at(0, ">> ")
+        b.insert_at(1, ",")
+        b.insert_at(2, "!")
+
+        self.assertEqual(b, ">> hello, world!")
+        self.assertEqual([b.position(c) for c in b.cursors], [3, 9, 16])
+
+    def test_delete_at(self):
+        """Does deleting at cursors remove items on the right side?"""
+
+        b = multigapbuffer("c", "hello, world!", cursors=[6, 12])
+        b.delete_at(0)
+        b.delete_at(1, 2, forward=True)
+
+        self.assertEqual(b, "hello world")
+        self.assertEqual([b.position(c) for c in b.cursors], [5, 11])
+
+    def test_delete_at_past_other_cursors(self):
+        """Do deletions past other cursors collapse them?"""
+
+        b = multigapbuffer("i", range(10), cursors=[2, 4, 6])
+        b.delete_at(2, 5)
+
+        self.assertEqual(b, [0, 6, 7, 8, 9])
+        self.assertEqual([b.position(c) for c in b.cursors], [1, 1, 1])
+
+    def test_unknown_cursor(self):
+        """Do operations on unknown cursors raise ValueError?"""
+
+        b = multigapbuffer("i", range(10), cursors=[2])
+
+        with self.assertRaises(ValueError):
+            b.insert_at(1, [1])
+        with self.assertRaises(ValueError):
+            b.remove_cursor(1)
+
+    def test_add_cursor_out_of_bounds(self):
+        """Does adding a cursor outside the buffer raise IndexError?"""
+
+        with self.assertRaises(IndexError):
+            multigapbuffer("i", range(10)).add_cursor(11)
+
+    def test_move_cursor(self):
+        """Does moving cursors, including past each other, work?"""
+
+        b = multigapbuffer("i", range(10), cursors=[2, 5])
+
+        b.move_cursor(0, 4)
+        self.assertEqual([b.position(c) for c in b.cursors], [4, 5])
+
+        b.move_cursor(0, 1)
+        self.assertEqual([b.position(c) for c in b.cursors], [1, 5])
+
+        b.move_cursor(0, 8)
+        self.assertEqual(b.cursors, [1, 0])
+        self.assertEqual([b.position(c) for c in b.cursors], [5, 8])
+        self.assertEqual(b, range(10))
+
+    def test_remove_cursor(self):
+        """Does removing a cursor keep the content intact?"""
+
+        b = multigapbuffer("i", range(10), cursors=[2, 5, 8])
+        b.remove_cursor(1)
+
+        self.assertEqual(b, range(10))
+        self.assertEqual(b.cursors, [0, 2])
+
+    def test_sequence_interface(self):
+        """Does the sequence interface see the content across all spans?"""
+
+        b = multigapbuffer("c", "hello world", cursors=[3, 7])
+
+        self.assertEqual(len(b), 11)
+        self.assertEqual(b[4], "o")
+        self.assertEqual(b[-1], "d")
+        self.assertEqual(b[2:9], "llo wor")
+        self.assertEqual(b[::-2], "drwolh")
+        self.assertEqual(str(b), "hello world")
+        self.assertEqual(list(reversed(b)), list("dlrow olleh"))
+        self.assertTrue("o w" in b)
+        self.assertEqual(b.count("o"), 2)
+        self.assertEqual(b.index("w"), 6)
+        self.assertEqual(b.find("rl"), 8)
+        self.assertTrue(b < "world")
+
+    def test_edit_congruency(self):
+        """Do random edits and cursor edits behave like they do on a list?"""
+
+        import random
+        rng = random.Random(0)
+
+        b = multigapbuffer("i", range(20), cursors=[5, 10, 15], gap_size=2)
+        l = range(20)
+
+        for i in xrange(500):
+            operation = rng.randint(0, 4)
+            start = rng.randint(0, len(l))
+            stop = rng.randint(start, len(l))
+            items = [rng.randint(0, 9) for j in xrange(rng.randint(0, 4))]
+
+            if operation == 0:
+                b[start:stop] = items
+                l[start:stop] = items
+            elif operation == 1:
+                del b[start:stop]
+                del l[start:stop]
+            elif operation == 2:
+                cursor = rng.choice(b.cursors)
+                position = b.position(cursor)
+                b.insert_at(cursor, items)
+                l[position:position] = items
+            elif operation == 3:
+                cursor = rng.choice(b.cursors)
+                position = b.position(cursor)
+                b.delete_at(cursor, len(items))
+                del l[max(0, position - len(items)):position]
+            else:
+                b.move_cursor(rng.choice(b.cursors), start)
+
+            self.assertEqual(b, l)
+
+        self.assertEqual(sorted(b.position(c) for c in b.cursors),
+                [b.position(c) for c in b.cursors])
+
+class TestPieceTable(unittest.TestCase):
+
+    def test_init_content(self):
+        """Can we init for every typecode with valid initial content?"""
+
+        for typecode in VALID_CONTENT:
+            b = piecetable(typecode, VALID_CONTENT[typecode])
+            self.assertEqual(b, VALID_CONTENT[typecode])
+
+    def test_original_unchanged(self):
+        """Do edits leave the initial content untouched?"""
+
+        content = array.array("i", range(10))
+        b = piecetable("i", content)
+
+        b[2:5] = [-1]
+        del b[0]
+        b.append(10)
+
+        self.assertEqual(content, array.array("i", range(10)))
+        self.assertEqual(b, [1, -1] + range(5, 10) + [10])
+
+    def test_typing(self):
+        """Does inserting one item after another in the middle work?"""
+
+        b = piecetable("c", "hello world")
+        for i, c in enumerate(", there"):
+            b.insert(5 + i, c)
+
+        self.assertEqual(b, "hello, there world")
+
+    def test_sequence_interface(self):
+        """Does the sequence interface see the content across all pieces?"""
+
+        b = piecetable("c", "hello world")
+        b[5:5] = ","
+        b.extend("!")
+
+        self.assertEqual(len(b), 13)
+        self.assertEqual(b[4], "o")
+        self.assertEqual(b[-1], "!")
+        self.assertEqual(b[3:9], "lo, wo")
+        self.assertEqual(b[::-3], "!r lh")
+        self.assertEqual(str(b), "hello, world!")
+        self.assertEqual(list(reversed(b)), list("!dlrow ,olleh"))
+        self.assertTrue(", w" in b)
+        self.assertEqual(b.count("o"), 2)
+        self.assertEqual(b.index("w"), 7)
+        self.assertEqual(b.pop(), "!")
+        self.assertEqual(b * 2, "hello, worldhello, world")
+
+    def test_context_manager(self):
+        """Are changes made through the context manager kept?"""
+
+        b = piecetable("i", range(5))
+        with b as raw:
+            raw.extend(range(5, 10))
+
+        self.assertEqual(b, range(10))
+
+    def test_context_manager_changes_only(self):
+        """Is only the changed part of the content replaced on exit?"""
+
+        replaced = []
+        class recording(piecetable):
+            def _replace(self, start, stop, items):
+                replaced.append((start, stop, items.tolist()))
+                piecetable._replace(self, start, stop, items)
+
+        b = recording("i", range(10))
+        with b:
+            pass
+        self.assertEqual(replaced, [])
+
+        with b as raw:
+            raw[4] = 40
+            raw[6] = 60
+        self.assertEqual(replaced, [(4, 7, [40, 5, 60])])
+        self.assertEqual(b, [0, 1, 2, 3, 40, 5, 60, 7, 8, 9])
+
+        del replaced[:]
+        with b as raw:
+            del raw[8:]
+            raw.insert(0, -1)
+        self.assertEqual(replaced,
+                [(0, 10, [-1, 0, 1, 2, 3, 40, 5, 60, 7])])
+
+    def test_apply_edits(self):
+        """Does applying a batch of edits work as it does for gapbuffer?"""
+
+        b = piecetable("c", "the quick brown fox")
+        b.apply_edits([(16, 19, "dog"), (0, 3, "a"), (4, 10, "")])
+
+        self.assertEqual(b, "a brown dog")
+
+    def test_edit_congruency(self):
+        """Do random edits behave like they do on a list?"""
+
+        import random
+        rng = random.Random(0)
+
+        b = piecetable("i", range(20))
+        l = range(20)
+
+        for i in xrange(500):
+            start = rng.randint(0, len(l))
+            stop = rng.randint(start, len(l))
+            items = [rng.randint(0, 9) for j in xrange(rng.randint(0, 4))]
+
+            if rng.randint(0, 1):
+                b[start:stop] = items
+                l[start:stop] = items
+            else:
+                del b[start:stop]
+                del l[start:stop]
+
+            self.assertEqual(b, l)
+
+    def test_search_in_chunks(self):
+        """Are searches done a chunk at a time, finding matches between them?"""
+
+        size = gapbuffer.SEARCH_CHUNK_SIZE
+        content = ("x" * (size - 2) + "abcd") * 3 + "ab"
+
+        copied = []
+        class recording(piecetable):
+            def _copy(self, start, stop):
+                copied.append(stop - start)
+                return piecetable._copy(self, start, stop)
+
+        b = recording("c", content)
+
+        self.assertEqual(b.find("abcd"), content.find("abcd"))
+        self.assertEqual(b.find("abcd", size), content.find("abcd", size))
+        self.assertEqual(b.rfind("abcd"), content.rfind("abcd"))
+        self.assertEqual(b.rfind("ab"), content.rfind("ab"))
+        self.assertEqual(b.count("abcd"), 3)
+        self.assertTrue("dxx" in b)
+        self.assertFalse("dabc" in b)
+        self.assertEqual(list(b.finditer("b+c")),
+                [(m.start(), m.end()) for m in re.finditer("b+c", content)])
+        self.assertEqual(b.index("d"), content.index("d"))
+
+        # nothing copied much more than a chunk of the content
+        self.assertTrue(max(copied) <= size + 2 * gapbuffer.SEARCH_WINDOW)
+
+    def test_count_copies_once(self):
+        """Do scans for many matches copy each chunk of content only once?"""
+
+        content = u"xe" * gapbuffer.SEARCH_CHUNK_SIZE
+
+        copied = []
+        class recording(piecetable):
+            def _copy(self, start, stop):
+                copied.append(stop - start)
+                return piecetable._copy(self, start, stop)
+
+        b = recording("u", content)
+
+        self.assertEqual(b.count(u"e"), len(content) // 2)
+        self.assertTrue(sum(copied) < 2 * len(content))
+
+        # and searches that stop early only copy the chunks they reach
+        for search in [lambda: b.find(u"e"), lambda: next(b.finditer(u"x"))]:
+            del copied[:]
+            search()
+            self.assertTrue(sum(copied) <=
+                    gapbuffer.SEARCH_CHUNK_SIZE + 2 * gapbuffer.SEARCH_WINDOW)
+
+class TestMappedPieceTable(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, content):
+        with open(self.path, "wb") as f:
+            f.write(content)
+
+    def test_frommap_path(self):
+        """Does mapping a file by path give its content?"""
+
+        self.write("hello\nworld\n")
+        b = piecetable.frommap("c", self.path)
+
+        self.assertEqual(b, "hello\nworld\n")
+        self.assertEqual(b[3], "l")
+        self.assertEqual(b[2:8], "llo\nwo")
+
+    def test_frommap_file(self):
+        """Does mapping an open file give its content?"""
+
+        self.write(array.array("i", range(10)).tostring())
+        with open(self.path, "rb") as f:
+            b = piecetable.frommap("i", f)
+
+        self.assertEqual(b, range(10))
+        self.assertEqual(b[::-3], [9, 6, 3, 0])
+
+    def test_frommap_edit(self):
+        """Do edits leave the mapped file untouched?"""
+
+        self.write("hello world")
+        b = piecetable.frommap("c", self.path)
+
+        b[5:5] = ","
+        del b[-1]
+
+        self.assertEqual(b, "hello, worl")
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), "hello world")
+
+    def test_frommap_empty(self):
+        """Does mapping an empty file give an empty buffer?"""
+
+        self.assertEqual(len(piecetable.frommap("c", self.path)), 0)
+
+    def test_frommap_partial_item(self):
+        """Does mapping a file with a partial item raise ValueError?"""
+
+        self.write("abcde")
+        with self.assertRaises(ValueError):
+            piecetable.frommap("i", self.path)
+
+class TestUtf8GapBuffer(unittest.TestCase):
+    def test_content(self):
+        """Does a utf8gapbuffer hold its content as UTF-8?"""
+
+        b = utf8gapbuffer("u", u"caf\xe9 \u4e2d\U0001f600")
+
+        self.assertEqual(len(b), 7)
+        self.assertEqual(b, u"caf\xe9 \u4e2d\U0001f600")
+        self.assertEqual(b.encoded_size, 13)
+        self.assertEqual(unicode(b), u"caf\xe9 \u4e2d\U0001f600")
+
+    def test_typecode(self):
+        """Does a typecode other than 'u' raise ValueError?"""
+
+        with self.assertRaises(ValueError):
+            utf8gapbuffer("c", "abc")
+
+    def test_indexing(self):
+        """Are items and slices indexed by character?"""
+
+        b = utf8gapbuffer("u", u"\xe9t\xe9 \u4e2d")
+
+        self.assertEqual(b[2], u"\xe9")
+        self.assertEqual(b[-1], u"\u4e2d")
+        self.assertEqual(b[1:4], u"t\xe9 ")
+        self.assertEqual(b[::2], u"\xe9\xe9\u4e2d")
+        self.assertTrue(isinstance(b[1:4], utf8gapbuffer))
+
+        with self.assertRaises(IndexError):
+            b[5]
+
+    def test_edits(self):
+        """Do edits replace whole characters?"""
+
+        b = utf8gapbuffer("u", u"na\xefve caf\xe9", gap_size=2)
+
+        b[2] = u"i"
+        b.insert(0, u"\u4e2d")
+        b[7:] = u"\U0001f600"
+        del b[1:3]
+        b.extend(u"!")
+
+        self.assertEqual(b, u"\u4e2dive \U0001f600!")
+        self.assertEqual(b.encoded_size, 12)
+
+    def test_offsets(self):
+        """Are indices translated to and from UTF-8 offsets?"""
+
+        content = u"\xe9\u4e2da" * 1000
+        b = utf8gapbuffer("u", content, gap_size=5)
+        b.insert(1500, u"\U0001f600")
+
+        self.assertEqual(b.byte_offset(0), 0)
+        self.assertEqual(b.byte_offset(3), 6)
+        self.assertEqual(b.byte_offset(1501), 3004)
+        self.assertEqual(b.byte_offset(len(b)), 6004)
+        self.assertEqual(b.char_index(3004), 1501)
+        self.assertEqual(b.char_index(6004), len(b))
+
+        with self.assertRaises(IndexError):
+            b.byte_offset(len(b) + 1)
+        with self.assertRaises(IndexError):
+            b.char_index(-1)
+
+    def test_search(self):
+        """Do searches give character indices?"""
+
+        b = utf8gapbuffer("u", u"\xe9t\xe9, \xe9t\xe9!")
+        b.insert(4, u"\u4e2d")
+
+        self.assertEqual(b.find(u"t\xe9"), 1)
+        self.assertEqual(b.find(u"t\xe9", 2), 7)
+        self.assertEqual(b.rfind(u"\xe9"), 8)
+        self.assertEqual(b.count(u"\xe9t"), 2)
+        self.assertEqual(b.count(""), len(b) + 1)
+        self.assertTrue(u"\u4e2d \xe9" in b)
+        self.assertFalse(u"\xe9\xe9" in b)
+        self.assertEqual(b.search(u"[!,]"), (3, 4))
+        self.assertEqual(b.find(u"", len(b) + 1), -1)
+        self.assertEqual(b.find(u"", 4, 2), -1)
+
+    def test_create(self):
+        """Can create() make a utf8gapbuffer?"""
+
+        b = create("u", u"abc", backend="utf8gapbuffer")
+        self.assertTrue(isinstance(b, utf8gapbuffer))
+
+class TestLoadSave(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        """Does saving and then loading a buffer give the same content?"""
+
+        for typecode, content in [("c", "hello\nworld"), ("i", range(100)),
+                ("d", [0.5, -2.0]), ("u", u"h\xe9llo")]:
+            b = gapbuffer(typecode, content, gap_size=3)
+            b.insert(2, content[0])
+
+            with open(self.path, "wb") as f:
+                b.save(f)
+            with open(self.path, "rb") as f:
+                loaded = gapbuffer(typecode)
+                loaded.load(f, chunk_size=7)
+
+            self.assertEqual(loaded, b)
+
+    def test_save_raw(self):
+        """Does saving write the same bytes as array.tofile()?"""
+
+        b = gapbuffer("i", range(10))
+        del b[3]
+
+        with open(self.path, "wb") as f:
+            b.save(f)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), array.array("i", b).tostring())
+
+    def test_load_appends(self):
+        """Does loading append to the existing content?"""
+
+        with open(self.path, "wb") as f:
+            f.write(" world")
+
+        b = gapbuffer("c", "hello")
+        b[0] = "j"
+        with open(self.path, "rb") as f:
+            b.load(f)
+
+        self.assertEqual(b, "jello world")
+        self.assertEqual(b.line_count(), 1)
+
+    def test_load_without_readinto(self):
+        """Can file objects without readinto() be loaded from?"""
+
+        import StringIO
+
+        b = gapbuffer("i")
+        b.load(StringIO.StringIO(array.array("i", range(10)).tostring()),
+                chunk_size=3)
+
+        self.assertEqual(b, range(10))
+
+    def test_load_partial_item(self):
+        """Does loading a file with a partial item raise a ValueError?"""
+
+        with open(self.path, "wb") as f:
+            f.write("abcde")
+
+        with open(self.path, "rb") as f:
+            with self.assertRaises(ValueError):
+                gapbuffer("i").load(f)
+
+    def test_load_undo(self):
+        """Is loading undone as a single edit?"""
+
+        with open(self.path, "wb") as f:
+            f.write("hello world")
+
+        b = gapbuffer("c", "> ", journal=editjournal())
+        with open(self.path, "rb") as f:
+            b.load(f, chunk_size=2)
+
+        self.assertEqual(b, "> hello world")
+        b.undo()
+        self.assertEqual(b, "> ")
+
+class TestCreate(unittest.TestCase):
+
+    def test_backends(self):
+        """Does create() make a buffer with each backend?"""
+
+        for backend in ["gapbuffer", "multigapbuffer", "piecetable"]:
+            b = create("c", "abc", backend=backend)
+
+            self.assertEqual(b.__class__.__name__, backend)
+            self.assertEqual(b, "abc")
+
+    def test_backends_compare(self):
+        """Do buffers of different backends compare with each other?"""
+
+        backends = ["gapbuffer", "multigapbuffer", "piecetable",
+                "utf8gapbuffer"]
+        for first in backends:
+            for second in backends:
+                a = create("u", u"abc", backend=first)
+                b = create("u", u"abd", backend=second)
+
+                self.assertEqual(a, create("u", u"abc", backend=second))
+                self.assertTrue(a < b)
+                self.assertTrue(b >= a)
+
+    def test_default_backend(self):
+        """Does create() make a gapbuffer by default?"""
+        self.assertTrue(isinstance(create("i", [1, 2]), gapbuffer))
+
+    def test_backend_arguments(self):
+        """Are extra arguments passed to the backend?"""
+
+        b = create("i", range(5), backend="multigapbuffer", cursors=[2])
+        self.assertEqual([b.position(c) for c in b.cursors], [2])
+
+    def test_unknown_backend(self):
+        """Does an unknown backend raise ValueError?"""
+
+        with self.assertRaises(ValueError):
+            create("i", backend="ropebuffer")
+
+if __name__ == "__main__":
+    import sys
+
+    # generate coverage data if coverage module is available
+    try:
+        from coverage import coverage
+        cov = coverage(config_file=False, branch=True, omit=["test_*.py"])
+        cov.start()
+    except ImportError:
+        cov = None
+
+    # imported here so coverage can catch the function/class definitions
+    from gapbuffer import (gapbuffer, growthpolicy, editjournal, bufferstats,
+            bufferprofiler, multigapbuffer, piecetable, snapshot, utf8gapbuffer,
+            create)
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([
+        loader.loadTestsFromTestCase(TestGapBuffer),
+        loader.loadTestsFromTestCase(TestNumeric),
+        loader.loadTestsFromTestCase(TestBufferStats),
+        loader.loadTestsFromTestCase(TestBufferProfiler),
+        loader.loadTestsFromTestCase(TestEditJournal),
+        loader.loadTestsFromTestCase(TestSnapshot),
+        loader.loadTestsFromTestCase(TestMarkers),
+        loader.loadTestsFromTestCase(TestNgramIndex),
+        loader.loadTestsFromTestCase(TestMultiGapBuffer),
+        loader.loadTestsFromTestCase(TestPieceTable),
+        loader.loadTestsFromTestCase(TestMappedPieceTable),
+        loader.loadTestsFromTestCase(TestUtf8GapBuffer),
+        loader.loadTestsFromTestCase(TestLoadSave),
+        loader.loadTestsFromTestCase(TestCreate),
+    ])
     unittest.TextTestRunner(stream=sys.stdout, verbosity=2).run(suite)
 
     # end coverage and generate a report if coverage was loaded